@@ -0,0 +1,19 @@
+"""Run from the analysis/ directory: python -m pytest tests"""
+import pandas as pd
+
+from utils.dedup import deduplicate, normalize_text
+
+
+def test_normalize_text_keeps_non_latin_scripts():
+    texts = pd.Series(["Pas de spam, merci !", "禁止发布广告。", "Без рекламы!", "No_spam: https://x.org"])
+    assert normalize_text(texts).tolist() == ["pas de spam merci", "禁止发布广告", "без рекламы", "no spam"]
+
+
+def test_deduplicate_non_latin_and_empty_rules():
+    rules = pd.Series(["禁止发布广告", "禁止发布广告。", "请尊重他人", "🚫", "!!!", "No spam", "no spam."])
+    ids = deduplicate(rules)
+    assert ids["exact_id"].tolist()[:3] == [0, 0, 1]
+    # Texts without letters nor digits are not duplicates of each other
+    assert ids["exact_id"].nunique() == 5
+    assert ids["canonical_id"].iloc[3] != ids["canonical_id"].iloc[4]
+    assert ids["canonical_id"].iloc[5] == ids["canonical_id"].iloc[6]
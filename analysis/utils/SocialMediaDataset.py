@@ -1,11 +1,62 @@
 import pandas as pd
 import ast
 import re
+import time
+
+from .aggregation import ServerSegments, aggregate_rules
+from .federation import BlockGraph
+from .memory import compare_memory, memory_usage, optimize_frame
+from .pipeline import StageCache, hash_file, hash_items, pipeline_stage, plan
+from .profiling import PROFILER
+from .strictness import lexicon_hits, load_lexicon, strictness_scores
+from .server_bootstrap import bootstrap_servers
+from .trends import parse_trend_list, trend_aggregates, trends_table
 
 #from langdetect import detect
-from transformers.pipelines import pipeline
-lang_recognition = pipeline("text-classification", model="spolivin/lang-recogn-model")
-        
+
+LANG_MODEL = "spolivin/lang-recogn-model"
+# Options of the CPU backends that do not change the predictions, left out of the stage keys
+_LANG_RUNTIME_OPTIONS = ("num_threads", "batch_size", "bucket_size", "onnx_dir")
+
+# The model (and transformers, which takes seconds to import) is only loaded on first use
+_lang_recognition = None
+_lang_backend = {"backend": "pipeline", "model_name": LANG_MODEL}
+
+def get_lang_recognition():
+    global _lang_recognition
+    if _lang_recognition is None:
+        from transformers.pipelines import pipeline
+        _lang_recognition = pipeline("text-classification", model=LANG_MODEL)
+    return _lang_recognition
+
+
+def set_lang_backend(backend: str = "pipeline", **kwargs) -> None:
+    """Language recognition used by detect_english(): the transformers pipeline ("pipeline") or a
+    CPU-optimized backend ("int8", "onnx", see utils.lang_backend). The backend and model are part
+    of the key of predicts_english_rules(), so the cached predictions of another backend are not reused."""
+    global _lang_recognition, _lang_backend
+    from .lang_backend import load_recognizer
+    _lang_recognition = load_recognizer(backend, **kwargs)
+    _lang_backend = {"backend": backend, "model_name": kwargs.get("model_name", LANG_MODEL),
+                     **{name: value for name, value in kwargs.items()
+                        if name not in _LANG_RUNTIME_OPTIONS and name != "model_name"}}
+
+
+def lang_backend_key(dataset=None) -> list:
+    """Identity of the language recognition in use (backend, model and options), for the stage keys."""
+    return sorted(_lang_backend.items())
+
+
+def _lexicon_key(dataset=None) -> dict:
+    return load_lexicon()
+
+
+def __getattr__(name):
+    # Backward compatibility with the former module level `lang_recognition` pipeline
+    if name == "lang_recognition":
+        return get_lang_recognition()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 
 class SocialMediaDataset:
@@ -17,21 +68,42 @@ class SocialMediaDataset:
         col_equiv_mas_to_red (dict): Dictionary mapping Mastodon column names to Reddit equivalents.
         col_equiv_red_to_mas (dict): Dictionary mapping Reddit column names to Mastodon equivalents.
         col_in_common (list): List of columns that are common between Mastodon and Reddit.
+        stage_cache (StageCache): On-disk cache of the pipeline stage outputs, None if disabled.
+        state_keys (dict): Key of the stage that produced each attribute (see pipeline.Stage).
     """
+
+    # Stages run by run_pipeline(), in order
+    pipeline_stages = ["clean", 
+                       "take_english_servers_only", 
+                       "extract_rules", 
+                       "deduplicate_rules",
+                       "predicts_english_rules", 
+                       "standardize_rules",
+                       "compute_strictness"]
+
+    # Number of texts per call to the language recognition model, None for one text at a time
+    lang_batch_size = None
     
     ######################################################
     #################### Data loading ####################
     ######################################################
     
     @staticmethod
-    def load_instance(data_path: str, cols_to_keep: list) -> pd.DataFrame:
-        df = pd.read_csv(data_path, usecols=cols_to_keep)
+    def load_instance(data_path: str, cols_to_keep: list, server_range: tuple = None) -> pd.DataFrame:
+        """Servers of the raw CSV, all of them or the rows [start, stop) of server_range (a shard,
+        see utils.shards), whose server_id stays their row number in the whole file."""
+        if server_range is None:
+            df = pd.read_csv(data_path, usecols=cols_to_keep)
+        else:
+            start, stop = server_range
+            df = pd.read_csv(data_path, usecols=cols_to_keep, skiprows=range(1, start + 1), nrows=stop - start)
+            df.index = pd.RangeIndex(start, start + len(df))
         df["server_id"] = df.index
         return df
     
-    def __init__(self, data_path: str, cols_to_keep: list) -> None:
+    def __init__(self, data_path: str, cols_to_keep: list, cache_dir: str = None, server_range: tuple = None) -> None:
 
-        self.df = self.load_instance(data_path, cols_to_keep)
+        self.df = self.load_instance(data_path, cols_to_keep, server_range)
         self.col_equiv_mas_and_red = {"domain": "domain", 
                                     "title": "title", 
                                     "description": "description",
@@ -48,6 +120,35 @@ class SocialMediaDataset:
         self.df_en = None
         self.rules_df = None
         self.std_rules_df = None
+        # Rules of every server once moved out of self.df, and the memory usage before (see optimize_memory())
+        self.rules_table = None
+        self.memory_baseline = None
+        # Silhouette and inertia of each number of clusters tried by cluster_servers()
+        self.cluster_selection = None
+        # Estimated seconds saved by running a stage on the canonical rules only (see deduplicate_rules())
+        self.dedup_time_saved = {}
+
+        # Memoization of the pipeline stages, keyed by raw data hash, stage parameters and code version
+        self.stage_cache = StageCache(cache_dir) if cache_dir is not None else None
+        self.state_keys = {}
+        if self.stage_cache is not None:
+            shard = () if server_range is None else (tuple(server_range),)
+            self.state_keys["df"] = hash_items(hash_file(data_path), sorted(cols_to_keep), *shard)
+
+    
+    #####################################################
+    ################## Pipeline stages ##################
+    #####################################################
+
+    def run_pipeline(self, stages: list = None) -> None:
+        """Runs the given stages (all of self.pipeline_stages by default) in order.
+        With a cache directory, only the stages invalidated since the last run are executed."""
+        for stage_name in stages or self.pipeline_stages:
+            getattr(self, stage_name)()
+
+    def pipeline_plan(self, stages: list = None) -> pd.DataFrame:
+        """Shows which stages of run_pipeline(stages) would be loaded from cache or recomputed."""
+        return plan(self, stages or self.pipeline_stages)
 
     
     
@@ -56,6 +157,8 @@ class SocialMediaDataset:
     #####################################################
     
 
+    @pipeline_stage(inputs=("df", "cleaned"), outputs=("df", "cleaned"),
+                    depends_on=("_format_col_names", "_clean_*", "_remove_empty", BlockGraph, parse_trend_list))
     def clean(self) -> None:
         if not self.cleaned:
             self._format_col_names()
@@ -65,10 +168,46 @@ class SocialMediaDataset:
                 if hasattr(self, method_name):
                     print(f"Cleaning column: {column}")
                     method = getattr(self, method_name)
-                    self.df[column] = method()
+                    self.df[column] = PROFILER.call(method_name, method, rows_in=len(self.df))
             self.cleaned = True
         print("Data is all clean and shiny! ✨🫧")
         
+    @pipeline_stage(inputs=("df",), outputs=("df", "rules_table", "memory_baseline"), returns="df",
+                    depends_on=("_explode_rules", optimize_frame, ".memory:COUNT_COLUMNS"))
+    def optimize_memory(self) -> pd.DataFrame:
+        """Memory-optimized layout of the cleaned data (see memory.optimize_frame()): the nested
+        rules move to self.rules_table (one row per rule, linked by server_id), languages and other
+        low-cardinality strings become categoricals, the remaining strings pyarrow strings, small
+        integers are downcast to signed types (int32 at least for the engagement counts) and flags
+        stored as booleans. Not part of pipeline_stages, run it after clean(),
+        e.g. run_pipeline(["clean", "optimize_memory", ...]). See memory_report()."""
+        if not self.cleaned:
+            raise ValueError("You must run clean() before optimizing the memory usage.")
+        if "rules" not in self.df.columns:
+            return self.df
+        self.memory_baseline = memory_usage(self.df)
+        self.rules_table = optimize_frame(self._explode_rules(self.df), exclude=())
+        self.df = optimize_frame(self.df.drop(columns="rules"))
+        report = self.memory_report()
+        total = report.iloc[-1]
+        print(f"Memory usage: {total['bytes_before'] / 2**20:.1f} MB -> {total['bytes_after'] / 2**20:.1f} MB "
+              f"({100 * total['ratio']:.0f}%) 🪶")
+        return self.df
+
+    def memory_report(self) -> pd.DataFrame:
+        """Per column memory usage of self.df before and after optimize_memory(), the rules table included."""
+        if self.memory_baseline is None:
+            raise ValueError("You must run optimize_memory() before reporting the memory usage.")
+        return compare_memory(self.memory_baseline, memory_usage(self.df), {"rules_table": self.rules_table})
+
+    def _rules_of(self, servers: pd.DataFrame) -> pd.DataFrame:
+        """One row per rule of the given servers, from their nested rules or from self.rules_table."""
+        if "rules" in servers.columns:
+            return self._explode_rules(servers)
+        if self.rules_table is None:
+            raise ValueError("The servers have no rules column and optimize_memory() was not run.")
+        return self.rules_table[self.rules_table["server_id"].isin(servers["server_id"])].reset_index(drop=True)
+
     def _format_col_names(self) -> None:
         self.df.rename(columns=self.col_equiv_mas_and_red, inplace=True)
        
@@ -102,15 +241,17 @@ class SocialMediaDataset:
     
     def _standardize_text(self, df_column, split = True):
         df_column = df_column.apply(lambda x: x.strip() if isinstance(x, str) else x)
-        df_column = df_column.str.lower()
-        df_column = df_column.apply(self.remove_urls)
-        df_column = df_column.str.replace(r"[^a-zA-Z0-9\s]", " ", regex=True)
+        df_column = df_column.str.casefold()
+        df_column = df_column.apply(self.remove_urls).astype(object)
+        # Letters and digits of every script (the regexes of pyarrow strings only know ASCII \w)
+        df_column = df_column.str.replace(r"[^\w\s]|_", " ", regex=True)
         df_column = df_column.str.replace(r"\s+", " ", regex=True).str.strip()
         if split:
             df_column = df_column.str.split(" ")
             df_column = df_column.apply(self._remove_empty)
         return df_column  
     
+    @pipeline_stage(inputs=("df",), outputs=("df_en",), returns="df_en", depends_on=("is_english_server",))
     def take_english_servers_only(self) -> pd.DataFrame:
         self.df_en = self.df[self.df["languages"].apply(self.is_english_server)]
         return self.df_en
@@ -122,48 +263,167 @@ class SocialMediaDataset:
     
     @staticmethod
     def detect_english(text):
+        lang_recognition = get_lang_recognition()
         try:
             
             return lang_recognition(text)[0]["label"] == 'English'
         except:
             return False 
+
+    def detect_english_many(self, texts: pd.Series) -> pd.Series:
+        """detect_english() on every text, by batches of self.lang_batch_size texts when set.
+        A batch that fails is retried one text at a time, so the results are the same."""
+        if not self.lang_batch_size:
+            return texts.apply(self.detect_english)
+        lang_recognition = get_lang_recognition()
+        is_text = texts.apply(lambda text: isinstance(text, str)).to_numpy()
+        valid = texts[is_text].tolist()
+        predictions = []
+        for start in range(0, len(valid), self.lang_batch_size):
+            batch = valid[start:start + self.lang_batch_size]
+            try:
+                predictions += [result["label"] == 'English' for result in lang_recognition(batch, batch_size=len(batch))]
+            except Exception:
+                predictions += [self.detect_english(text) for text in batch]
+        english = pd.Series(False, index=texts.index)
+        english[is_text] = predictions
+        return english
     
     ###################################################
     ########### Rules strictness evlauation ###########
     ###################################################
     
-    def compute_strictness(text): # TODO make it a method
-        """ Computes the strictness score of a rule based on the modal words it contains.
-        The metric is defined as follows:
-            S = number of strict words that the rule contains
-            L = number of lenient words that the rule contains
-            T = S + T
-                               
-            Strictness score = 0 if T = 0
-                               S / T otherwise
-            
-            Strictness score is between 0 and 1, equal to 0 if no imperative words are present, 
-            and equal to one if all the imperative words that the rule contains are strict words."""
-        lexicon = pd.read_json("strictness_lexicon.json")
-        def S(text):
-            strict_words = lexicon["strict"].tolist()
-            count_instances = [text.count(word) for word in strict_words]
-            return count_instances.sum()
-        def L(text):
-            lenient_words = lexicon["lenient"].tolist()
-            count_instances = [text.count(word) for word in lenient_words]
-            return count_instances.sum()
-        s, l = S(text), L(text)
-        t = s + l
-        return s / t if t != 0 else 0
-        
-        # TODO: define server level strictness: mean value of the strictness?
-        # diversity of rules?
+    ###################################################
+    ############### Rules deduplication ###############
+    ###################################################
+
+    @pipeline_stage(inputs=("rules_df",), outputs=("rules_df",), returns="rules_df",
+                    depends_on=("rule_documents", "_standardize_text", "remove_urls", ".dedup:deduplicate"))
+    def deduplicate_rules(self, threshold: float = 0.8) -> pd.DataFrame:
+        """Gives each rule an exact_id (same normalized text) and a canonical_id (near duplicates,
+        see dedup.deduplicate()). Once deduplicated, language detection and topic assignment
+        only run on the first rule of each canonical_id and broadcast the result to the others."""
+        if self.rules_df is None:
+            raise ValueError("You must run extract_rules() before deduplicating the rules.")
+        from .dedup import dedup_report, deduplicate  # scipy.sparse is only needed here
+        ids = deduplicate(self.rule_documents(), threshold=threshold)
+        self.rules_df["exact_id"] = ids["exact_id"]
+        self.rules_df["canonical_id"] = ids["canonical_id"]
+        report = dedup_report(self.rules_df)
+        print(f"{report['n_rules']} rules, {report['n_exact']} distinct texts, {report['n_canonical']} canonical rules "
+              f"({100 * report['dedup_ratio']:.0f}% duplicates) 🧬")
+        return self.rules_df
+
+    def _map_canonical(self, func, documents: pd.Series, stage: str, weighted: bool = False):
+        """func(documents), computed on one rule per canonical_id when the rules are deduplicated
+        and broadcast to the near duplicates. With weighted=True, func(documents, weights) also gets
+        the number of rules each document stands for (None when the rules are not deduplicated)."""
+        if "canonical_id" not in self.rules_df.columns:
+            return func(documents, None) if weighted else func(documents)
+        canonical_id = self.rules_df["canonical_id"].to_numpy()
+        first = ~pd.Series(canonical_id).duplicated().to_numpy()
+        start = time.perf_counter()
+        if weighted:
+            group_sizes = pd.Series(canonical_id).value_counts()
+            result = func(documents[first], group_sizes.reindex(canonical_id[first]).to_numpy())
+        else:
+            result = func(documents[first])
+        elapsed = time.perf_counter() - start
+        result = result.iloc[pd.Index(canonical_id[first]).get_indexer(canonical_id)]
+        result.index = documents.index
+        self.dedup_time_saved[stage] = elapsed * (len(documents) / max(first.sum(), 1) - 1)
+        print(f"Ran {stage} on {first.sum()} canonical rules instead of {len(documents)}, "
+              f"saving ~{self.dedup_time_saved[stage]:.1f}s ⏱️")
+        return result
+
+    def rule_documents(self) -> pd.Series:
+        """Text on which the strictness of each rule is measured (the raw rules, as in the notebook)."""
+        return self.rules_df["rules"]
+
+    @pipeline_stage(inputs=("rules_df",), outputs=("rules_df",), returns="rules_df",
+                    depends_on=("rule_documents", "_standardize_text", "remove_urls", lexicon_hits, strictness_scores),
+                    context=_lexicon_key)
+    def compute_strictness(self) -> pd.DataFrame:
+        """ Computes the strictness score of each rule based on the modal words it contains
+        (see strictness.strictness_scores()), along with the number of strict and lenient
+        words found in the rule."""
+        if self.rules_df is None:
+            raise ValueError("You must run extract_rules() before computing the strictness.")
+        hits = lexicon_hits(self.rule_documents())
+        self.rules_df["strict_hits"] = hits["strict_hits"]
+        self.rules_df["lenient_hits"] = hits["lenient_hits"]
+        self.rules_df["strictness"] = strictness_scores(hits["strict_hits"], hits["lenient_hits"])
+        return self.rules_df
+
+    def aggregate_servers(self, topic_col: str = "Topic") -> pd.DataFrame:
+        """Server-level statistics of the rules (strictness, rule count, English rate, lexicon hits,
+        topic distribution), computed in one pass. See aggregation.aggregate_rules()."""
+        if self.rules_df is None:
+            raise ValueError("You must run extract_rules() before aggregating the rules.")
+        with PROFILER.stage(f"{type(self).__name__}.aggregate_servers", rows_in=len(self.rules_df)) as record:
+            server_table = aggregate_rules(self.rules_df, topic_col=topic_col)
+            record["rows_out"] = len(server_table)
+        return server_table
+
+    def bootstrap_servers(self, column: str = "strictness", statistic: str = "sum", **kwargs) -> pd.DataFrame:
+        """Bootstrap confidence interval of a server-level statistic of a rule metric (by default the
+        server strictness, sum of the strictness of its rules), for all servers at once. See
+        server_bootstrap.bootstrap_servers() for the keyword arguments."""
+        if self.rules_df is None or column not in self.rules_df.columns:
+            raise ValueError(f"The rules have no {column!r} column (see compute_strictness()).")
+        with PROFILER.stage(f"{type(self).__name__}.bootstrap_servers", rows_in=len(self.rules_df)) as record:
+            intervals = bootstrap_servers(self.rules_df[column], self.rules_df["server_id"], statistic, **kwargs)
+            record["rows_out"] = len(intervals)
+        return intervals
+
+    def cluster_servers(self, topic_col: str = "Topic", **kwargs) -> pd.DataFrame:
+        """Clusters the servers on the topic distribution of their rules with mini-batch k-means,
+        choosing k by silhouette when it is not given. See server_clustering.cluster_servers()
+        for the keyword arguments. Returns server_id, cluster and n_rules_with_topic."""
+        if self.rules_df is None or topic_col not in self.rules_df.columns:
+            raise ValueError("You must run assign_topics() before clustering the servers.")
+        from .server_clustering import cluster_servers  # scipy.sparse and sklearn are only needed here
+        with PROFILER.stage(f"{type(self).__name__}.cluster_servers", rows_in=len(self.rules_df)) as record:
+            clusters, self.cluster_selection = cluster_servers(self.rules_df, topic_col=topic_col, **kwargs)
+            record["rows_out"] = len(clusters)
+        return clusters
+
+    def assign_topics(self, topic_model, update: bool = True) -> pd.Series:
+        """Topic of each rule according to a topic_model.IncrementalTopicModel, stored in
+        self.rules_df["Topic"] (see aggregate_servers()). With update=True, the rules are also
+        added to the model online, which may trigger a refit; once the rules are deduplicated, each
+        canonical rule is added with the number of its near duplicates as weight, so the topic
+        sizes and term counts are those of all the rules."""
+        if self.rules_df is None:
+            raise ValueError("You must run extract_rules() before assigning topics.")
+        if update:
+            topics = self._map_canonical(
+                lambda docs, weights: pd.Series(topic_model.partial_fit(docs.tolist(), weights), index=docs.index),
+                self.rule_documents(), stage="assign_topics", weighted=True)
+        else:
+            topics = self._map_canonical(lambda docs: pd.Series(topic_model.transform(docs.tolist()), index=docs.index),
+                                         self.rule_documents(), stage="assign_topics")
+        self.rules_df["Topic"] = topics
+        return self.rules_df["Topic"]
 
 
 
 class MastodonDataset(SocialMediaDataset):
-    """Class for handling Mastodon dataset, inheriting from SocialMediaDataset."""
+    """Class for handling Mastodon dataset, inheriting from SocialMediaDataset.
+    Attributes:
+        block_graph (BlockGraph): Federation graph parsed from the blacklists when cleaning, None before.
+        trends_df (pd.DataFrame): Trending tags of the servers, one row per server and rank (see extract_trends()).
+    """
+    pipeline_stages = ["clean", 
+                       "take_english_servers_only", 
+                       "extract_rules", 
+                       "deduplicate_rules",
+                       "predicts_english_rules", 
+                       "keep_english_rules_only",
+                       "standardize_rules",
+                       "compute_strictness"]
+    extra_stage_outputs = {"clean": ("block_graph",)}
+
     def __init__(self, 
                  mast_path="../dataset/Mastodon/mastodon_instance_info.csv",
                  cols_to_keep_mastodon = ["domain", # common with reddit
@@ -177,7 +437,9 @@ class MastodonDataset(SocialMediaDataset):
                                           "total_posts", 
                                           "blacklist", 
                                           "source_url"],
-                 keep_common_col_only = True) -> None:
+                 keep_common_col_only = True,
+                 cache_dir = None,
+                 server_range = None) -> None:
         self.col_in_common = ["domain", 
                         "title", 
                         "description", 
@@ -187,7 +449,9 @@ class MastodonDataset(SocialMediaDataset):
                         "rules"]
         if keep_common_col_only:
             cols_to_keep_mastodon = self.col_in_common
-        super().__init__(mast_path, cols_to_keep_mastodon)
+        super().__init__(mast_path, cols_to_keep_mastodon, cache_dir, server_range)
+        self.block_graph = None
+        self.trends_df = None
         self.col_mast_specific = ["top_5_trends", 
                                   "total_posts", 
                                   "blacklist", 
@@ -219,39 +483,59 @@ class MastodonDataset(SocialMediaDataset):
                 return []
         return self.df["languages"].fillna("[]").apply(parse_list_lang)
  
-    # TODO: test efficiency of this cleaning for top_5_trends   
     def _clean_top_5_trends(self) -> pd.Series:
-        @staticmethod
-        def parse_trends(x):
-            if pd.isna(x):
-                return []
-            try:
-                parsed = ast.literal_eval(x)
-                if isinstance(parsed, list) and all(isinstance(ast.literal_eval(item), int) for item in parsed):
-                    return parsed
-                return []
-            except Exception:
-                return []
-        return self.df["top_5_trends"].apply(parse_trends)
+        # Lists of {"day", "uses", "accounts"} dicts, typed by extract_trends()
+        return self.df["top_5_trends"].apply(parse_trend_list)
 
     def _clean_total_posts(self) -> pd.Series:
         return pd.to_numeric(self.df["total_posts"], errors='coerce').fillna(0).astype(int)
 
     def _clean_blacklist(self) -> pd.Series:
-        # TODO: implement better cleaning for blacklist (here is an example, commented)
-        # Count number of blacklisted items if stored as list-like strings
-        # def safe_count(x):
-        #     try:
-        #         return len(ast.literal_eval(x)) if isinstance(x, str) else 0
-        #     except Exception:
-        #         return 0
-        return self.df['blacklist'].apply(lambda x: len(str(x).split("|")) if x else 0) #.apply(safe_count)
+        # The " | "-joined domains are parsed once into the federation graph, the column keeps
+        # the number of distinct blocked domains (0 for missing or empty blacklists)
+        self.block_graph = BlockGraph.from_blacklists(self.df["domain"], self.df["blacklist"],
+                                                       server_ids=self.df["server_id"])
+        return pd.Series(self.block_graph.out_degree()[self.block_graph.server_nodes], index=self.df.index)
+
+    @pipeline_stage(inputs=("df", "block_graph"), outputs=("df",), returns="df",
+                    depends_on=(".federation_metrics:server_block_metrics",))
+    def add_federation_metrics(self, jaccard_threshold: float = 0.5) -> pd.DataFrame:
+        """Joins the block network metrics of each server (see federation_metrics.server_block_metrics)
+        onto self.df by server_id."""
+        if self.block_graph is None:
+            raise ValueError("You must run clean() with the 'blacklist' column (keep_common_col_only=False) first.")
+        from .federation_metrics import server_block_metrics  # scipy.sparse is only needed here
+        metrics = server_block_metrics(self.block_graph, jaccard_threshold=jaccard_threshold)
+        metrics = metrics.drop(columns=["domain", "blocks_out"])
+        self.df = self.df.drop(columns=[c for c in metrics.columns if c != "server_id" and c in self.df.columns])
+        # A left merge keeps the row order; the index (server_id of the rules) is kept too
+        self.df = self.df.merge(metrics, on="server_id", how="left").set_axis(self.df.index)
+        return self.df
+
+    @pipeline_stage(inputs=("df",), outputs=("trends_df",), returns="trends_df", depends_on=(trends_table,))
+    def extract_trends(self) -> pd.DataFrame:
+        """Long table of the trending tags (server_id, rank, day, uses, accounts), see trends.trends_table()."""
+        if "top_5_trends" not in self.df.columns:
+            raise ValueError("The 'top_5_trends' column is needed (keep_common_col_only=False).")
+        self.trends_df = trends_table(self.df["top_5_trends"], self.df["server_id"])
+        return self.trends_df
+
+    def aggregate_trends(self, reference=None) -> pd.DataFrame:
+        """Per-server trend activity (total uses and accounts, recency...), see trends.trend_aggregates()."""
+        if self.trends_df is None:
+            raise ValueError("You must run extract_trends() before aggregating the trends.")
+        with PROFILER.stage(f"{type(self).__name__}.aggregate_trends", rows_in=len(self.trends_df)) as record:
+            server_table = trend_aggregates(self.trends_df, reference)
+            record["rows_out"] = len(server_table)
+        return server_table
 
     # TODO: implement more precise cleaning for source_url
     def _clean_source_url(self) -> pd.Series:
         return self.df["source_url"].fillna("").astype(str)
 
     def is_english_server(self, lang, en_symbol=["en"]): 
+        if isinstance(lang, str):  # "|"-joined languages of a memory-optimized df
+            lang = lang.split("|") if lang else []
         return lang == en_symbol if isinstance(lang, list) else False
 
 
@@ -259,7 +543,7 @@ class MastodonDataset(SocialMediaDataset):
         """Clean the 'hint' column in the rules DataFrame."""
         if "hint" not in self.rules_df.columns:
             raise ValueError("DataFrame must contain a 'hint' column to clean it.")
-        self.rules_df["hint"] = self.rules_df["hint"].fillna('')
+        self.rules_df["hint"] = self.rules_df["hint"].astype(object).fillna('')
         return self.rules_df["hint"].apply(lambda x: x if isinstance(x, str) else '')
     
 
@@ -267,25 +551,32 @@ class MastodonDataset(SocialMediaDataset):
     ################# Extraction of rules #################
     #######################################################
     
-    def extract_rules(self) -> pd.DataFrame:
-        if self.df_en is None:
-            rules = self.df[['rules']].explode('rules').reset_index(drop=False)
-        else:
-            rules = self.df_en[['rules']].explode('rules').reset_index(drop=False)
+    def _explode_rules(self, servers: pd.DataFrame) -> pd.DataFrame:
+        rules = servers[['rules']].explode('rules').reset_index(drop=False)
         rules = rules.rename(columns={"index": "server_id"}) 
         rules = rules.dropna()
         rules = pd.concat([rules.drop(['rules'], axis=1), rules['rules'].apply(pd.Series)], axis=1)
-        rules = rules.rename(columns={'id': "rule_id"})
-        self.rules_df = rules
+        return rules.rename(columns={'id': "rule_id"})
+
+    @pipeline_stage(inputs=("df", "df_en", "rules_table"), outputs=("rules_df",), returns="rules_df",
+                    depends_on=("_rules_of", "_explode_rules", "_clean_hint"))
+    def extract_rules(self) -> pd.DataFrame:
+        self.rules_df = self._rules_of(self.df if self.df_en is None else self.df_en)
         self.rules_df["hint"] = self._clean_hint()
         return self.rules_df  
 
+    def rule_documents(self) -> pd.Series:
+        """Standardized text and hint of each rule, as in the notebook."""
+        return self._standardize_text(self.rules_df["text"].fillna("").astype(str) + " " + self.rules_df["hint"].fillna("").astype(str), split=False)
+
     @staticmethod
     def create_document(row):
         if isinstance(row["text"], list) and isinstance(row["hint"], list):
             return row["text"] + row["hint"]
         return row["text"]
 
+    @pipeline_stage(inputs=("rules_df",), outputs=("std_rules_df",), returns="std_rules_df",
+                    depends_on=("_standardize_text", "remove_urls", "_remove_empty", "create_document"))
     def standardize_rules(self) -> pd.DataFrame:
         if self.rules_df is None:
             raise ValueError("You must run self.extract_rules() before standardizing.")
@@ -296,24 +587,29 @@ class MastodonDataset(SocialMediaDataset):
         return self.std_rules_df
 
     
+    @pipeline_stage(inputs=("rules_df",), outputs=("rules_df",), returns="rules_df",
+                    depends_on=("detect_english", "detect_english_many", "_map_canonical"), context=lang_backend_key)
     def predicts_english_rules(self) -> pd.DataFrame:
         if self.rules_df is None:
             raise ValueError("You must run extract_rules() before filtering English rules.")
         else:
             doc = self.rules_df.apply(lambda row: row["text"] + " " + row["hint"] if isinstance(row["text"], list) and isinstance(row["hint"], list) else row["text"], axis=1)
-            english_rules_prediction = doc.apply(self.detect_english)
+            english_rules_prediction = self._map_canonical(self.detect_english_many, doc,
+                                                           stage="predicts_english_rules")
             self.rules_df["is_english_pred"] = english_rules_prediction
         return self.rules_df
     
+    @pipeline_stage(inputs=("rules_df",), outputs=("rules_df",), returns="rules_df")
     def keep_english_rules_only(self) -> pd.DataFrame:
         if self.rules_df is None:
             raise ValueError("You must run extract_rules() before filtering English rules.")
         if self.rules_df["is_english_pred"].isnull().any():
             raise ValueError("You must run predicts_english_rules() before filtering English rules.")
-        english_pred_rate = self.rules_df.groupby("server_id")[["server_id", "is_english_pred"]].apply(lambda server: server["is_english_pred"].sum() / server["server_id"].count()).reset_index(name='is_english_pred_rate')
+        servers = ServerSegments(self.rules_df["server_id"])
+        english_pred_rate = servers.mean(self.rules_df["is_english_pred"].astype(bool))
         print(f"Started with {self.rules_df.shape[0]} rules…")
         
-        mastodon_rules_english = self.rules_df[self.rules_df["server_id"].isin(english_pred_rate[english_pred_rate["is_english_pred_rate"] > 0]["server_id"])]
+        mastodon_rules_english = self.rules_df[(english_pred_rate > 0)[servers.codes]]
         print(f"Removed {self.rules_df.shape[0] - mastodon_rules_english.shape[0]} rules from servers with 0% of rules predicted to be in english…")
         
         mastodon_rules_english_93 = mastodon_rules_english[(~mastodon_rules_english["server_id"].isin([176, 229, 230, 292])) | (mastodon_rules_english["is_english_pred"] == True)]
@@ -344,7 +640,9 @@ class RedditDataset(SocialMediaDataset):
                                       "quarantine", 
                                       "is_restricted", 
                                       "moderators_count"],
-                 keep_common_col_only = True) -> None:
+                 keep_common_col_only = True,
+                 cache_dir = None,
+                 server_range = None) -> None:
         self.col_in_common = ["name", 
                         "title", 
                         "description", 
@@ -354,7 +652,7 @@ class RedditDataset(SocialMediaDataset):
                         "rules"]
         if keep_common_col_only:
             cols_to_keep_reddit = self.col_in_common
-        super().__init__(redd_path, cols_to_keep_reddit)
+        super().__init__(redd_path, cols_to_keep_reddit, cache_dir, server_range)
         self.col_redd_specific = ["over18",
                                   "quarantine", 
                                   "is_restricted", 
@@ -388,11 +686,14 @@ class RedditDataset(SocialMediaDataset):
     def is_english_server(self, lang, en_symbol="en"): 
         return lang == en_symbol if isinstance(lang, str) else False
 
+    @pipeline_stage(inputs=("rules_df",), outputs=("rules_df",), returns="rules_df",
+                    depends_on=("detect_english", "detect_english_many", "_map_canonical"), context=lang_backend_key)
     def predicts_english_rules(self) -> pd.DataFrame:
         if self.rules_df is None:
             raise ValueError("You must run extract_rules() before filtering English rules.")
         else:
-            english_rules_prediction = self.rules_df["rules"].apply(self.detect_english)
+            english_rules_prediction = self._map_canonical(self.detect_english_many,
+                                                           self.rules_df["rules"], stage="predicts_english_rules")
             self.rules_df["is_english_pred"] = english_rules_prediction
         return self.rules_df
     
@@ -401,15 +702,22 @@ class RedditDataset(SocialMediaDataset):
     ################# Extraction of rules #################
     #######################################################
     
-    def extract_rules(self) -> pd.DataFrame:
-        rules_df = self.df['rules'].explode().reset_index(drop=False)
+    def _explode_rules(self, servers: pd.DataFrame) -> pd.DataFrame:
+        rules_df = servers['rules'].explode().reset_index(drop=False)
         rules_df = rules_df.rename(columns={"index": "server_id"}) #TODO
         # We add an index to the rules
         rules_df["rule_id"] = rules_df.groupby("server_id").cumcount()
         rules_df = rules_df.dropna()
-        self.rules_df = rules_df[["server_id", "rule_id", "rules"]].reset_index(drop=True)
+        return rules_df[["server_id", "rule_id", "rules"]].reset_index(drop=True)
+
+    @pipeline_stage(inputs=("df", "rules_table"), outputs=("rules_df",), returns="rules_df",
+                    depends_on=("_rules_of", "_explode_rules"))
+    def extract_rules(self) -> pd.DataFrame:
+        self.rules_df = self._rules_of(self.df)
         return self.rules_df
     
+    @pipeline_stage(inputs=("rules_df",), outputs=("std_rules_df",), returns="std_rules_df",
+                    depends_on=("_standardize_text", "remove_urls", "_remove_empty", "create_document"))
     def standardize_rules(self):
         if self.rules_df is None:
             raise ValueError("You must run extract_rules() before standardizing.")
@@ -1,10 +1,8 @@
 import pandas as pd
 import ast
 
-from langdetect import detect
-from transformers.pipelines import pipeline
-lang_recognition = pipeline("text-classification", model="spolivin/lang-recogn-model")
-        
+from .SocialMediaDataset import get_lang_recognition
+
 
 
 class SocialMediaDataset:
@@ -109,6 +107,7 @@ class SocialMediaDataset:
     
     @staticmethod
     def detect_english(text):
+        lang_recognition = get_lang_recognition()
         try:
             
             return lang_recognition(text)[0]["label"] == 'English'
@@ -210,14 +209,9 @@ class MastodonDataset(SocialMediaDataset):
         return pd.to_numeric(self.df["total_posts"], errors='coerce').fillna(0).astype(int)
 
     def _clean_blacklist(self) -> pd.Series:
-        # TODO: implement better cleaning for blacklist (here is an example, commented)
-        # Count number of blacklisted items if stored as list-like strings
-        # def safe_count(x):
-        #     try:
-        #         return len(ast.literal_eval(x)) if isinstance(x, str) else 0
-        #     except Exception:
-        #         return 0
-        return self.df['blacklist'].apply(lambda x: len(str(x).split("|")) if x else 0) #.apply(safe_count)
+        # Number of " | "-separated blocked domains, 0 for missing or empty blacklists
+        blacklist = self.df["blacklist"].fillna("").astype(str).str.strip()
+        return (blacklist.str.count(r"\|") + 1).where(blacklist != "", 0)
 
     # TODO: implement more precise cleaning for source_url
     def _clean_source_url(self) -> pd.Series:
@@ -0,0 +1,56 @@
+"""Analysis utilities.
+
+`import utils` is cheap: the names below are resolved on first access, and the heavy
+dependencies (transformers, scipy.stats, sklearn, shap, matplotlib, nltk) are only imported
+by the functions that need them. For instance, `from utils import fisher_z_test` loads
+neither the dataset classes nor scipy until the test is run.
+"""
+import importlib
+
+
+_LAZY_ATTRIBUTES = {
+    # Datasets
+    "MastodonDataset": "SocialMediaDataset",
+    "RedditDataset": "SocialMediaDataset",
+    "MultiPlatformDataset": "multi_platform",
+    # Pipeline and profiling
+    "StageCache": "pipeline",
+    "PROFILER": "profiling",
+    "profiled": "profiling",
+    # Rule metrics
+    "aggregate_rules": "aggregation",
+    "strictness_scores": "strictness",
+    "bootstrap_servers": "server_bootstrap",
+    "optimize_frame": "memory",
+    "TrendStore": "trends",
+    "IncrementalTopicModel": "topic_model",
+    "EmbeddingIndex": "embedding_index",
+    # Statistics
+    "pearsonr_correlation": "statistic_analysis",
+    "spearmanr_correlation": "statistic_analysis",
+    "kendalltau_correlation": "statistic_analysis",
+    "fisher_z_test": "statistic_analysis",
+    "run_t_test": "statistic_analysis",
+    "bootstrap_spearman_diff": "statistic_analysis",
+    "bootstrap_kendall_diff": "statistic_analysis",
+    "stratified_analysis": "stratified",
+    "CorrelationTracker": "online_stats",
+    # Misc
+    "compare_languages": "utils",
+    "lemmatize": "utils",
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        module = importlib.import_module(f".{_LAZY_ATTRIBUTES[name]}", __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+
+class ServerSegments:
+    """Rules grouped into contiguous per-server segments, for one-pass reductions.
+
+    The server ids are factorized once; sums, counts and means are then np.bincount calls
+    and maxima are np.maximum.reduceat over the rules sorted by server.
+
+    Attributes:
+        server_ids (np.ndarray): Distinct server ids, in increasing order.
+        codes (np.ndarray): Position in server_ids of the server of each rule.
+        counts (np.ndarray): Number of rules of each server.
+    """
+
+    def __init__(self, server_id) -> None:
+        self.codes, self.server_ids = pd.factorize(pd.Series(server_id).to_numpy(), sort=True)
+        self.n_servers = len(self.server_ids)
+        self.counts = np.bincount(self.codes, minlength=self.n_servers)
+        self._order = None
+
+    @property
+    def order(self) -> np.ndarray:
+        if self._order is None:
+            self._order = np.argsort(self.codes, kind="stable")
+        return self._order
+
+    def sum(self, values) -> np.ndarray:
+        return np.bincount(self.codes, weights=np.asarray(values, dtype=float), minlength=self.n_servers)
+
+    def mean(self, values) -> np.ndarray:
+        return self.sum(values) / np.maximum(self.counts, 1)
+
+    def max(self, values) -> np.ndarray:
+        values = np.asarray(values, dtype=float)[self.order]
+        starts = np.r_[0, np.cumsum(self.counts)[:-1]]
+        return np.maximum.reduceat(values, starts) if len(values) else np.zeros(self.n_servers)
+
+    def distribution(self, labels, prefix: str) -> pd.DataFrame:
+        """Share of each label among the rules of each server, one column per label."""
+        label_codes, labels = pd.factorize(pd.Series(labels).to_numpy(), sort=True)
+        n_labels = len(labels)
+        counts = np.bincount(self.codes * n_labels + label_codes, minlength=self.n_servers * n_labels)
+        shares = counts.reshape(self.n_servers, n_labels) / np.maximum(self.counts, 1)[:, None]
+        return pd.DataFrame(shares, columns=[f"{prefix}{label}" for label in labels])
+
+
+def aggregate_rules(rules: pd.DataFrame, topic_col: str = "Topic") -> pd.DataFrame:
+    """Server-level statistics of a rules table, in one vectorized pass.
+
+    The statistics that can be computed depend on the columns of the rules table:
+        - rule_count: always
+        - strictness_sum / strictness_mean / strictness_max: 'strictness' (see compute_strictness())
+        - strict_hits / lenient_hits: lexicon hit counts
+        - english_rate: 'is_english_pred' (see predicts_english_rules())
+        - topic_<k>: share of the rules of the server in each topic, from `topic_col`
+
+    Returns:
+        pd.DataFrame: One row per server_id.
+    """
+    segments = ServerSegments(rules["server_id"])
+    aggregates = {"server_id": segments.server_ids, "rule_count": segments.counts}
+    if "strictness" in rules.columns:
+        strictness = rules["strictness"].fillna(0).to_numpy(dtype=float)
+        aggregates["strictness_sum"] = segments.sum(strictness)
+        aggregates["strictness_mean"] = segments.mean(strictness)
+        aggregates["strictness_max"] = segments.max(strictness)
+    for column in ["strict_hits", "lenient_hits"]:
+        if column in rules.columns:
+            aggregates[column] = segments.sum(rules[column].fillna(0)).astype(np.int64)
+    if "is_english_pred" in rules.columns:
+        aggregates["english_rate"] = segments.mean(rules["is_english_pred"].fillna(False).astype(bool))
+    server_table = pd.DataFrame(aggregates)
+    if topic_col is not None and topic_col in rules.columns:
+        server_table = pd.concat([server_table, segments.distribution(rules[topic_col], prefix="topic_")], axis=1)
+    return server_table
@@ -0,0 +1,148 @@
+"""Benchmark suite of the dataset pipeline and of the statistic analysis on synthetic data.
+
+Every run appends one JSON line per (platform, size, stage) to the results file, tagged with
+the git commit, so that timings can be compared across commits.
+
+Usage (from the analysis/ directory):
+    python -m utils.benchmark --sizes 10000 100000
+    python -m utils.benchmark --compare
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import subprocess
+
+import pandas as pd
+
+from .profiling import PROFILER
+from .synthetic import write_datasets
+
+
+RESULTS_PATH = "benchmark_results.jsonl"
+
+# Language detection runs the transformers model on every rule: opt-in only
+LANGUAGE_STAGES = ["predicts_english_rules", "keep_english_rules_only"]
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+######################################################
+###################### Stages ########################
+######################################################
+
+def bench_dataset(dataset_cls, data_path: str, stages: list) -> pd.DataFrame:
+    """Runs the given pipeline stages on a synthetic file, returns the profiler report."""
+    PROFILER.reset()
+    with PROFILER.stage(f"{dataset_cls.__name__}.load_instance") as record:
+        dataset = dataset_cls(data_path, keep_common_col_only=False)
+        record["rows_out"] = len(dataset.df)
+    with contextlib.redirect_stdout(io.StringIO()):
+        dataset.run_pipeline([stage for stage in dataset.pipeline_stages if stage in stages])
+    return PROFILER.report()
+
+
+def bench_statistics(df: pd.DataFrame, n_bootstrap: int = 200) -> pd.DataFrame:
+    """Times the statistic_analysis helpers on the rules count vs engagement of a cleaned frame."""
+    from . import statistic_analysis as sa
+
+    PROFILER.reset()
+    rules_num = df["rules"].apply(len).to_numpy(dtype=float)
+    engagement = df["active_month"].to_numpy(dtype=float)
+    half = len(df) // 2
+    calls = {
+        "pearsonr_correlation": lambda: sa.pearsonr_correlation(rules_num, engagement),
+        "spearmanr_correlation": lambda: sa.spearmanr_correlation(rules_num, engagement),
+        "kendalltau_correlation": lambda: sa.kendalltau_correlation(rules_num, engagement),
+        "fisher_z_test": lambda: sa.fisher_z_test(rules_num[:half], engagement[:half], rules_num[half:], engagement[half:]),
+        "run_t_test": lambda: sa.run_t_test(rules_num[:half], rules_num[half:]),
+        "bootstrap_spearman_diff": lambda: sa.bootstrap_spearman_diff(rules_num[:half], engagement[:half],
+                                                                      rules_num[half:], engagement[half:],
+                                                                      n_iter=n_bootstrap),
+    }
+    for name, call in calls.items():
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            with PROFILER.stage(f"statistic_analysis.{name}", rows_in=len(df)):
+                call()
+    return PROFILER.report()
+
+
+def run_benchmarks(sizes: list, data_dir: str, stages: list = None, results_path: str = RESULTS_PATH,
+                   trace_memory: bool = True) -> pd.DataFrame:
+    """Generates (if needed) the synthetic datasets, benchmarks them and appends the results."""
+    from .SocialMediaDataset import MastodonDataset, RedditDataset
+
+    missing = [size for size in sizes
+               if not all(os.path.exists(os.path.join(data_dir, f"{platform}_{size}.csv")) for platform in ["mastodon", "reddit"])]
+    if missing:
+        write_datasets(missing, data_dir)
+
+    commit, timestamp = git_revision(), datetime.datetime.now().isoformat(timespec="seconds")
+    PROFILER.enable(trace_memory=trace_memory)
+    results = []
+    try:
+        for size in sizes:
+            for platform, dataset_cls in [("mastodon", MastodonDataset), ("reddit", RedditDataset)]:
+                print(f"Benchmarking {platform} with {size} instances… ⏱️")
+                path = os.path.join(data_dir, f"{platform}_{size}.csv")
+                stage_names = stages or [s for s in dataset_cls.pipeline_stages if s not in LANGUAGE_STAGES]
+                report = bench_dataset(dataset_cls, path, stage_names)
+                report["platform"], report["n_instances"] = platform, size
+                results.append(report)
+
+                clean_df = dataset_cls(path, keep_common_col_only=False)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    clean_df.clean()
+                report = bench_statistics(clean_df.df)
+                report["platform"], report["n_instances"] = platform, size
+                results.append(report)
+    finally:
+        PROFILER.disable()
+        PROFILER.reset()
+
+    results = pd.concat(results, ignore_index=True)
+    results["commit"], results["timestamp"] = commit, timestamp
+    results = results[results["depth"] == 0].drop(columns=["parent", "depth"])
+    with open(results_path, "a", encoding="utf-8") as f:
+        for record in results.astype(object).where(results.notna(), None).to_dict(orient="records"):
+            f.write(json.dumps(record) + "\n")
+    print(f"Results appended to {results_path} 📈")
+    return results
+
+
+def compare(results_path: str = RESULTS_PATH, metric: str = "wall_time_s") -> pd.DataFrame:
+    """Table of a metric per (platform, size, stage) and commit, in the order the commits were benchmarked."""
+    results = pd.read_json(results_path, lines=True, dtype={"commit": str})
+    commits = results.sort_values("timestamp")["commit"].unique()
+    table = results.pivot_table(index=["platform", "n_instances", "stage"], columns="commit",
+                                values=metric, aggfunc="median")
+    return table[[commit for commit in commits if commit in table.columns]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dataset pipeline on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--data-dir", default="synthetic_data")
+    parser.add_argument("--results", default=RESULTS_PATH)
+    parser.add_argument("--stages", nargs="+", default=None, help="Pipeline stages to run (default: all but language detection).")
+    parser.add_argument("--language-detection", action="store_true", help="Also run the language detection stages.")
+    parser.add_argument("--no-memory", action="store_true", help="Do not trace peak memory (faster).")
+    parser.add_argument("--compare", action="store_true", help="Only print the comparison table across commits.")
+    args = parser.parse_args()
+
+    if not args.compare:
+        stages = args.stages
+        if stages is None and args.language_detection:
+            stages = ["clean", "take_english_servers_only", "extract_rules", "deduplicate_rules",
+                      "standardize_rules", "compute_strictness"] + LANGUAGE_STAGES
+        run_benchmarks(args.sizes, args.data_dir, stages, args.results, trace_memory=not args.no_memory)
+    with pd.option_context("display.width", 200, "display.max_rows", None):
+        print(compare(args.results))
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+from .minhash import lsh_clusters, minhash
+
+
+def normalize_text(documents: pd.Series) -> pd.Series:
+    """Casefolded text without URLs, punctuation and repeated whitespace. Letters and digits of
+    every script are kept (object dtype: the regexes of pyarrow strings only know ASCII \\w)."""
+    return (documents.fillna("").astype(str).astype(object).str.casefold()
+            .str.replace(r"https?://\S+|www\.\S+", " ", regex=True)
+            .str.replace(r"[^\w\s]|_", " ", regex=True)
+            .str.replace(r"\s+", " ", regex=True).str.strip())
+
+
+def exact_ids(texts) -> tuple:
+    """exact_id of each normalized text (see normalize_text()), numbered in order of first
+    appearance. Empty texts have nothing in common, each one gets its own id.
+
+    Returns:
+        tuple: (exact_id of each text, pd.Series of the distinct texts, "" for the empty ones)
+    """
+    texts = np.array(texts, dtype=object)
+    empty = texts == ""
+    texts[empty] = -1 - np.arange(empty.sum())  # distinct keys, not texts
+    exact_id, unique_texts = pd.factorize(texts)
+    unique_texts = pd.Series(unique_texts, dtype=object)
+    unique_texts[~unique_texts.map(lambda text: isinstance(text, str))] = ""
+    return exact_id, unique_texts
+
+
+def shingles(texts: pd.Series, size: int = 2) -> tuple:
+    """Word n-grams of each text, as integer ids.
+
+    Texts with fewer than `size` words are a single shingle (the whole text), empty texts have none.
+
+    Returns:
+        tuple: (number of shingles of each text, shingle ids concatenated in text order)
+    """
+    texts = texts.reset_index(drop=True)
+    tokens = texts.str.split(" ").explode()
+    tokens = tokens[tokens.fillna("") != ""]
+    doc = tokens.index.to_numpy()
+    grams = tokens.to_numpy(dtype=object)
+    valid = np.ones(len(grams), dtype=bool)
+    for offset in range(1, size):
+        if len(grams) <= offset:
+            valid[:] = False
+            break
+        grams[:-offset] = grams[:-offset] + " " + tokens.to_numpy(dtype=object)[offset:]
+        valid[:-offset] &= doc[offset:] == doc[:-offset]
+        valid[-offset:] = False
+
+    doc, grams = doc[valid], grams[valid]
+    short = np.setdiff1d(np.flatnonzero(texts != ""), doc)
+    doc = np.concatenate([doc, short])
+    grams = np.concatenate([grams, texts.to_numpy(dtype=object)[short]])
+    order = np.argsort(doc, kind="stable")
+    members, _ = pd.factorize(grams[order])
+    return np.bincount(doc, minlength=len(texts)), members
+
+
+def deduplicate(documents: pd.Series, threshold: float = 0.8, n_perm: int = 64, n_bands: int = 8,
+                shingle_size: int = 2, seed: int = 0) -> pd.DataFrame:
+    """Exact and near-duplicate groups of documents.
+
+    Exact duplicates share the same normalized text (hashed with pd.factorize). Near duplicates
+    are the distinct texts whose word n-gram sets have an estimated Jaccard similarity above
+    `threshold` (MinHash-LSH, see minhash.lsh_clusters). Texts that normalize to "" (e.g. only
+    emojis or punctuation) have nothing to compare, each one gets its own ids.
+
+    Returns:
+        pd.DataFrame: exact_id and canonical_id of each document (same order), numbered in order
+            of first appearance. Documents with the same canonical_id are near duplicates.
+    """
+    exact_id, unique_texts = exact_ids(normalize_text(documents))
+    set_sizes, members = shingles(unique_texts, size=shingle_size)
+    near = lsh_clusters(minhash(set_sizes, members, n_perm=n_perm, seed=seed), threshold=threshold, n_bands=n_bands)
+    # Texts without near duplicates are their own group
+    groups = np.where(near >= 0, near, near.max(initial=-1) + 1 + np.arange(len(near)))
+    canonical_id, _ = pd.factorize(groups[exact_id])
+    return pd.DataFrame({"exact_id": exact_id, "canonical_id": canonical_id}, index=documents.index)
+
+
+def dedup_report(rules: pd.DataFrame) -> dict:
+    """Number of rules, of distinct texts and of canonical rules, and the share of rules that are duplicates."""
+    n_rules = len(rules)
+    n_exact = rules["exact_id"].nunique()
+    n_canonical = rules["canonical_id"].nunique()
+    return {"n_rules": n_rules,
+            "n_exact": n_exact,
+            "n_canonical": n_canonical,
+            "exact_dup_ratio": 1 - n_exact / n_rules if n_rules else 0.0,
+            "dedup_ratio": 1 - n_canonical / n_rules if n_rules else 0.0}
@@ -0,0 +1,232 @@
+"""Persisted approximate nearest-neighbour index over rule and server description embeddings.
+
+Inverted-file (IVF) index: the normalized embeddings are partitioned with k-means and a query
+only scores the vectors of its `nprobe` nearest partitions. Each vector carries a metadata row
+(platform, server_id, rule_id, domain, ...) which queries can filter on. New vectors are
+appended to a buffer that is scanned exhaustively and merged into the partitions once it
+grows past `max_pending`, so inserts never require a rebuild.
+
+Usage:
+    index = build_rules_index([mastodon, reddit])     # datasets after extract_rules()
+    index.save("rules_index/")
+    index = EmbeddingIndex.load("rules_index/")
+    index.search_text(["no nazis"], k=10, filters={"platform": "mastodon"})
+"""
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from .topic_model import DEFAULT_EMBEDDING_MODEL, _normalize_rows
+
+
+class EmbeddingIndex:
+    """IVF index of normalized embeddings (cosine similarity) with a metadata table.
+
+    Attributes:
+        vectors (np.ndarray): Normalized embeddings, the first n_indexed sorted by partition.
+        metadata (pd.DataFrame): One row per vector.
+        centroids (np.ndarray): Partition centroids.
+        list_indptr (np.ndarray): Vectors of partition p are rows list_indptr[p]:list_indptr[p + 1].
+    """
+
+    def __init__(self, embedding_model: str = DEFAULT_EMBEDDING_MODEL, nprobe: int = 8,
+                 max_pending: int = 10_000, seed: int = 0) -> None:
+        self.embedding_model = embedding_model
+        self.nprobe = nprobe
+        self.max_pending = max_pending
+        self.seed = seed
+        self.vectors = None
+        self.metadata = pd.DataFrame()
+        self.centroids = None
+        self.list_indptr = None
+        self.n_indexed = 0
+        self._encoder = None
+
+    def __len__(self) -> int:
+        return 0 if self.vectors is None else len(self.vectors)
+
+    ######################################################
+    ###################### Building ######################
+    ######################################################
+
+    @classmethod
+    def build(cls, embeddings: np.ndarray, metadata: pd.DataFrame, n_lists: int = None, **kwargs) -> "EmbeddingIndex":
+        """Index of the given embeddings; n_lists defaults to about sqrt(number of vectors)."""
+        index = cls(**kwargs)
+        index.add(embeddings, metadata, n_lists=n_lists)
+        return index
+
+    def train(self, n_lists: int) -> None:
+        """Fits the partition centroids on (a sample of) the vectors and re-partitions every vector."""
+        from sklearn.cluster import MiniBatchKMeans
+        rng = np.random.default_rng(self.seed)
+        n_lists = min(n_lists, len(self.vectors))
+        sample = self.vectors[rng.choice(len(self.vectors), min(len(self.vectors), 256 * n_lists), replace=False)]
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=self.seed, n_init=3, batch_size=4096).fit(sample)
+        self.centroids = _normalize_rows(kmeans.cluster_centers_.astype(np.float32))
+        self.n_indexed = 0
+        self._merge_pending()
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        return (vectors @ self.centroids.T).argmax(axis=1)
+
+    def _merge_pending(self) -> None:
+        """Sorts every vector by partition and rebuilds the partition offsets."""
+        lists = self._assign(self.vectors)
+        order = np.argsort(lists, kind="stable")
+        self.vectors = self.vectors[order]
+        self.metadata = self.metadata.iloc[order].reset_index(drop=True)
+        self.list_indptr = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(lists, minlength=len(self.centroids)), out=self.list_indptr[1:])
+        self.n_indexed = len(self.vectors)
+
+    def add(self, embeddings: np.ndarray, metadata: pd.DataFrame, n_lists: int = None) -> None:
+        """Inserts new vectors. They are searchable immediately and merged into the partitions in
+        batches. The partitions are trained on the first vectors added to an empty index."""
+        if len(embeddings) == 0:
+            return
+        vectors = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        if self.vectors is None:
+            self.vectors, self.metadata = vectors, metadata.reset_index(drop=True)
+        else:
+            self.vectors = np.vstack([self.vectors, vectors])
+            self.metadata = pd.concat([self.metadata, metadata], ignore_index=True)
+        if self.centroids is None:
+            self.train(n_lists or max(1, int(np.sqrt(len(self.vectors)))))
+        elif len(self.vectors) - self.n_indexed > self.max_pending:
+            self._merge_pending()
+
+    ######################################################
+    ###################### Queries #######################
+    ######################################################
+
+    def filter_mask(self, filters: dict = None) -> np.ndarray:
+        """Rows whose metadata matches every filter: {column: value, list of values, or function of the column}."""
+        mask = np.ones(len(self), dtype=bool)
+        for column, condition in (filters or {}).items():
+            values = self.metadata[column]
+            if callable(condition):
+                mask &= np.asarray(condition(values), dtype=bool)
+            elif isinstance(condition, (list, tuple, set, np.ndarray)):
+                mask &= values.isin(list(condition)).to_numpy()
+            else:
+                mask &= (values == condition).to_numpy()
+        return mask
+
+    def _candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        probes = np.argsort(-(self.centroids @ query))[:nprobe]
+        ranges = [np.arange(self.list_indptr[p], self.list_indptr[p + 1]) for p in probes]
+        return np.concatenate(ranges + [np.arange(self.n_indexed, len(self))])
+
+    def search(self, queries: np.ndarray, k: int = 10, filters: dict = None, nprobe: int = None) -> pd.DataFrame:
+        """k most similar vectors of each query that match the filters.
+
+        When fewer than k candidates of the probed partitions match the filters (very selective
+        filters), all the matching vectors are scored instead.
+
+        Returns:
+            pd.DataFrame: query, rank, score (cosine similarity) and the metadata of the match.
+        """
+        queries = _normalize_rows(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        nprobe = nprobe or self.nprobe
+        mask = self.filter_mask(filters) if filters else None
+        results = []
+        for q, query in enumerate(queries if len(self) else []):
+            candidates = self._candidates(query, nprobe)
+            if mask is not None:
+                candidates = candidates[mask[candidates]]
+                if len(candidates) < k:
+                    candidates = np.flatnonzero(mask)
+            scores = self.vectors[candidates] @ query
+            top = np.argpartition(-scores, k)[:k] if len(scores) > k else np.arange(len(scores))
+            top = top[np.argsort(-scores[top])]
+            results.append(pd.DataFrame({"query": q, "rank": np.arange(len(top)), "score": scores[top],
+                                         "row": candidates[top]}))
+        results = pd.concat(results, ignore_index=True) if results else pd.DataFrame(columns=["query", "rank", "score", "row"])
+        matches = self.metadata.iloc[results["row"].to_numpy()].reset_index(drop=True)
+        return pd.concat([results.drop(columns="row"), matches], axis=1)
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            from sentence_transformers import SentenceTransformer
+            self._encoder = SentenceTransformer(self.embedding_model)
+        return self._encoder
+
+    def embed(self, documents: list) -> np.ndarray:
+        return np.asarray(self.encoder.encode(list(documents), show_progress_bar=False), dtype=np.float32)
+
+    def search_text(self, texts: list, k: int = 10, filters: dict = None, nprobe: int = None) -> pd.DataFrame:
+        return self.search(self.embed(texts), k=k, filters=filters, nprobe=nprobe)
+
+    ######################################################
+    #################### Persistence #####################
+    ######################################################
+
+    def save(self, path: str) -> None:
+        """Writes the vectors (.npy, memory-mappable on load) and the rest of the index (pickle).
+        Pending vectors are merged into the partitions first."""
+        if self.n_indexed < len(self):
+            self._merge_pending()
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        state = {key: value for key, value in self.__dict__.items() if key not in ("_encoder", "vectors")}
+        tmp_path = os.path.join(path, "index.pkl.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, os.path.join(path, "index.pkl"))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "EmbeddingIndex":
+        index = cls.__new__(cls)
+        with open(os.path.join(path, "index.pkl"), "rb") as f:
+            index.__dict__.update(pickle.load(f))
+        index._encoder = None
+        index.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+        return index
+
+
+######################################################
+############# Indexing of the datasets ###############
+######################################################
+
+def platform_name(dataset) -> str:
+    return type(dataset).__name__.replace("Dataset", "").lower()
+
+
+def rules_metadata(dataset, server_cols: list = ("domain", "languages", "total_users")) -> pd.DataFrame:
+    """Metadata of the rules of a dataset (after extract_rules()): platform, ids and server attributes."""
+    rules = dataset.rules_df
+    metadata = rules[["server_id", "rule_id"]].reset_index(drop=True).assign(platform=platform_name(dataset), kind="rule")
+    metadata["document"] = dataset.rule_documents().reset_index(drop=True)
+    servers = dataset.df[["server_id"] + [col for col in server_cols if col in dataset.df.columns]]
+    return metadata.merge(servers, on="server_id", how="left")
+
+
+def descriptions_metadata(dataset, server_cols: list = ("domain", "languages", "total_users")) -> pd.DataFrame:
+    servers = dataset.df[dataset.df["description"].fillna("").astype(str).str.strip() != ""]
+    metadata = servers[["server_id"] + [col for col in server_cols if col in servers.columns]].reset_index(drop=True)
+    metadata = metadata.assign(platform=platform_name(dataset), kind="description", rule_id=-1)
+    metadata["document"] = servers["description"].astype(str).to_numpy()
+    return metadata
+
+
+def build_rules_index(datasets: list, include_descriptions: bool = True, index: EmbeddingIndex = None,
+                      batch_size: int = 10_000, **kwargs) -> EmbeddingIndex:
+    """Embeds the rules (and descriptions) of the datasets and adds them to `index` (a new one by default).
+    Datasets without any rule or description leave the index unchanged."""
+    metadata = [rules_metadata(dataset) for dataset in datasets]
+    if include_descriptions:
+        metadata += [descriptions_metadata(dataset) for dataset in datasets]
+    if index is None:
+        index = EmbeddingIndex(**kwargs)
+    metadata = pd.concat(metadata, ignore_index=True) if metadata else pd.DataFrame()
+    if metadata.empty:
+        print("No rule or description to index ⚠️")
+        return index
+    embeddings = np.vstack([index.embed(metadata["document"].iloc[start:start + batch_size].tolist())
+                            for start in range(0, len(metadata), batch_size)])
+    index.add(embeddings, metadata)
+    return index
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+
+
+class BlockGraph:
+    """Federation graph of domain blocks, with interned domains and CSR adjacency arrays.
+
+    Node i is the domain self.domains[i]. The crawled servers come first, in the order of the
+    instance table (row i is node self.server_nodes[i], which is i unless a domain appears on
+    several rows, and has the server_id self.server_ids[i]), then the blocked domains that were
+    not crawled. Edge (u, v) means that
+    u blocks v. Out-edges of u are self.indices[self.indptr[u]:self.indptr[u + 1]], in-edges
+    of v (the domains blocking v) are self.in_indices[self.in_indptr[v]:self.in_indptr[v + 1]].
+
+    Attributes:
+        domains (np.ndarray): Domain of each node.
+        server_nodes (np.ndarray): Node of each row of the instance table.
+        server_ids (np.ndarray): server_id of each row of the instance table (its position by default).
+        indptr, indices (np.ndarray): CSR arrays of the out-edges (blocker -> blocked).
+        in_indptr, in_indices (np.ndarray): CSR arrays of the in-edges (blocked -> blockers).
+    """
+
+    def __init__(self, domains: np.ndarray, server_nodes: np.ndarray, src: np.ndarray, dst: np.ndarray,
+                 server_ids: np.ndarray = None) -> None:
+        self.domains = np.asarray(domains, dtype=object)
+        self.server_nodes = np.asarray(server_nodes, dtype=np.int64)
+        self.server_ids = (np.arange(len(self.server_nodes)) if server_ids is None
+                           else np.asarray(server_ids, dtype=np.int64))
+        self._ids = None
+        n_nodes = len(self.domains)
+
+        # Deduplicate the edges (some servers list the same domain twice) and sort them
+        edges = np.sort(src.astype(np.int64) * n_nodes + dst.astype(np.int64))
+        edges = edges[np.r_[True, edges[1:] != edges[:-1]]] if len(edges) else edges
+        src, dst = (edges // n_nodes).astype(np.int32), (edges % n_nodes).astype(np.int32)
+        self.indptr, self.indices = self._csr(src, dst, n_nodes)
+        order = np.argsort(dst, kind="stable")
+        self.in_indptr, self.in_indices = self._csr(dst[order], src[order], n_nodes)
+
+    @staticmethod
+    def _csr(sorted_rows: np.ndarray, cols: np.ndarray, n_nodes: int):
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sorted_rows, minlength=n_nodes), out=indptr[1:])
+        return indptr, cols
+
+    @classmethod
+    def from_blacklists(cls, server_domains: pd.Series, blacklists: pd.Series, sep: str = "|",
+                        server_ids=None) -> "BlockGraph":
+        """Builds the graph from the raw `blacklist` column (domains joined by " | ").
+
+        The strings are split in one vectorized pass; missing and empty blacklists give no edge.
+        server_ids are those of the rows (e.g. the server_id column of a filtered or sharded
+        instance table), their positions by default.
+        """
+        server_domains = pd.Series(server_domains).astype(str).str.strip().str.lower().reset_index(drop=True)
+        blocked = (pd.Series(blacklists).reset_index(drop=True)
+                   .fillna("").astype(str).str.split(sep, regex=False).explode()
+                   .str.strip().str.lower())
+        blocked = blocked[blocked != ""]
+
+        # Intern the domains: crawled servers first, then the other blocked domains
+        codes, domains = pd.factorize(pd.concat([server_domains, blocked], ignore_index=True))
+        server_nodes = codes[:len(server_domains)]
+        src = server_nodes[blocked.index.to_numpy()]
+        dst = codes[len(server_domains):]
+        return cls(np.asarray(domains, dtype=object), server_nodes, src, dst, server_ids)
+
+    ######################################################
+    ###################### Lookups #######################
+    ######################################################
+
+    @property
+    def n_servers(self) -> int:
+        return len(self.server_nodes)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.domains)
+
+    @property
+    def n_edges(self) -> int:
+        return len(self.indices)
+
+    def node_ids(self, domains) -> np.ndarray:
+        """Ids of the given domains, -1 for the domains that appear nowhere in the graph."""
+        if self._ids is None:
+            self._ids = pd.Series(np.arange(self.n_nodes), index=self.domains)
+        domains = pd.Series(list(domains), dtype=object).astype(str).str.strip().str.lower()
+        return self._ids.reindex(domains).fillna(-1).to_numpy(dtype=np.int64)
+
+    def node_id(self, domain: str) -> int:
+        return int(self.node_ids([domain])[0])
+
+    def blocked_by(self, domain: str) -> np.ndarray:
+        """Domains that block `domain` (who blocks X)."""
+        v = self.node_id(domain)
+        if v < 0:
+            return np.array([], dtype=object)
+        return self.domains[self.in_indices[self.in_indptr[v]:self.in_indptr[v + 1]]]
+
+    def blocks(self, domain: str) -> np.ndarray:
+        """Domains blocked by `domain`."""
+        u = self.node_id(domain)
+        if u < 0:
+            return np.array([], dtype=object)
+        return self.domains[self.indices[self.indptr[u]:self.indptr[u + 1]]]
+
+    def out_degree(self) -> np.ndarray:
+        """Number of domains blocked by each node."""
+        return np.diff(self.indptr)
+
+    def in_degree(self) -> np.ndarray:
+        """Number of domains blocking each node."""
+        return np.diff(self.in_indptr)
+
+    @staticmethod
+    def _gather(indptr: np.ndarray, rows: np.ndarray):
+        """Rows and positions of all the edges of the given rows, without a Python loop."""
+        starts, counts = indptr[rows], indptr[rows + 1] - indptr[rows]
+        edge_rows = np.repeat(rows, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return edge_rows, np.repeat(starts, counts) + offsets
+
+    def edges(self, rows: np.ndarray = None) -> tuple:
+        """(src, dst) arrays of the out-edges of the given nodes (all nodes by default)."""
+        if rows is None:
+            return np.repeat(np.arange(self.n_nodes), self.out_degree()), self.indices
+        edge_rows, positions = self._gather(self.indptr, np.asarray(rows, dtype=np.int64))
+        return edge_rows, self.indices[positions]
+
+    def blocks_between(self, domains) -> pd.DataFrame:
+        """Blocks whose blocker and blocked domain both belong to `domains`."""
+        ids = self.node_ids(domains)
+        ids = np.unique(ids[ids >= 0])
+        src, dst = self.edges(ids)
+        mask = np.isin(dst, ids)
+        return pd.DataFrame({"blocker": self.domains[src[mask]], "blocked": self.domains[dst[mask]]})
+
+    def reciprocal_blocks(self) -> pd.DataFrame:
+        """Pairs of domains blocking each other, each pair once."""
+        src, dst = self.edges()
+        # The edges are sorted by (src, dst): look the reversed edges up by binary search
+        forward = src.astype(np.int64) * self.n_nodes + dst
+        backward = dst.astype(np.int64) * self.n_nodes + src
+        positions = np.minimum(np.searchsorted(forward, backward), max(len(forward) - 1, 0))
+        mask = (src < dst) & (forward[positions] == backward) if len(forward) else np.zeros(0, dtype=bool)
+        return pd.DataFrame({"domain_a": self.domains[src[mask]], "domain_b": self.domains[dst[mask]]})
+
+    def to_scipy(self):
+        """Adjacency matrix as a scipy.sparse.csr_matrix (row blocks column)."""
+        from scipy.sparse import csr_matrix
+        data = np.ones(self.n_edges, dtype=np.float32)
+        return csr_matrix((data, self.indices, self.indptr), shape=(self.n_nodes, self.n_nodes))
+
+    def server_degrees(self) -> pd.DataFrame:
+        """In and out degrees of the crawled servers, one row per server (row order of the instance table)."""
+        return pd.DataFrame({"server_id": self.server_ids,
+                             "domain": self.domains[self.server_nodes],
+                             "blocks_out": self.out_degree()[self.server_nodes],
+                             "blocked_by": self.in_degree()[self.server_nodes]})
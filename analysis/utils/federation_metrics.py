@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from .federation import BlockGraph
+from .minhash import lsh_clusters, minhash
+from .profiling import profiled
+
+
+######################################################
+############## Components and PageRank ###############
+######################################################
+
+def block_components(graph: BlockGraph) -> pd.DataFrame:
+    """Weakly and strongly connected components of the block graph, one row per node."""
+    adjacency = graph.to_scipy()
+    n_weak, weak = connected_components(adjacency, directed=True, connection="weak")
+    n_strong, strong = connected_components(adjacency, directed=True, connection="strong")
+    return pd.DataFrame({"domain": graph.domains,
+                         "weak_component": weak,
+                         "weak_component_size": np.bincount(weak, minlength=n_weak)[weak],
+                         "strong_component": strong,
+                         "strong_component_size": np.bincount(strong, minlength=n_strong)[strong]})
+
+
+def blockedness(graph: BlockGraph, damping: float = 0.85, tol: float = 1e-10, max_iter: int = 100) -> np.ndarray:
+    """PageRank of the block graph: a domain is "blocked" when it is blocked by domains that are blocked themselves.
+
+    Power iteration on the sparse adjacency matrix. The mass of the domains that block nothing
+    (most of them) is spread uniformly, as in the original PageRank.
+    """
+    n_nodes = graph.n_nodes
+    if n_nodes == 0:
+        return np.zeros(0)
+    out_degree = graph.out_degree().astype(float)
+    dangling = out_degree == 0
+    # Row-normalized adjacency, transposed so that rank flows from blocker to blocked
+    weights = np.repeat(1.0 / np.where(dangling, 1.0, out_degree), graph.out_degree())
+    src, dst = graph.edges()
+    transition = coo_matrix((weights, (dst, src)), shape=(n_nodes, n_nodes)).tocsr()
+
+    rank = np.full(n_nodes, 1.0 / n_nodes)
+    for _ in range(max_iter):
+        new_rank = damping * (transition @ rank + rank[dangling].sum() / n_nodes) + (1 - damping) / n_nodes
+        converged = np.abs(new_rank - rank).sum() < tol
+        rank = new_rank
+        if converged:
+            break
+    return rank
+
+
+######################################################
+############ Blocklist similarity (MinHash) ##########
+######################################################
+
+def minhash_signatures(graph: BlockGraph, n_perm: int = 64, seed: int = 0) -> np.ndarray:
+    """MinHash signatures of the blocklists of the crawled servers.
+
+    Returns:
+        np.ndarray: (n_servers, n_perm) array; rows of servers blocking nothing are all -1.
+    """
+    nodes = graph.server_nodes
+    counts = graph.indptr[nodes + 1] - graph.indptr[nodes]
+    _, positions = graph._gather(graph.indptr, nodes[counts > 0])
+    return minhash(counts, graph.indices[positions], n_perm=n_perm, seed=seed)
+
+
+def blocklist_clusters(signatures: np.ndarray, threshold: float = 0.5, n_bands: int = 16) -> np.ndarray:
+    """Clusters servers whose blocklists have an estimated Jaccard similarity above `threshold`
+    (see minhash.lsh_clusters). Servers blocking nothing and servers similar to no other get -1."""
+    return lsh_clusters(signatures, threshold=threshold, n_bands=n_bands)
+
+
+######################################################
+################ Per server metrics ##################
+######################################################
+
+@profiled("federation_metrics")
+def server_block_metrics(graph: BlockGraph, jaccard_threshold: float = 0.5, n_perm: int = 64,
+                         damping: float = 0.85, seed: int = 0) -> pd.DataFrame:
+    """Network-level moderation metrics of the crawled servers, keyed by server_id.
+
+    Columns: blocks_out, blocked_by, weak_component(_size), strong_component(_size),
+    blockedness (PageRank, scaled so that 1 is the average domain) and blocklist_cluster
+    (servers with similar blocklists, -1 for none).
+    """
+    metrics = graph.server_degrees()
+    components = block_components(graph).iloc[graph.server_nodes].reset_index(drop=True)
+    metrics = pd.concat([metrics, components.drop(columns="domain")], axis=1)
+    metrics["blockedness"] = blockedness(graph, damping=damping)[graph.server_nodes] * graph.n_nodes
+    signatures = minhash_signatures(graph, n_perm=n_perm, seed=seed)
+    metrics["blocklist_cluster"] = blocklist_clusters(signatures, threshold=jaccard_threshold)
+    return metrics
@@ -0,0 +1,102 @@
+"""Import-time benchmark of the analysis modules.
+
+Each module is imported in a fresh interpreter with `python -X importtime`. The check fails
+(exit code 1) when a module takes longer than its budget to import, or when it pulls in one
+of the heavy dependencies that must only be imported on first use.
+
+Usage (from the analysis/ directory):
+    python -m utils.import_budget
+    python -m utils.import_budget --top 15 utils.statistic_analysis
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+
+# Budgets in milliseconds of cumulative import time, pandas and numpy included
+BUDGETS_MS = {
+    "utils": 50,
+    "utils.statistic_analysis": 1000,
+    "utils.SocialMediaDataset": 1000,
+    "utils.SocialMediaDataset_Sa": 1000,
+    "utils.utils": 1000,
+    "utils.profiling": 1000,
+    "utils.pipeline": 1000,
+    "utils.synthetic": 1000,
+    "utils.benchmark": 1000,
+    "utils.federation": 1000,
+    "utils.federation_metrics": 1000,
+    "utils.aggregation": 1000,
+    "utils.strictness": 1000,
+    "utils.topic_model": 1000,
+    "utils.embedding_index": 1000,
+    "utils.dedup": 1000,
+    "utils.minhash": 1000,
+    "utils.strictness_service": 1000,
+    "utils.refresh": 1000,
+    "utils.memory": 1000,
+    "utils.trends": 1000,
+    "utils.topic_sweep": 1000,
+    "utils.server_clustering": 1000,
+    "utils.mock_fediverse": 1000,
+    "utils.lang_backend": 1000,
+    "utils.server_bootstrap": 1000,
+    "utils.multi_platform": 1000,
+    "utils.stratified": 1000,
+    "utils.shards": 1000,
+    "utils.online_stats": 1000,
+}
+
+# Modules that must not be imported as a side effect of importing the analysis modules
+HEAVY_MODULES = ["transformers", "torch", "shap", "sklearn", "seaborn", "matplotlib", "scipy.stats",
+                 "langdetect", "nltk", "bertopic", "umap", "hdbscan", "tqdm"]
+
+
+def import_times(module: str, python: str = sys.executable) -> pd.DataFrame:
+    """Parses the output of `python -X importtime -c 'import module'`.
+
+    Returns:
+        pd.DataFrame: One row per imported module with its self and cumulative time in ms.
+    """
+    analysis_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, cwd=analysis_dir)
+    if result.returncode != 0:
+        raise ImportError(f"Could not import {module}:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append({"module": name.strip(),
+                     "self_ms": int(self_us) / 1000,
+                     "cumulative_ms": int(cumulative_us) / 1000})
+    return pd.DataFrame(rows)
+
+
+def check_budgets(budgets: dict = BUDGETS_MS, top: int = 0) -> bool:
+    """Imports each module and checks its budget. Returns True if every budget is met."""
+    all_ok = True
+    for module, budget_ms in budgets.items():
+        times = import_times(module)
+        total_ms = times.loc[times["module"] == module, "cumulative_ms"].max()
+        heavy = [name for name in HEAVY_MODULES if (times["module"] == name).any()]
+        ok = total_ms <= budget_ms and not heavy
+        all_ok &= ok
+        print(f"{'✅' if ok else '❌'} {module}: {total_ms:.0f} ms (budget {budget_ms} ms)"
+              + (f", imports {', '.join(heavy)}" if heavy else ""))
+        if top:
+            print(times.sort_values("self_ms", ascending=False).head(top).to_string(index=False))
+    return all_ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the import time budgets of the analysis modules.")
+    parser.add_argument("modules", nargs="*", help="Modules to check (default: all modules with a budget).")
+    parser.add_argument("--top", type=int, default=0, help="Also show the N slowest imports of each module.")
+    args = parser.parse_args()
+    budgets = {module: BUDGETS_MS.get(module, 1000) for module in args.modules} if args.modules else BUDGETS_MS
+    sys.exit(0 if check_budgets(budgets, args.top) else 1)
@@ -0,0 +1,243 @@
+"""CPU-optimized inference backends for the language recognition model (spolivin/lang-recogn-model).
+
+CPULangRecognizer is a drop-in replacement of the transformers text-classification pipeline used
+by SocialMediaDataset.detect_english(): called on a text or a list of texts, it returns
+[{"label", "score"}, ...]. Two backends:
+    - "int8": PyTorch dynamic int8 quantization of the Linear layers
+    - "onnx": ONNX export run with ONNX Runtime (weights dynamically quantized to int8 by default)
+The texts are tokenized once, sorted by length and batched, and each batch is padded to its
+longest text rounded up to a multiple of bucket_size only (instead of the longest text of the
+call), which saves most of the padding on short rules and keeps a few distinct input shapes.
+
+Usage (from the analysis/ directory):
+    from utils.SocialMediaDataset import set_lang_backend
+    set_lang_backend("onnx", num_threads=4)    # detect_english() and predicts_english_rules() now use it
+
+    python -m utils.lang_backend --platform mastodon --n-rules 2000 --backends pipeline int8 onnx --threads 4
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+DEFAULT_MODEL = "spolivin/lang-recogn-model"
+BACKENDS = ["pipeline", "int8", "onnx"]
+ONNX_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "socialmedia_project", "onnx")
+
+
+class CPULangRecognizer:
+    """Text classification with a quantized PyTorch model or ONNX Runtime, batched by length.
+
+    Args:
+        backend (str): "int8" or "onnx".
+        num_threads (int): Intra-op threads of PyTorch / ONNX Runtime (default: their own default).
+        batch_size (int): Texts per forward pass.
+        bucket_size (int): Batches are padded to a multiple of this many tokens.
+        max_length (int): Texts are truncated to this many tokens (default: the model maximum, at most 512).
+        quantize_onnx (bool): Whether the ONNX weights are quantized to int8.
+        onnx_dir (str): Where the exported ONNX models are cached.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, backend: str = "int8", num_threads: int = None,
+                 batch_size: int = 64, bucket_size: int = 16, max_length: int = None,
+                 quantize_onnx: bool = True, onnx_dir: str = ONNX_CACHE_DIR) -> None:
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+        if backend not in ("int8", "onnx"):
+            raise ValueError(f"Unknown backend {backend!r}, expected 'int8' or 'onnx'.")
+        self.model_name = model_name
+        self.backend = backend
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+        self.id2label = model.config.id2label
+        self.max_length = max_length or min(self.tokenizer.model_max_length, 512)
+        self.pad_token_id = self.tokenizer.pad_token_id or 0
+
+        if backend == "int8":
+            if num_threads:
+                torch.set_num_threads(num_threads)
+            self.model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            self.session = self._onnx_session(model, num_threads, quantize_onnx, onnx_dir)
+
+    ######################################################
+    ######################## ONNX ########################
+    ######################################################
+
+    def _onnx_session(self, model, num_threads: int, quantize: bool, onnx_dir: str):
+        import onnxruntime
+        model_dir = os.path.join(onnx_dir, self.model_name.replace("/", "--"))
+        os.makedirs(model_dir, exist_ok=True)
+        path = os.path.join(model_dir, "model.onnx")
+        if not os.path.exists(path):
+            self._export_onnx(model, path)
+        if quantize:
+            quantized_path = os.path.join(model_dir, "model.int8.onnx")
+            if not os.path.exists(quantized_path):
+                from onnxruntime.quantization import QuantType, quantize_dynamic
+                quantize_dynamic(path, f"{quantized_path}.tmp", weight_type=QuantType.QInt8)
+                os.replace(f"{quantized_path}.tmp", quantized_path)
+            path = quantized_path
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        return onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+    def _export_onnx(self, model, path: str) -> None:
+        import torch
+        dummy = self.tokenizer(["a short text", "another one"], padding=True, return_tensors="pt")
+        kwargs = dict(input_names=["input_ids", "attention_mask"], output_names=["logits"],
+                      dynamic_axes={"input_ids": {0: "batch", 1: "sequence"},
+                                    "attention_mask": {0: "batch", 1: "sequence"},
+                                    "logits": {0: "batch"}},
+                      opset_version=17)
+        tmp_path = f"{path}.tmp"
+        with torch.no_grad():
+            try:
+                torch.onnx.export(model, (dummy["input_ids"], dummy["attention_mask"]), tmp_path, dynamo=False, **kwargs)
+            except TypeError:  # torch < 2.5 has no dynamo argument
+                torch.onnx.export(model, (dummy["input_ids"], dummy["attention_mask"]), tmp_path, **kwargs)
+        os.replace(tmp_path, path)
+
+    ######################################################
+    ##################### Inference ######################
+    ######################################################
+
+    def batches(self, texts: list):
+        """(positions, input_ids, attention_mask) of length-sorted batches, padded per bucket."""
+        encodings = self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+        lengths = np.fromiter((len(ids) for ids in encodings), dtype=np.int64, count=len(encodings))
+        order = np.argsort(lengths, kind="stable")
+        for start in range(0, len(order), self.batch_size):
+            positions = order[start:start + self.batch_size]
+            width = min(-(-int(lengths[positions].max()) // self.bucket_size) * self.bucket_size, self.max_length)
+            input_ids = np.full((len(positions), width), self.pad_token_id, dtype=np.int64)
+            attention_mask = np.zeros((len(positions), width), dtype=np.int64)
+            for row, position in enumerate(positions):
+                input_ids[row, :lengths[position]] = encodings[position]
+                attention_mask[row, :lengths[position]] = 1
+            yield positions, input_ids, attention_mask
+
+    def logits(self, input_ids: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.backend == "onnx":
+            return self.session.run(["logits"], {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+        import torch
+        with torch.inference_mode():
+            return self.model(input_ids=torch.from_numpy(input_ids),
+                              attention_mask=torch.from_numpy(attention_mask)).logits.numpy()
+
+    def __call__(self, inputs, batch_size: int = None, **kwargs) -> list:
+        """Same output as the text-classification pipeline: [{"label", "score"}] per text."""
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        labels = np.zeros(len(texts), dtype=np.int64)
+        scores = np.zeros(len(texts))
+        for positions, input_ids, attention_mask in self.batches(texts):
+            logits = self.logits(input_ids, attention_mask)
+            probabilities = np.exp(logits - logits.max(axis=1, keepdims=True))
+            probabilities /= probabilities.sum(axis=1, keepdims=True)
+            labels[positions] = probabilities.argmax(axis=1)
+            scores[positions] = probabilities.max(axis=1)
+        return [{"label": self.id2label[int(label)], "score": float(score)} for label, score in zip(labels, scores)]
+
+
+def load_recognizer(backend: str = "pipeline", model_name: str = DEFAULT_MODEL, **kwargs):
+    """The default transformers pipeline ("pipeline") or a CPULangRecognizer ("int8", "onnx")."""
+    if backend == "pipeline":
+        from transformers.pipelines import pipeline
+        return pipeline("text-classification", model=model_name)
+    return CPULangRecognizer(model_name, backend, **kwargs)
+
+
+######################################################
+############## Parity check and benchmark ############
+######################################################
+
+def _labels(recognizer, texts: list, batch_size: int = None) -> list:
+    if batch_size is None:  # as detect_english(), one text at a time
+        return [recognizer(text)[0]["label"] for text in texts]
+    return [result["label"] for start in range(0, len(texts), batch_size)
+            for result in recognizer(texts[start:start + batch_size], batch_size=batch_size)]
+
+
+def parity_check(texts: list, backend: str = "int8", reference: list = None, model_name: str = DEFAULT_MODEL,
+                 **kwargs) -> dict:
+    """Agreement of a backend with the labels of the default pipeline (computed if reference is None).
+
+    Returns:
+        dict: n_texts, label_agreement, english_agreement (same detect_english() decision) and
+            disagreements (DataFrame of the texts labelled differently).
+    """
+    texts = [str(text) for text in texts]
+    if reference is None:
+        reference = _labels(load_recognizer("pipeline", model_name), texts, batch_size=32)
+    labels = _labels(load_recognizer(backend, model_name, **kwargs), texts, batch_size=kwargs.get("batch_size", 64))
+    compared = pd.DataFrame({"text": texts, "reference": reference, "label": labels})
+    english = (compared["reference"] == "English") == (compared["label"] == "English")
+    return {"n_texts": len(texts),
+            "label_agreement": float((compared["reference"] == compared["label"]).mean()),
+            "english_agreement": float(english.mean()),
+            "disagreements": compared[compared["reference"] != compared["label"]].reset_index(drop=True)}
+
+
+def benchmark(texts: list, backends: list = BACKENDS, model_name: str = DEFAULT_MODEL, num_threads: int = None,
+              batch_size: int = 64, bucket_size: int = 16) -> pd.DataFrame:
+    """Throughput (rules/second) and English decision agreement of each backend.
+
+    The "pipeline" backend is measured one text at a time (as detect_english(), the default of
+    predicts_english_rules) and by batches (as with lang_batch_size). Agreement is measured
+    against the one-at-a-time pipeline labels.
+    """
+    texts = [str(text) for text in texts]
+    if num_threads:
+        import torch
+        torch.set_num_threads(num_threads)
+    runs = []
+    for backend in backends:
+        kwargs = {} if backend == "pipeline" else dict(num_threads=num_threads, batch_size=batch_size,
+                                                       bucket_size=bucket_size)
+        recognizer = load_recognizer(backend, model_name, **kwargs)
+        recognizer(texts[:2])  # warm up (lazy initializations, ONNX Runtime allocations)
+        modes = [("pipeline", None), ("pipeline batched", batch_size)] if backend == "pipeline" else [(backend, batch_size)]
+        for name, size in modes:
+            start = time.perf_counter()
+            labels = _labels(recognizer, texts, size)
+            runs.append({"backend": name, "rules": len(texts), "seconds": time.perf_counter() - start, "labels": labels})
+
+    results = pd.DataFrame(runs)
+    results["rules_per_s"] = results["rules"] / results["seconds"]
+    baseline = results.iloc[0]
+    results["speedup"] = results["rules_per_s"] / baseline["rules_per_s"]
+    is_english = [np.asarray(labels) == "English" for labels in results["labels"]]
+    results["english_agreement"] = [float((english == is_english[0]).mean()) for english in is_english]
+    return results.drop(columns="labels")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the CPU backends of the language recognition model.")
+    parser.add_argument("--platform", choices=["mastodon", "reddit"], default="mastodon")
+    parser.add_argument("--data-path", default=None, help="Raw dataset (default: the one of utils.refresh).")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--n-rules", type=int, default=2000, help="Number of rules benchmarked (random sample).")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=BACKENDS)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--bucket-size", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from .refresh import load_dataset
+    dataset = load_dataset(args.platform, args.data_path)
+    dataset.run_pipeline(["clean", "take_english_servers_only", "extract_rules"])
+    column = "text" if "text" in dataset.rules_df.columns else "rules"
+    rules = dataset.rules_df[column].dropna().astype(str)
+    rules = rules.sample(min(args.n_rules, len(rules)), random_state=args.seed).tolist()
+
+    results = benchmark(rules, args.backends, args.model, args.threads, args.batch_size, args.bucket_size)
+    print(results.round(3).to_string(index=False))
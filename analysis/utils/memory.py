@@ -0,0 +1,107 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+def string_dtype():
+    """pyarrow-backed strings when pyarrow is installed, pandas' own string dtype otherwise.
+    Missing values stay NaN, as in object columns."""
+    storage = "pyarrow"
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        storage = "python"
+    try:
+        return pd.StringDtype(storage, na_value=np.nan)
+    except TypeError:  # pandas < 2.3, missing values become pd.NA
+        return pd.StringDtype(storage)
+
+
+def _nested_size(value) -> int:
+    """Size of a python object with the lists, tuples and dicts it contains."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(_nested_size(k) + _nested_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(_nested_size(item) for item in value)
+    return size
+
+
+def memory_usage(df: pd.DataFrame) -> pd.DataFrame:
+    """Deep memory usage of each column (index excluded). Unlike DataFrame.memory_usage(deep=True),
+    the content of nested lists and dicts (e.g. Mastodon rules) is counted."""
+    usage = df.memory_usage(deep=True, index=False)
+    for column in df.columns[(df.dtypes == object).to_numpy()]:
+        if df[column].map(lambda x: isinstance(x, (list, tuple, dict))).any():
+            usage[column] = 8 * len(df) + sum(_nested_size(value) for value in df[column])
+    return pd.DataFrame({"column": usage.index, "dtype": df.dtypes.astype(str).to_numpy(), "bytes": usage.to_numpy()})
+
+
+def _is_boolean(column: pd.Series) -> bool:
+    values = column.dropna()
+    return len(values) > 0 and values.map(type).isin([bool, np.bool_]).all()
+
+
+def _is_string(column: pd.Series) -> bool:
+    return column.dropna().map(type).eq(str).all()
+
+
+# Engagement counts that the analyses subtract, sum or divide (e.g. total_users - active_month):
+# downcast to int32 at most, so that this arithmetic cannot wrap around in an int8 / int16
+COUNT_COLUMNS = ("total_users", "active_month", "total_posts", "moderators_count")
+
+
+def optimize_frame(df: pd.DataFrame, exclude: tuple = ("server_id",),
+                   max_category_ratio: float = 0.5) -> pd.DataFrame:
+    """Smaller dtypes for every column of the frame but the excluded ones.
+
+    - integer columns are downcast to the smallest signed integer type holding their values
+      (never unsigned, so that differences stay negative instead of wrapping around), int32 at
+      least for the COUNT_COLUMNS: cast them to int64 before multiplying them together
+    - object columns of booleans become bool (or the nullable "boolean" if values are missing)
+    - lists of strings (e.g. Mastodon languages) become "|"-joined strings
+    - string columns become categoricals when they have few distinct values (at most
+      max_category_ratio distinct values per row, e.g. languages), pyarrow strings otherwise
+    """
+    df = df.copy()
+    for column in df.columns:
+        if column in exclude:
+            continue
+        values = df[column]
+        if pd.api.types.is_integer_dtype(values) and not isinstance(values.dtype, pd.CategoricalDtype):
+            values = pd.to_numeric(values, downcast="integer")
+            if column in COUNT_COLUMNS and values.dtype.itemsize < 4:
+                values = values.astype(np.int32)
+            df[column] = values
+        elif values.dtype == object and _is_boolean(values):
+            df[column] = values.astype(bool) if values.notna().all() else values.astype("boolean")
+        elif values.dtype == object or pd.api.types.is_string_dtype(values):
+            if values.map(lambda x: isinstance(x, list) and all(isinstance(item, str) for item in x)).all():
+                values = values.map(lambda x: "|".join(map(str, x)))
+            elif not _is_string(values):
+                continue
+            if values.nunique() <= max_category_ratio * len(values):
+                df[column] = values.astype("category")
+            else:
+                df[column] = values.astype(string_dtype())
+    return df
+
+
+def compare_memory(before: pd.DataFrame, after: pd.DataFrame, extra: dict = None) -> pd.DataFrame:
+    """Per column memory usage before and after (outputs of memory_usage()), with a total row.
+
+    Args:
+        extra (dict): Tables created along the optimized layout, {name: DataFrame}, counted in the after total.
+    """
+    report = before.merge(after, on="column", how="outer", suffixes=("_before", "_after"))
+    for name, table in (extra or {}).items():
+        report = pd.concat([report, pd.DataFrame({"column": [f"[{name}]"], "dtype_after": ["table"],
+                                                  "bytes_after": [memory_usage(table)["bytes"].sum()]})],
+                           ignore_index=True)
+    report[["bytes_before", "bytes_after"]] = report[["bytes_before", "bytes_after"]].fillna(0).astype(np.int64)
+    total = pd.DataFrame({"column": ["TOTAL"], "bytes_before": [report["bytes_before"].sum()],
+                          "bytes_after": [report["bytes_after"].sum()]})
+    report = pd.concat([report, total], ignore_index=True)
+    report["ratio"] = report["bytes_after"] / report["bytes_before"].replace(0, np.nan)
+    return report[["column", "dtype_before", "dtype_after", "bytes_before", "bytes_after", "ratio"]]
@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+# Mersenne prime used by the universal hash functions of MinHash
+_PRIME = (1 << 61) - 1
+
+
+def minhash(set_sizes: np.ndarray, members: np.ndarray, n_perm: int = 64, seed: int = 0) -> np.ndarray:
+    """MinHash signatures of sets of non-negative integers.
+
+    Args:
+        set_sizes (np.ndarray): Number of members of each set.
+        members (np.ndarray): Members of all the sets, concatenated in the order of set_sizes.
+
+    Returns:
+        np.ndarray: (n_sets, n_perm) array; rows of empty sets are all -1.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, size=n_perm, dtype=np.int64)
+    b = rng.integers(0, _PRIME, size=n_perm, dtype=np.int64)
+
+    set_sizes = np.asarray(set_sizes)
+    non_empty = np.flatnonzero(set_sizes)
+    signatures = np.full((len(set_sizes), n_perm), -1, dtype=np.int64)
+    if len(non_empty) == 0:
+        return signatures
+
+    members = np.asarray(members).astype(np.uint64)
+    starts = np.r_[0, np.cumsum(set_sizes[non_empty])[:-1]]
+    for k in range(n_perm):
+        # (a x + b) mod p on uint64, wrapping is fine for hashing purposes
+        hashed = (members * np.uint64(a[k]) + np.uint64(b[k])) % np.uint64(_PRIME)
+        signatures[non_empty, k] = np.minimum.reduceat(hashed, starts).astype(np.int64)
+    return signatures
+
+
+def lsh_clusters(signatures: np.ndarray, threshold: float = 0.5, n_bands: int = 16) -> np.ndarray:
+    """Clusters the sets whose estimated Jaccard similarity is above `threshold`.
+
+    Locality-sensitive hashing: the signatures are cut into bands and sets sharing a band go
+    to the same bucket. Each set is linked to the first set of its bucket when their
+    estimated similarity passes the threshold, and clusters are the connected components of
+    these links, numbered by decreasing size. Empty sets and sets similar to no other get -1.
+    """
+    n_sets, n_perm = signatures.shape
+    rows_per_band = n_perm // n_bands
+    non_empty = signatures[:, 0] >= 0
+    candidates = np.flatnonzero(non_empty)
+    links_src, links_dst = [], []
+    for band in range(n_bands):
+        band_sig = signatures[candidates, band * rows_per_band:(band + 1) * rows_per_band]
+        _, bucket = np.unique(band_sig, axis=0, return_inverse=True)
+        bucket = bucket.ravel()
+        order = np.argsort(bucket, kind="stable")
+        sorted_bucket = bucket[order]
+        first = np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]]
+        representative = order[np.flatnonzero(first)][np.cumsum(first) - 1]
+        members = order
+        keep = members != representative
+        src, dst = candidates[members[keep]], candidates[representative[keep]]
+        similar = (signatures[src] == signatures[dst]).mean(axis=1) >= threshold
+        links_src.append(src[similar])
+        links_dst.append(dst[similar])
+
+    links_src, links_dst = np.concatenate(links_src), np.concatenate(links_dst)
+    links = coo_matrix((np.ones(len(links_src)), (links_src, links_dst)), shape=(n_sets, n_sets))
+    _, labels = connected_components(links, directed=False)
+
+    # Relabel by decreasing size, singletons and empty sets are not clusters
+    sizes = np.bincount(labels)
+    labels = np.where((sizes[labels] > 1) & non_empty, labels, -1)
+    clustered = labels >= 0
+    if clustered.any():
+        ranked = pd.Series(labels[clustered]).value_counts().index
+        labels[clustered] = pd.Series(np.arange(len(ranked)), index=ranked)[labels[clustered]].to_numpy()
+    return labels
+
+
+def estimated_jaccard(signatures: np.ndarray, i: int, j: int) -> float:
+    if signatures[i, 0] < 0 or signatures[j, 0] < 0:
+        return 0.0
+    return float((signatures[i] == signatures[j]).mean())
@@ -0,0 +1,371 @@
+"""Local mock of the Mastodon API for thousands of synthetic servers, and a load test of the crawler.
+
+The mock serves, for every domain of a synthetic instance table (see synthetic.generate_mastodon),
+the endpoints read by dataset/Mastodon/test.py under a /<domain> prefix:
+    GET /servers                                   server list, as api.joinmastodon.org/servers
+    GET /<domain>/api/v2/instance                  title, description, languages, rules, active users
+    GET /<domain>/api/v1/instance                  user and status counts
+    GET /<domain>/api/v1/trends/tags               trending tags with their history
+    GET /<domain>/api/v1/instance/domain_blocks    blocked domains, 401 for servers not publishing them
+
+Latency (log-normal), server errors (500), rate limiting (429) and payload sizes are configurable
+(see DEFAULT_BEHAVIOR). The load test points the crawler at the mock and measures its throughput,
+the latency of each endpoint and the completeness of the crawled CSV against the synthetic table.
+
+Usage (from the analysis/ directory):
+    python -m utils.mock_fediverse --domains 2000 --port 8080             # serve only
+    python -m utils.mock_fediverse --load-test --domains 1000 --latency-ms 5 --error-rate 0.02 --crawler-workers 8
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+import numpy as np
+import pandas as pd
+
+from .synthetic import generate_mastodon
+
+
+CRAWLER_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "dataset", "Mastodon", "test.py")
+ENDPOINTS = ["/api/v2/instance", "/api/v1/instance", "/api/v1/trends/tags", "/api/v1/instance/domain_blocks"]
+DEFAULT_BEHAVIOR = {"latency_ms": 20.0,        # median response time
+                    "latency_sigma": 0.5,      # log-normal spread of the response time (tail latency)
+                    "error_rate": 0.01,        # share of requests answered with a 500
+                    "rate_limit_rate": 0.01,   # share of requests answered with a 429 (Retry-After: 1)
+                    "unauthorized_rate": 0.57, # share of servers whose domain_blocks answer 401
+                    "payload_scale": 1.0,      # the descriptions are repeated this many times
+                    "mean_blocks": 300}        # mean number of blocked domains of the publishing servers
+
+
+class MockFediverse:
+    """Mock Mastodon servers of an instance table with the schema of mastodon_instance_info.csv.
+
+    Responses are encoded once per domain and endpoint. Counters of the requests per endpoint and
+    status are kept in `stats`.
+    """
+
+    def __init__(self, instances: pd.DataFrame, behavior: dict = None, seed: int = 0) -> None:
+        self.instances = instances.reset_index(drop=True)
+        self.behavior = {**DEFAULT_BEHAVIOR, **(behavior or {})}
+        self.rows = {domain: i for i, domain in enumerate(self.instances["domain"])}
+        self.stats = {}
+        self.bytes_sent = 0
+        self.server = None
+        self._payloads = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_synthetic(cls, n_domains: int, behavior: dict = None, seed: int = 0) -> "MockFediverse":
+        behavior = {**DEFAULT_BEHAVIOR, **(behavior or {})}
+        instances = generate_mastodon(n_domains, seed=seed, blacklist_rate=1 - behavior["unauthorized_rate"],
+                                      mean_blocks=behavior["mean_blocks"])
+        return cls(instances, behavior, seed)
+
+    ######################################################
+    ###################### Payloads ######################
+    ######################################################
+
+    def _payload(self, domain: str, endpoint: str):
+        """(status, JSON bytes) of an endpoint of a domain, before error injection."""
+        key = (domain, endpoint)
+        if key not in self._payloads:
+            self._payloads[key] = self._encode(self.instances.iloc[self.rows[domain]], endpoint)
+        return self._payloads[key]
+
+    def _encode(self, row: pd.Series, endpoint: str):
+        def value(x):
+            return None if pd.isna(x) else int(x)
+
+        if endpoint == "/api/v2/instance":
+            payload = {"domain": row["domain"], "title": row["title"], "source_url": row["source_url"],
+                       "description": " ".join([row["description"]] * max(1, round(self.behavior["payload_scale"]))),
+                       "usage": {"users": {"active_month": value(row["active_month"])}},
+                       "languages": json.loads(row["languages"]), "rules": json.loads(row["rules"])}
+        elif endpoint == "/api/v1/instance":
+            payload = {"uri": row["domain"],
+                       "stats": {"user_count": value(row["total_users"]), "status_count": value(row["total_posts"])}}
+        elif endpoint == "/api/v1/trends/tags":
+            payload = [{"name": f"tag{i}", "url": f"https://{row['domain']}/tags/tag{i}", "history": [history]}
+                       for i, history in enumerate(json.loads(row["top_5_trends"]))]
+        else:
+            if pd.isna(row["blacklist"]):
+                return 401, json.dumps({"error": "This API requires an authenticated user"}).encode("utf-8")
+            payload = [{"domain": blocked, "digest": "", "severity": "suspend", "comment": ""}
+                       for blocked in row["blacklist"].split(" | ") if blocked]
+        return 200, json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+    def _servers(self) -> bytes:
+        if "/servers" not in self._payloads:
+            self._payloads["/servers"] = json.dumps([{"domain": domain} for domain in self.rows]).encode("utf-8")
+        return self._payloads["/servers"]
+
+    ######################################################
+    ###################### Serving #######################
+    ######################################################
+
+    def _draw(self):
+        """Simulated latency (seconds) and injected status (None for a normal response) of one request."""
+        with self._lock:
+            latency = self._random.lognormvariate(np.log(self.behavior["latency_ms"] / 1000), self.behavior["latency_sigma"]) \
+                if self.behavior["latency_ms"] > 0 else 0.0
+            draw = self._random.random()
+        if draw < self.behavior["error_rate"]:
+            return latency, 500
+        if draw < self.behavior["error_rate"] + self.behavior["rate_limit_rate"]:
+            return latency, 429
+        return latency, None
+
+    def handle(self, path: str):
+        """(status, body, endpoint) of a GET request."""
+        url = urlparse(path)
+        if url.path.rstrip("/") == "/servers":
+            return 200, self._servers(), "/servers"
+        domain, _, rest = url.path.lstrip("/").partition("/")
+        domain, endpoint = unquote(domain), "/" + rest.rstrip("/")
+        if domain not in self.rows or endpoint not in ENDPOINTS:
+            return 404, b'{"error": "Record not found"}', "unknown"
+        latency, injected = self._draw()
+        time.sleep(latency)
+        if injected == 500:
+            return 500, b'{"error": "Internal server error"}', endpoint
+        if injected == 429:
+            return 429, b'{"error": "Too many requests"}', endpoint
+        status, body = self._payload(domain, endpoint)
+        return status, body, endpoint
+
+    def _count(self, endpoint: str, status: int, n_bytes: int) -> None:
+        with self._lock:
+            self.stats[(endpoint, status)] = self.stats.get((endpoint, status), 0) + 1
+            self.bytes_sent += n_bytes
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serves in a background thread. Returns the base URL template of the servers ("{domain}" placeholder)."""
+        mock = self
+
+        class MockHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                status, body, endpoint = mock.handle(self.path)
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    if status == 429:
+                        self.send_header("Retry-After", "1")
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):  # the client timed out
+                    mock._count(endpoint, "aborted", 0)
+                    return
+                mock._count(endpoint, status, len(body))
+
+        class MockServer(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 1024
+
+            def handle_error(self, request, client_address):
+                if not isinstance(sys.exc_info()[1], ConnectionError):  # clients giving up are expected
+                    super().handle_error(request, client_address)
+
+        self.server = MockServer((host, port), MockHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    @property
+    def address(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self) -> str:
+        return self.address + "/{domain}"
+
+    @property
+    def servers_url(self) -> str:
+        return self.address + "/servers"
+
+    def shutdown(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def stats_table(self) -> pd.DataFrame:
+        with self._lock:
+            stats = dict(self.stats)
+        table = pd.DataFrame([{"endpoint": endpoint, "status": str(status), "requests": n}
+                              for (endpoint, status), n in stats.items()])
+        return table.sort_values(["endpoint", "status"], ignore_index=True) if len(table) else table
+
+
+######################################################
+##################### Load test ######################
+######################################################
+
+def load_crawler(path: str = CRAWLER_PATH):
+    """The crawler script as a module (its file name, test.py, would shadow the stdlib test package)."""
+    crawler_dir = os.path.dirname(os.path.abspath(path))
+    if crawler_dir not in sys.path:  # for its sibling modules (telemetry.py)
+        sys.path.append(crawler_dir)
+    spec = importlib.util.spec_from_file_location("mastodon_crawler", path)
+    crawler = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(crawler)
+    return crawler
+
+
+class _TimedRequests:
+    """Stand-in for the `requests` module of the crawler recording the latency and status of each GET."""
+
+    def __init__(self, requests_module) -> None:
+        self._requests = requests_module
+        self.records = []
+
+    def get(self, url, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self._requests.get(url, *args, **kwargs)
+            status = response.status_code
+            return response
+        except Exception:
+            status = -1  # connection error or timeout
+            raise
+        finally:
+            self.records.append((urlparse(url).path, status, time.perf_counter() - start))
+
+    def __getattr__(self, name):
+        return getattr(self._requests, name)
+
+
+def completeness(crawled: pd.DataFrame, truth: pd.DataFrame) -> dict:
+    """Share of the servers crawled, and of the crawled servers whose fields match the mock data."""
+    merged = crawled.merge(truth, on="domain", how="left", suffixes=("", "_truth"))
+
+    def same_json(a, b):
+        try:
+            return json.loads(a) == json.loads(b)
+        except (TypeError, ValueError):
+            return False
+
+    def same_blocks(a, b):
+        if pd.isna(b):  # not published: nothing to crawl
+            return pd.isna(a) or a == ""
+        return not pd.isna(a) and set(a.split(" | ")) == set(b.split(" | "))
+
+    n = max(len(merged), 1)
+    return {"servers": len(crawled) / len(truth),
+            "rules": sum(map(same_json, merged["rules"], merged["rules_truth"])) / n,
+            "languages": sum(map(same_json, merged["languages"], merged["languages_truth"])) / n,
+            "trends": sum(map(same_json, merged["top_5_trends"], merged["top_5_trends_truth"])) / n,
+            "total_users": float((pd.to_numeric(merged["total_users"], errors="coerce").fillna(-1)
+                                  == merged["total_users_truth"].fillna(-1)).mean()) if len(merged) else 0.0,
+            "blacklist": sum(map(same_blocks, merged["blacklist"], merged["blacklist_truth"])) / n}
+
+
+def load_test(n_domains: int = 1000, behavior: dict = None, crawler_workers: int = 1,
+              crawler_path: str = CRAWLER_PATH, timeout: float = 10, seed: int = 0) -> dict:
+    """Crawls a mock of n_domains servers with dataset/Mastodon/test.py.
+
+    With crawler_workers > 1, the domain list is split into that many shards crawled in parallel
+    threads (each into its own CSV), as a parallel crawler would.
+
+    Returns:
+        dict: "summary" (throughput, completeness, failed requests and, separately, the expected
+            401s of unpublished domain blocks), "latency" (percentiles per endpoint, client
+            side, DataFrame), "statuses" (requests per endpoint and status seen by the mock, DataFrame)
+            and "telemetry" (snapshot of the crawler's own telemetry, when it has some).
+    """
+    mock = MockFediverse.from_synthetic(n_domains, behavior, seed)
+    mock.start()
+    crawler = load_crawler(crawler_path)
+    crawler.BASE_URL, crawler.SERVERS_URL, crawler.TIMEOUT = mock.base_url, mock.servers_url, timeout
+    timed = _TimedRequests(crawler.requests)
+    crawler.requests = timed
+    work_dir = tempfile.mkdtemp(prefix="mock_fediverse_")
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            start = time.perf_counter()
+            domains = crawler.fetch_domains()
+            shards = [domains[i::crawler_workers] for i in range(crawler_workers)]
+            paths = [os.path.join(work_dir, f"crawl_{i}.csv") for i in range(crawler_workers)]
+            with ThreadPoolExecutor(crawler_workers) as executor:
+                list(executor.map(crawler.crawl, shards, paths))
+            elapsed = time.perf_counter() - start
+        crawled = pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+    finally:
+        mock.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    records = pd.DataFrame(timed.records, columns=["path", "status", "seconds"])
+    records["endpoint"] = records["path"].map(lambda path: next((e for e in ENDPOINTS if path.endswith(e)), path))
+    latency = records.groupby("endpoint")["seconds"].describe(percentiles=[0.5, 0.95, 0.99])
+    latency = (latency[["count", "50%", "95%", "99%", "max"]] * [1, 1000, 1000, 1000, 1000]).rename(
+        columns={"count": "requests", "50%": "p50_ms", "95%": "p95_ms", "99%": "p99_ms", "max": "max_ms"})
+    # The 401s of the servers not publishing their domain blocks are expected answers, not failures
+    unauthorized = (records["endpoint"] == "/api/v1/instance/domain_blocks") & (records["status"] == 401)
+    summary = {"domains": n_domains,
+               "crawler_workers": crawler_workers,
+               "seconds": elapsed,
+               "domains_per_s": len(domains) / elapsed,
+               "requests_per_s": len(records) / elapsed,
+               "requests": len(records),
+               "failed_requests": int((~records["status"].between(200, 299) & ~unauthorized).sum()),
+               "unauthorized_requests": int(unauthorized.sum()),
+               "mb_received": mock.bytes_sent / 2**20,
+               "crawler_log_lines": log.getvalue().count("\n"),
+               **{f"complete_{field}": share for field, share in completeness(crawled, mock.instances).items()}}
+    telemetry = crawler.TELEMETRY.snapshot() if hasattr(crawler, "TELEMETRY") else None
+    return {"summary": summary, "latency": latency.reset_index(), "statuses": mock.stats_table(), "telemetry": telemetry}
+
+
+def _behavior(args) -> dict:
+    return {"latency_ms": args.latency_ms, "latency_sigma": args.latency_sigma, "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate, "unauthorized_rate": args.unauthorized_rate,
+            "payload_scale": args.payload_scale, "mean_blocks": args.mean_blocks}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock fediverse servers and crawler load test.")
+    parser.add_argument("--domains", type=int, default=1000, help="Number of synthetic servers.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--seed", type=int, default=0)
+    for name, default in DEFAULT_BEHAVIOR.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(default), default=default)
+    parser.add_argument("--load-test", action="store_true", help="Crawl the mock with dataset/Mastodon/test.py.")
+    parser.add_argument("--crawler-workers", type=int, default=1)
+    parser.add_argument("--crawler-path", default=CRAWLER_PATH)
+    parser.add_argument("--timeout", type=float, default=10, help="Request timeout of the crawler (s).")
+    args = parser.parse_args()
+
+    if args.load_test:
+        result = load_test(args.domains, _behavior(args), args.crawler_workers, args.crawler_path, args.timeout, args.seed)
+        print(pd.Series(result["summary"]).round(3).to_string())
+        print(result["latency"].round(2).to_string(index=False))
+        print(result["statuses"].to_string(index=False))
+    else:
+        mock = MockFediverse.from_synthetic(args.domains, _behavior(args), args.seed)
+        mock.start(args.host, args.port)
+        print(f"Serving {args.domains} mock servers on {mock.base_url} (server list: {mock.servers_url}) 🐘")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            mock.shutdown()
@@ -0,0 +1,225 @@
+"""Mastodon and Reddit in one dataset: one instance table and one rules table, tagged by platform.
+
+The tables are Arrow tables (pyarrow), built once from the processed MastodonDataset /
+RedditDataset: the columns are renamed to the common names of col_equiv_mas_and_red, the
+languages become a list of codes on both platforms, and the columns of a single platform are
+null for the other one. Every server gets a global key `uid` (platform code in the high 32 bits,
+server_id of its platform in the low ones), so that the rules of both platforms can be
+aggregated together. Cross-platform filters, group-bys and comparisons then run in one pass
+over the unified tables, instead of concatenating per-platform frames each time (the
+notebooks' `platforms_serv_descr = pd.concat([...])`).
+
+Usage (from the analysis/ directory):
+    unified = MultiPlatformDataset.load()                   # runs both pipelines
+    unified.compare(["total_users", "active_month"])        # per-platform statistics
+    unified.group_by(["platform", "Topic"], {"strictness": ["mean", "count"]}, table="rules")
+    english = unified.filter(instances=pc.field("english_server"), rules=pc.field("strictness") > 0)
+    unified.to_parquet("unified/")
+
+    python -m utils.multi_platform --output-dir unified/ --cache-dir .cache/
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from .aggregation import aggregate_rules
+
+
+PLATFORMS = ["mastodon", "reddit"]
+# Platform labels of the notebooks' M_or_R column
+PLATFORM_NAMES = {"mastodon": "Mastodon", "reddit": "Reddit"}
+# Instance columns moved to the rules table rather than kept in the instance table
+NESTED_COLUMNS = ["rules"]
+RULE_COLUMNS = ["rule_id", "text", "hint", "rules", "canonical_id", "is_english_pred",
+                "strict_hits", "lenient_hits", "strictness", "Topic"]
+
+
+def server_uid(platform_code: int, server_id) -> np.ndarray:
+    """Global server key: platform code in the high 32 bits, per-platform server_id in the low ones."""
+    return (np.int64(platform_code) << 32) + np.asarray(server_id, dtype=np.int64)
+
+
+def _language_list(value) -> list:
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [str(language) for language in value]
+    if isinstance(value, str) and value:
+        return value.split("|")  # lists are "|"-joined by optimize_memory()
+    return []
+
+
+def _to_arrow(df: pd.DataFrame, platform: str) -> pa.Table:
+    """Columns of a per-platform frame as Arrow arrays; columns pyarrow cannot convert are skipped."""
+    arrays = {"platform": pa.array([PLATFORM_NAMES[platform]] * len(df), pa.string())}
+    for column in df.columns:
+        try:
+            array = pa.array(df[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            print(f"Skipped the {platform} column {column!r}, which has no Arrow type ⚠️")
+            continue
+        # Categoricals of optimize_memory() would not concatenate with the plain strings of another platform
+        arrays[column] = array.dictionary_decode() if pa.types.is_dictionary(array.type) else array
+    return pa.table(arrays)
+
+
+def platform_tables(dataset, platform: str) -> tuple:
+    """(instances, rules) Arrow tables of one processed dataset, with the common column names."""
+    code = PLATFORMS.index(platform)
+    servers = dataset.df.rename(columns=dataset.col_equiv_mas_and_red).drop(columns=NESTED_COLUMNS, errors="ignore")
+    servers = servers.loc[:, ~servers.columns.duplicated()].copy()
+    if "languages" in servers.columns:
+        servers["languages"] = servers["languages"].map(_language_list)
+    english = dataset.df_en["server_id"] if dataset.df_en is not None else servers["server_id"]
+    servers["english_server"] = servers["server_id"].isin(english)
+    servers.insert(0, "uid", server_uid(code, servers["server_id"]))
+
+    rules = pd.DataFrame({"uid": server_uid(code, dataset.rules_df["server_id"]),
+                          "server_id": dataset.rules_df["server_id"].to_numpy()})
+    for column in RULE_COLUMNS:
+        if column in dataset.rules_df.columns:
+            values = dataset.rules_df[column]
+            rules[column] = values.astype(str).to_numpy() if column == "rule_id" else values.to_numpy()
+    if "rules" in rules.columns:  # Reddit rules are plain texts, Mastodon ones have a text and a hint
+        rules = rules.rename(columns={"rules": "text"}) if "text" not in rules.columns else rules.drop(columns="rules")
+    return _to_arrow(servers, platform), _to_arrow(rules, platform)
+
+
+class MultiPlatformDataset:
+    """Harmonized instances and rules of several platforms, as two Arrow tables.
+
+    Attributes:
+        instances (pa.Table): One row per server: platform, uid, server_id, the common columns
+            (domain, title, description, languages, total_users, active_month), english_server
+            and the columns specific to a platform (null elsewhere).
+        rules (pa.Table): One row per rule: platform, uid, server_id, rule_id, text, hint and the
+            rule metrics computed by the pipelines (strictness, lexicon hits, is_english_pred, Topic).
+    """
+
+    def __init__(self, instances: pa.Table, rules: pa.Table) -> None:
+        self.instances = instances
+        self.rules = rules
+        self._frames = {}
+
+    @classmethod
+    def from_datasets(cls, datasets: dict) -> "MultiPlatformDataset":
+        """From processed datasets, {platform: MastodonDataset / RedditDataset}. The per-platform
+        tables are concatenated without copying their columns (chunked arrays); columns whose
+        integer types differ between platforms (e.g. after optimize_memory()) are widened."""
+        tables = [platform_tables(dataset, platform) for platform, dataset in datasets.items()]
+        return cls(pa.concat_tables([instances for instances, _ in tables], promote_options="permissive"),
+                   pa.concat_tables([rules for _, rules in tables], promote_options="permissive"))
+
+    @classmethod
+    def load(cls, platforms: list = PLATFORMS, data_paths: dict = None, cache_dir: str = None,
+             stages: list = None) -> "MultiPlatformDataset":
+        """Loads the raw datasets and runs their pipelines (see refresh.load_dataset())."""
+        from .refresh import load_dataset
+        data_paths = data_paths or {}
+        datasets = {}
+        for platform in platforms:
+            datasets[platform] = load_dataset(platform, data_paths.get(platform), cache_dir)
+            datasets[platform].run_pipeline(stages)
+        return cls.from_datasets(datasets)
+
+    ######################################################
+    ###################### Storage #######################
+    ######################################################
+
+    def to_parquet(self, directory: str) -> None:
+        """Writes instances.parquet and rules.parquet (atomically) in the directory."""
+        os.makedirs(directory, exist_ok=True)
+        for name, table in [("instances", self.instances), ("rules", self.rules)]:
+            path = os.path.join(directory, f"{name}.parquet")
+            pq.write_table(table, f"{path}.tmp", compression="zstd")
+            os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def read_parquet(cls, directory: str) -> "MultiPlatformDataset":
+        return cls(pq.read_table(os.path.join(directory, "instances.parquet")),
+                   pq.read_table(os.path.join(directory, "rules.parquet")))
+
+    ######################################################
+    ###################### Queries #######################
+    ######################################################
+
+    def frame(self, table: str = "instances") -> pd.DataFrame:
+        """Arrow-backed pandas view of a table (pd.ArrowDtype columns, no conversion to NumPy)."""
+        if table not in self._frames:
+            self._frames[table] = getattr(self, table).to_pandas(types_mapper=pd.ArrowDtype)
+        return self._frames[table]
+
+    @property
+    def platforms(self) -> list:
+        return pc.unique(self.instances["platform"]).to_pylist()
+
+    def filter(self, instances: pc.Expression = None, rules: pc.Expression = None,
+               platforms: list = None) -> "MultiPlatformDataset":
+        """Subset of the servers and rules, e.g. filter(instances=pc.field("total_users") > 100).
+
+        The rules are restricted to the servers kept, and the servers to those with a rule
+        matching `rules` when it is given.
+        """
+        instance_table, rule_table = self.instances, self.rules
+        if platforms is not None:
+            names = pa.array([PLATFORM_NAMES.get(platform, platform) for platform in platforms])
+            instance_table = instance_table.filter(pc.is_in(instance_table["platform"], names))
+        if instances is not None:
+            instance_table = instance_table.filter(instances)
+        if rules is not None:
+            rule_table = rule_table.filter(rules)
+            instance_table = instance_table.filter(pc.is_in(instance_table["uid"], pc.unique(rule_table["uid"])))
+        rule_table = rule_table.filter(pc.is_in(rule_table["uid"], instance_table["uid"]))
+        return MultiPlatformDataset(instance_table, rule_table)
+
+    def group_by(self, keys: list, aggregations: dict, table: str = "instances") -> pd.DataFrame:
+        """Arrow group-by over both platforms at once, e.g.
+        group_by(["platform"], {"total_users": ["mean", "max"], "uid": ["count"]}).
+
+        Returns:
+            pd.DataFrame: One row per group, columns <column>_<aggregation>.
+        """
+        aggregate = [(column, function) for column, functions in aggregations.items() for function in functions]
+        grouped = getattr(self, table).group_by(keys).aggregate(aggregate)
+        return grouped.to_pandas(types_mapper=pd.ArrowDtype).sort_values(keys, ignore_index=True)
+
+    def compare(self, columns: list, table: str = "instances",
+                functions: tuple = ("count", "mean", "stddev", "min", "approximate_median", "max")) -> pd.DataFrame:
+        """Statistics of numeric columns on each platform, one row per (platform, column)."""
+        grouped = self.group_by(["platform"], {column: list(functions) for column in columns}, table)
+        rows = [{"platform": row["platform"], "column": column,
+                 **{function: row[f"{column}_{function}"] for function in functions}}
+                for row in grouped.to_dict("records") for column in columns]
+        return pd.DataFrame(rows)
+
+    def server_table(self, topic_col: str = "Topic") -> pd.DataFrame:
+        """aggregation.aggregate_rules() over the rules of all platforms at once, joined with the
+        platform, server_id and domain of each server."""
+        rules = self.rules.select([column for column in ["uid", "strictness", "strict_hits", "lenient_hits",
+                                                         "is_english_pred", topic_col] if column in self.rules.column_names])
+        aggregates = aggregate_rules(rules.to_pandas().rename(columns={"uid": "server_id"}), topic_col=topic_col)
+        aggregates = aggregates.rename(columns={"server_id": "uid"})
+        servers = self.instances.select(["uid", "platform", "server_id", "domain"]).to_pandas()
+        return servers.merge(aggregates, on="uid", how="inner")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the unified Mastodon + Reddit tables.")
+    parser.add_argument("--platforms", nargs="+", choices=PLATFORMS, default=PLATFORMS)
+    parser.add_argument("--mastodon-path", default=None)
+    parser.add_argument("--reddit-path", default=None)
+    parser.add_argument("--cache-dir", default=None, help="Cache of the pipeline stages.")
+    parser.add_argument("--output-dir", default=None, help="Write instances.parquet and rules.parquet here.")
+    args = parser.parse_args()
+
+    unified = MultiPlatformDataset.load(args.platforms, {"mastodon": args.mastodon_path, "reddit": args.reddit_path},
+                                        args.cache_dir)
+    print(f"{unified.instances.num_rows} servers and {unified.rules.num_rows} rules of {', '.join(unified.platforms)} 🌐")
+    print(unified.compare(["total_users", "active_month"]).to_string(index=False))
+    print(unified.compare(["strictness"], table="rules").to_string(index=False))
+    if args.output_dir:
+        unified.to_parquet(args.output_dir)
+        print(f"Wrote the unified tables to {args.output_dir} 💾")
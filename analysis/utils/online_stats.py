@@ -0,0 +1,366 @@
+"""Incremental Pearson, Spearman and Kendall correlations across crawl snapshots.
+
+The correlations of statistic_analysis.ipynb (e.g. strictness vs active_month or total_users)
+are tracked over re-crawls without being recomputed from scratch on every snapshot. Only the
+servers whose values changed since the previous snapshot, and those that left the rolling time
+window, update the statistics:
+    - Pearson: Welford / Chan moments (means, sums of squared deviations and co-deviations),
+      added and removed by batches, O(changed servers)
+    - Spearman: the average ranks of the current servers are shifted in place when a server is
+      added or removed, and the sum of the rank products is updated along (the sums of the
+      ranks and squared ranks only depend on n and the tie counts)
+    - Kendall: the number of concordant minus discordant pairs is updated with the pairs of the
+      added / removed server, the tie counts of tau-b with the counts of each value
+The rank updates are one vectorized pass over the current servers per changed server; when
+more than max_incremental servers changed, the ranks are rebuilt with one sort instead. The
+values are exact (the ranks are multiples of 1/2), p-values are those of scipy (asymptotic
+for Kendall).
+
+Usage (from the analysis/ directory):
+    tracker = CorrelationTracker(pairs=[("strictness", "active_month")], window="90D")
+    for crawled_at, servers in snapshots:              # one server table per crawl
+        tracker.update(servers, crawled_at)
+    tracker.trend_table()
+
+    python -m utils.online_stats out/2025-01/mastodon_server_strictness.csv out/2025-02/mastodon_server_strictness.csv
+"""
+import argparse
+import ast
+import json
+import os
+from collections import Counter, deque
+
+import numpy as np
+import pandas as pd
+
+
+# Correlations reported in statistic_analysis.ipynb
+DEFAULT_PAIRS = [("strictness", "active_month"), ("strictness", "total_users"), ("strictness", "active_rate"),
+                 ("rules_num", "active_month"), ("rules_num", "total_users"), ("rules_num", "active_rate")]
+
+
+def _tie_terms(count: int) -> np.ndarray:
+    """Tie terms of a group of `count` equal values: pairs, t(t-1)(t-2), t(t-1)(2t+5), t^3 - t."""
+    t = float(count)
+    return np.array([t * (t - 1) / 2, t * (t - 1) * (t - 2), t * (t - 1) * (2 * t + 5), t ** 3 - t])
+
+
+class OnlineCorrelation:
+    """Pearson, Spearman and Kendall tau-b correlations of a set of (key, x, y) points that are
+    added, updated and removed over time.
+
+    Args:
+        max_incremental (int): Above this many changed points in one update, the ranks and the
+            Kendall statistic are rebuilt from scratch (O(n log n)) rather than updated point by
+            point (O(n) each). Both cost about the same around 16-24 changes, whatever n.
+    """
+
+    def __init__(self, max_incremental: int = 16) -> None:
+        self.max_incremental = max_incremental
+        self.positions = {}
+        self.keys = []
+        self.x, self.y = np.zeros(0), np.zeros(0)
+        self.rx, self.ry = np.zeros(0), np.zeros(0)
+        self.n = 0
+        # Pearson moments
+        self.mean_x = self.mean_y = 0.0
+        self.m2_x = self.m2_y = self.c_xy = 0.0
+        # Rank statistics: sum of the rank products, concordant minus discordant pairs, tie terms
+        self.sum_rxry = 0.0
+        self.s = 0
+        self.x_counts, self.y_counts = Counter(), Counter()
+        self.x_ties, self.y_ties = np.zeros(4), np.zeros(4)
+
+    ######################################################
+    ####################### Updates ######################
+    ######################################################
+
+    def update(self, keys, x, y, removed=()) -> int:
+        """Sets the (x, y) values of the given keys (added or replaced) and removes the `removed`
+        keys. Points whose values did not change cost nothing. Returns the number of changes."""
+        keys, x, y = np.asarray(keys, dtype=object), np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        removals = [key for key in dict.fromkeys(removed) if key in self.positions]
+        # Changed points found in one vectorized comparison, only those are visited below
+        positions = np.fromiter(map(self.positions.get, keys, [-1] * len(keys)), dtype=np.int64, count=len(keys))
+        known = positions >= 0
+        changed = ~known
+        changed[known] = (self.x[positions[known]] != x[known]) | (self.y[positions[known]] != y[known])
+        removals += keys[changed & known].tolist()
+        insertions = list(zip(keys[changed].tolist(), x[changed].tolist(), y[changed].tolist()))
+        if not removals and not insertions:
+            return 0
+
+        removal_positions = [self.positions[key] for key in removals]
+        self._pearson(self.x[removal_positions], self.y[removal_positions], self.n, sign=-1)
+        self._pearson(np.array([xi for _, xi, _ in insertions]), np.array([yi for _, _, yi in insertions]),
+                      self.n - len(removals), sign=1)
+        incremental = len(removals) + len(insertions) <= self.max_incremental
+        for key in removals:
+            self._remove(key, incremental)
+        for key, xi, yi in insertions:
+            self._insert(key, xi, yi, incremental)
+        if not incremental:
+            self._rebuild_ranks()
+        return len(removals) + len(insertions)
+
+    def _pearson(self, x: np.ndarray, y: np.ndarray, n_current: int, sign: int) -> None:
+        """Adds (sign=1) or removes (sign=-1) a batch of points from the moments of n_current
+        points (Chan et al.)."""
+        n_batch = len(x)
+        if n_batch == 0:
+            return
+        mean_bx, mean_by = x.mean(), y.mean()
+        m2_bx, m2_by = ((x - mean_bx) ** 2).sum(), ((y - mean_by) ** 2).sum()
+        c_b = ((x - mean_bx) * (y - mean_by)).sum()
+        if sign > 0:
+            n_total = n_current + n_batch
+            dx, dy = mean_bx - self.mean_x, mean_by - self.mean_y
+            self.mean_x += dx * n_batch / n_total
+            self.mean_y += dy * n_batch / n_total
+            self.m2_x += m2_bx + dx * dx * n_current * n_batch / n_total
+            self.m2_y += m2_by + dy * dy * n_current * n_batch / n_total
+            self.c_xy += c_b + dx * dy * n_current * n_batch / n_total
+            return
+        n_rest = n_current - n_batch
+        if n_rest <= 0:
+            self.mean_x = self.mean_y = self.m2_x = self.m2_y = self.c_xy = 0.0
+            return
+        mean_rx = (n_current * self.mean_x - n_batch * mean_bx) / n_rest
+        mean_ry = (n_current * self.mean_y - n_batch * mean_by) / n_rest
+        dx, dy = mean_bx - mean_rx, mean_by - mean_ry
+        self.m2_x = max(self.m2_x - m2_bx - dx * dx * n_rest * n_batch / n_current, 0.0)
+        self.m2_y = max(self.m2_y - m2_by - dy * dy * n_rest * n_batch / n_current, 0.0)
+        self.c_xy -= c_b + dx * dy * n_rest * n_batch / n_current
+        self.mean_x, self.mean_y = mean_rx, mean_ry
+
+    def _count(self, counts: Counter, ties: np.ndarray, value: float, step: int) -> None:
+        count = counts[value]
+        ties += _tie_terms(count + step) - _tie_terms(count)
+        if count + step:
+            counts[value] = count + step
+        else:
+            del counts[value]
+
+    def _insert(self, key, a: float, b: float, incremental: bool) -> None:
+        n = self.n
+        if n == len(self.x):  # grow the arrays by doubling
+            capacity = max(2 * n, 16)
+            for name in ["x", "y", "rx", "ry"]:
+                grown = np.zeros(capacity)
+                grown[:n] = getattr(self, name)[:n]
+                setattr(self, name, grown)
+        if incremental and n:
+            xs, ys, rx, ry = self.x[:n], self.y[:n], self.rx[:n], self.ry[:n]
+            shift_x = (xs > a) + 0.5 * (xs == a)
+            shift_y = (ys > b) + 0.5 * (ys == b)
+            self.sum_rxry += (rx * shift_y + ry * shift_x + shift_x * shift_y).sum()
+            rx += shift_x
+            ry += shift_y
+            self.s += int((np.sign(a - xs) * np.sign(b - ys)).sum())
+            self.rx[n] = 1 + (xs < a).sum() + 0.5 * (xs == a).sum()
+            self.ry[n] = 1 + (ys < b).sum() + 0.5 * (ys == b).sum()
+        elif incremental:
+            self.rx[n] = self.ry[n] = 1.0
+        if incremental:
+            self.sum_rxry += self.rx[n] * self.ry[n]
+        self.x[n], self.y[n] = a, b
+        self.positions[key] = n
+        self.keys.append(key)
+        self.n = n + 1
+        self._count(self.x_counts, self.x_ties, a, 1)
+        self._count(self.y_counts, self.y_ties, b, 1)
+
+    def _remove(self, key, incremental: bool) -> None:
+        position = self.positions.pop(key)
+        last = self.n - 1
+        a, b = self.x[position], self.y[position]
+        if incremental:
+            self.sum_rxry -= self.rx[position] * self.ry[position]
+        # The last point takes the place of the removed one
+        for array in [self.x, self.y, self.rx, self.ry]:
+            array[position] = array[last]
+        if position != last:
+            self.keys[position] = self.keys[last]
+            self.positions[self.keys[position]] = position
+        self.keys.pop()
+        self.n = last
+        if incremental and last:
+            xs, ys, rx, ry = self.x[:last], self.y[:last], self.rx[:last], self.ry[:last]
+            shift_x = (xs > a) + 0.5 * (xs == a)
+            shift_y = (ys > b) + 0.5 * (ys == b)
+            self.sum_rxry -= (rx * shift_y + ry * shift_x - shift_x * shift_y).sum()
+            rx -= shift_x
+            ry -= shift_y
+            self.s -= int((np.sign(a - xs) * np.sign(b - ys)).sum())
+        self._count(self.x_counts, self.x_ties, a, -1)
+        self._count(self.y_counts, self.y_ties, b, -1)
+
+    def _rebuild_ranks(self) -> None:
+        from scipy.stats import kendalltau, rankdata
+        n = self.n
+        xs, ys = self.x[:n], self.y[:n]
+        self.rx[:n], self.ry[:n] = rankdata(xs), rankdata(ys)
+        self.sum_rxry = float((self.rx[:n] * self.ry[:n]).sum())
+        pairs = n * (n - 1) / 2
+        tau = kendalltau(xs, ys).statistic if n > 1 else np.nan
+        norm = np.sqrt((pairs - self.x_ties[0]) * (pairs - self.y_ties[0]))
+        self.s = int(round(tau * norm)) if np.isfinite(tau) else 0
+
+    ######################################################
+    ###################### Results #######################
+    ######################################################
+
+    def correlations(self) -> dict:
+        """n, and the coefficient and two-sided p-value of each correlation (NaN if undefined)."""
+        from scipy.stats import norm, t as student
+        n = self.n
+        results = {"n": n}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            r = np.clip(self.c_xy / np.sqrt(self.m2_x * self.m2_y), -1, 1) if n > 2 else np.nan
+            mean_rank = (n + 1) / 2
+            base = n * (n + 1) * (2 * n + 1) / 6 - n * mean_rank ** 2
+            rho = ((self.sum_rxry - n * mean_rank ** 2) /
+                   np.sqrt((base - self.x_ties[3] / 12) * (base - self.y_ties[3] / 12))) if n > 2 else np.nan
+            rho = np.clip(rho, -1, 1)
+            for name, coefficient in [("pearson", r), ("spearman", rho)]:
+                t_stat = coefficient * np.sqrt((n - 2) / (1 - coefficient ** 2))
+                p = 0.0 if abs(coefficient) == 1 else 2 * student.sf(abs(t_stat), n - 2)
+                results[f"{name}_r"], results[f"{name}_p"] = coefficient, p if np.isfinite(coefficient) else np.nan
+
+            pairs = n * (n - 1) / 2
+            tau = self.s / np.sqrt((pairs - self.x_ties[0]) * (pairs - self.y_ties[0])) if n > 1 else np.nan
+            m = n * (n - 1.0)
+            variance = ((m * (2 * n + 5) - self.x_ties[2] - self.y_ties[2]) / 18
+                        + 2 * self.x_ties[0] * self.y_ties[0] / m
+                        + self.x_ties[1] * self.y_ties[1] / (9 * m * (n - 2))) if n > 2 else np.nan
+            results["kendall_tau"] = tau
+            results["kendall_p"] = 2 * norm.sf(abs(self.s / np.sqrt(variance))) if np.isfinite(tau) else np.nan
+        return results
+
+
+######################################################
+####################### Tracker ######################
+######################################################
+
+def count_rules(rules) -> float:
+    """Number of rules of a server, from a list or its serialization in the CSV outputs (JSON or
+    Python literal, as written by utils.refresh), NaN when missing or malformed."""
+    if isinstance(rules, str):
+        try:
+            rules = json.loads(rules)
+        except ValueError:
+            try:
+                rules = ast.literal_eval(rules)
+            except Exception:
+                return np.nan
+    return len(rules) if isinstance(rules, (list, tuple, np.ndarray)) else np.nan
+
+
+def add_engagement_rates(servers: pd.DataFrame) -> pd.DataFrame:
+    """Adds the derived columns of statistic_analysis.ipynb when their inputs are present:
+    active_rate (active_month / total_users) and rules_num (number of rules)."""
+    servers = servers.copy()
+    if "active_rate" not in servers.columns and {"active_month", "total_users"} <= set(servers.columns):
+        servers["active_rate"] = servers["active_month"] / servers["total_users"]
+    if "rules_num" not in servers.columns and "rules" in servers.columns:
+        servers["rules_num"] = servers["rules"].map(count_rules)
+    return servers
+
+
+class CorrelationTracker:
+    """Correlations of several column pairs over a rolling window of crawl snapshots.
+
+    A server counts with its latest values, as long as it was seen in a snapshot of the last
+    `window`; a server that is missing, or has a missing / infinite value, in the snapshots of the
+    window is left out.
+
+    Args:
+        pairs (list): (x, y) column pairs.
+        window (str or pd.Timedelta): Rolling window, None to keep every server ever seen.
+        key (str): Column identifying a server across snapshots (server_id is a row number).
+    """
+
+    def __init__(self, pairs: list = DEFAULT_PAIRS, window=None, key: str = "domain",
+                 max_incremental: int = 16) -> None:
+        self.pairs = [tuple(pair) for pair in pairs]
+        self.window = pd.Timedelta(window) if window is not None else None
+        self.key = key
+        self.stats = {pair: OnlineCorrelation(max_incremental) for pair in self.pairs}
+        self.last_seen = {}
+        self.snapshots = deque()  # (crawled_at, keys seen) of the snapshots in the window
+        self.trend = []
+
+    def update(self, servers: pd.DataFrame, crawled_at) -> pd.DataFrame:
+        """Adds a snapshot (one row per server) taken at crawled_at, expires the servers not seen
+        within the window, and appends the correlations of every pair to the trend table.
+        Snapshots must come in chronological order. Returns the rows of this snapshot."""
+        crawled_at = pd.Timestamp(crawled_at)
+        if self.snapshots and crawled_at <= self.snapshots[-1][0]:
+            raise ValueError(f"Snapshot {crawled_at} is not after the previous one ({self.snapshots[-1][0]}).")
+        servers = servers.drop_duplicates(self.key, keep="last")
+        keys = servers[self.key].to_numpy(dtype=object)
+        self.last_seen.update(dict.fromkeys(keys.tolist(), crawled_at))
+        self.snapshots.append((crawled_at, keys))
+
+        expired = []
+        while self.window is not None and self.snapshots[0][0] <= crawled_at - self.window:
+            time, old_keys = self.snapshots.popleft()
+            for server in old_keys:
+                if self.last_seen.get(server) == time:
+                    expired.append(server)
+                    del self.last_seen[server]
+
+        rows = []
+        for (x_col, y_col), stats in self.stats.items():
+            x = pd.to_numeric(servers[x_col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+            y = pd.to_numeric(servers[y_col], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+            valid = np.isfinite(x) & np.isfinite(y)
+            # Servers of this snapshot without a valid value are left out until they get one
+            n_changed = stats.update(keys[valid], x[valid], y[valid], removed=expired + keys[~valid].tolist())
+            rows.append({"crawled_at": crawled_at, "x": x_col, "y": y_col, "n_changed": n_changed,
+                         "n_expired": len(expired), **stats.correlations()})
+        self.trend += rows
+        return pd.DataFrame(rows)
+
+    def trend_table(self) -> pd.DataFrame:
+        """One row per (snapshot, pair): n, n_changed, n_expired and the three correlations."""
+        return pd.DataFrame(self.trend)
+
+
+def read_snapshot(path: str) -> tuple:
+    """(crawl time, server table) of a snapshot file: CSV or Parquet, crawled_at column or else
+    the modification time of the file."""
+    servers = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+    if "crawled_at" in servers.columns:
+        crawled_at = pd.Timestamp(servers["crawled_at"].max())
+    else:
+        crawled_at = pd.Timestamp(os.path.getmtime(path), unit="s")
+    return crawled_at, servers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trend of the strictness / engagement correlations across snapshots.")
+    parser.add_argument("snapshots", nargs="+", help="Server tables of successive crawls (e.g. refresh outputs).")
+    parser.add_argument("--pairs", nargs="+", default=None, metavar="X:Y",
+                        help="Column pairs (default: those of statistic_analysis.ipynb present in the data).")
+    parser.add_argument("--window", default=None, help="Rolling window, e.g. 90D (default: no window).")
+    parser.add_argument("--key", default="domain")
+    parser.add_argument("--output", default=None, help="Write the trend table to this CSV file.")
+    args = parser.parse_args()
+
+    snapshots = sorted((read_snapshot(path) for path in args.snapshots), key=lambda snapshot: snapshot[0])
+    snapshots = [(crawled_at, add_engagement_rates(servers)) for crawled_at, servers in snapshots]
+    if args.pairs:
+        pairs = [tuple(pair.split(":")) for pair in args.pairs]
+    else:
+        columns = set(snapshots[0][1].columns)
+        pairs = [pair for pair in DEFAULT_PAIRS if set(pair) <= columns]
+    tracker = CorrelationTracker(pairs, args.window, args.key)
+    for crawled_at, servers in snapshots:
+        tracker.update(servers, crawled_at)
+    trend = tracker.trend_table()
+    print(trend.to_string(index=False))
+    if args.output:
+        trend.to_csv(f"{args.output}.tmp", index=False)
+        os.replace(f"{args.output}.tmp", args.output)
+        print(f"Wrote the trend table to {args.output} 💾")
@@ -0,0 +1,241 @@
+import fnmatch
+import functools
+import hashlib
+import importlib
+import inspect
+import os
+import pickle
+
+import pandas as pd
+
+from .profiling import PROFILER, n_rows
+
+
+# Bump this to invalidate every cached stage output at once (e.g. after a pandas upgrade
+# that changes the pickled layout of the frames).
+PIPELINE_VERSION = "1"
+
+
+######################################################
+###################### Hashing #######################
+######################################################
+
+def hash_items(*items) -> str:
+    """Stable short hash of a sequence of (repr-able) items."""
+    h = hashlib.sha256()
+    for item in items:
+        h.update(repr(item).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()[:16]
+
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """Hash of the raw bytes of a file, used as the root key of the stage DAG."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def code_version(func) -> str:
+    """Hash of the source code of a stage (or of a helper, class or module it depends on), so
+    editing it invalidates the stage outputs."""
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        code = getattr(func, "__code__", None)
+        source = code.co_code if code is not None else repr(func)
+    return hash_items(source)
+
+
+def resolve_dependencies(cls, depends_on: tuple) -> list:
+    """Objects named by the depends_on of a stage, for the dataset class cls:
+        - "name" or "pattern*": attributes of the class (e.g. "_clean_*", "_standardize_text"),
+          so the helpers a stage dispatches to are those of the subclass that runs it
+        - ".module:attribute": attribute of a module of this package, imported when needed
+        - any other object: a function, class or module whose source code is hashed
+    """
+    objects = []
+    for dependency in depends_on:
+        if not isinstance(dependency, str):
+            objects.append(dependency)
+        elif ":" in dependency:
+            module_name, attribute = dependency.split(":")
+            objects.append(getattr(importlib.import_module(module_name, package=__package__), attribute))
+        else:
+            names = sorted(name for name in dir(cls) if fnmatch.fnmatchcase(name, dependency))
+            objects += [getattr(cls, name) for name in names]
+    return objects
+
+
+######################################################
+#################### Stage cache #####################
+######################################################
+
+class StageCache:
+    """On-disk store of stage outputs, one pickle file per (stage, key).
+
+    Attributes:
+        cache_dir (str): Directory in which the stage outputs are written.
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, stage_name: str, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{stage_name}-{key}.pkl")
+
+    def contains(self, stage_name: str, key: str) -> bool:
+        return os.path.exists(self.path(stage_name, key))
+
+    def load(self, stage_name: str, key: str):
+        path = self.path(stage_name, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            # A truncated or stale file is treated as a cache miss
+            return None
+
+    def save(self, stage_name: str, key: str, outputs: dict) -> None:
+        path = self.path(stage_name, key)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(outputs, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def clear(self) -> None:
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(".pkl"):
+                os.remove(os.path.join(self.cache_dir, file_name))
+
+
+######################################################
+##################### Stage DAG ######################
+######################################################
+
+class Stage:
+    """Description of a pipeline stage: which attributes of the dataset it reads and writes.
+
+    The DAG is implicit in the attributes: a stage depends on whichever stage last wrote
+    one of its inputs. Every attribute carries a state key, the key of the stage that
+    produced it, so a stage key is the hash of its code, its parameters and the state keys
+    of its inputs. Changing the raw data, a parameter or the code of a stage therefore
+    invalidates that stage and everything downstream of it, and nothing else.
+
+    Attributes:
+        name (str): Name of the stage, equal to the name of the dataset method.
+        inputs (tuple): Dataset attributes read by the stage.
+        outputs (tuple): Dataset attributes written by the stage.
+        returns (str): Attribute returned by the method, or None.
+        version (str): Hash of the source code of the stage.
+        depends_on (tuple): Helpers whose source code is part of the key (see resolve_dependencies()).
+        context (callable): context(dataset) is part of the key, for state that lives outside of
+            the dataset attributes (e.g. the language model, the strictness lexicon).
+    """
+
+    def __init__(self, name: str, inputs: tuple, outputs: tuple, returns: str, version: str,
+                 depends_on: tuple = (), context=None) -> None:
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.returns = returns
+        self.version = version
+        self.depends_on = tuple(depends_on)
+        self.context = context
+        self._dependency_versions = {}  # dataset class -> hash of the sources of the dependencies
+
+    def dependency_version(self, cls) -> str:
+        if cls not in self._dependency_versions:
+            objects = resolve_dependencies(cls, self.depends_on)
+            self._dependency_versions[cls] = hash_items(*[code_version(obj) for obj in objects])
+        return self._dependency_versions[cls]
+
+    def key(self, dataset, state_keys: dict, args: tuple = (), kwargs: dict = None) -> str:
+        input_keys = [state_keys.get(attr) for attr in self.inputs]
+        params = (args, sorted((kwargs or {}).items()))
+        context = self.context(dataset) if self.context is not None else None
+        return hash_items(PIPELINE_VERSION, type(dataset).__name__, self.name, self.version,
+                          self.dependency_version(type(dataset)), context, params, input_keys)
+
+
+def pipeline_stage(inputs: tuple, outputs: tuple, returns: str = None, depends_on: tuple = (), context=None):
+    """Turns a dataset method into a memoized pipeline stage.
+
+    Without a cache (dataset.stage_cache is None) the method is called as is. With a cache,
+    the outputs are loaded from disk when a file with the stage key exists, and computed then
+    saved otherwise. When the profiler is enabled, each call is recorded as a stage.
+
+    The key covers the source of the method only; the helpers it calls are listed in
+    depends_on, e.g. depends_on=("_clean_*", ".strictness:lexicon_hits"), and values read outside
+    of the dataset (model, lexicon...) are returned by context(dataset).
+
+    Subclasses that write additional attributes in a stage declare them in their
+    `extra_stage_outputs` class attribute, e.g. {"clean": ("block_graph",)}.
+    """
+    def decorator(method):
+        stage = Stage(method.__name__, inputs, outputs, returns, code_version(method), depends_on, context)
+
+        def run(self, args, kwargs):
+            cache = getattr(self, "stage_cache", None)
+            if cache is None:
+                return method(self, *args, **kwargs), False
+
+            outputs = stage.outputs + tuple(getattr(self, "extra_stage_outputs", {}).get(stage.name, ()))
+            key = stage.key(self, self.state_keys, args, kwargs)
+            cached = cache.load(stage.name, key)
+            if cached is not None:
+                print(f"Loaded stage '{stage.name}' from cache ♻️")
+                for attr, value in cached.items():
+                    setattr(self, attr, value)
+                result = getattr(self, stage.returns) if stage.returns else None
+            else:
+                result = method(self, *args, **kwargs)
+                cache.save(stage.name, key, {attr: getattr(self, attr) for attr in outputs})
+
+            for attr in outputs:
+                self.state_keys[attr] = key
+            return result, cached is not None
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not PROFILER.enabled:
+                return run(self, args, kwargs)[0]
+            rows_in = next((n_rows(getattr(self, attr)) for attr in stage.inputs 
+                            if isinstance(getattr(self, attr, None), pd.DataFrame)), None)
+            with PROFILER.stage(f"{type(self).__name__}.{stage.name}", rows_in=rows_in) as record:
+                result, from_cache = run(self, args, kwargs)
+                output = result if result is not None else getattr(self, stage.outputs[0], None)
+                record["rows_out"] = n_rows(output) if isinstance(output, pd.DataFrame) else None
+                record["cached"] = from_cache
+            return result
+
+        wrapper.stage = stage
+        return wrapper
+    return decorator
+
+
+def plan(dataset, stages: list) -> pd.DataFrame:
+    """Dry run of a sequence of stages: for each stage, its key and whether it is cached.
+
+    Stages that are not cached are the ones a call to dataset.run_pipeline(stages) would execute.
+    """
+    state_keys = dict(dataset.state_keys)
+    producers = {}
+    cache = dataset.stage_cache
+    rows = []
+    for stage_name in stages:
+        stage = getattr(type(dataset), stage_name).stage
+        key = stage.key(dataset, state_keys)
+        rows.append({"stage": stage_name,
+                     "key": key,
+                     "depends_on": sorted({producers[attr] for attr in stage.inputs if attr in producers}),
+                     "cached": cache is not None and cache.contains(stage_name, key)})
+        for attr in stage.outputs:
+            state_keys[attr] = key
+            producers[attr] = stage_name
+    return pd.DataFrame(rows)
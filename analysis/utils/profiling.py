@@ -0,0 +1,192 @@
+import functools
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+class Profiler:
+    """Collects wall time, CPU time, rows in/out and peak memory of the pipeline stages.
+
+    The profiler is disabled by default, in which case profiled calls go straight to the
+    wrapped function. Once enabled, every stage produces one record; nested stages (e.g. the
+    _clean_<column> methods inside clean()) are recorded with their depth and parent.
+
+    Example:
+        from utils.profiling import PROFILER
+        PROFILER.enable()
+        mastodon.clean()
+        with PROFILER.stage("topic_modeling", rows_in=len(docs)) as record:
+            topics, probs = topic_model.fit_transform(docs)
+            record["rows_out"] = len(topics)
+        PROFILER.print_summary()
+        PROFILER.to_json("profile.json")
+
+    Attributes:
+        enabled (bool): Whether calls are recorded.
+        trace_memory (bool): Whether peak memory is measured (with tracemalloc, which slows
+            down allocations while it is on).
+        records (list): One dict per profiled call, in completion order.
+    """
+
+    def __init__(self, enabled: bool = False, trace_memory: bool = True) -> None:
+        self.enabled = False
+        self.trace_memory = trace_memory
+        self.records = []
+        self._stack = []
+        self._started_tracemalloc = False
+        if enabled:
+            self.enable()
+
+    def enable(self, trace_memory: bool = None) -> None:
+        if trace_memory is not None:
+            self.trace_memory = trace_memory
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def reset(self) -> None:
+        self.records = []
+        self._stack = []
+
+    ######################################################
+    ##################### Recording ######################
+    ######################################################
+
+    @contextmanager
+    def stage(self, name: str, rows_in: int = None, **info):
+        """Records the enclosed block as a stage. The yielded dict can be completed by the
+        caller, typically with record["rows_out"]."""
+        if not self.enabled:
+            yield {}
+            return
+
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            # The peak is global: save it into the enclosing stages before resetting it
+            for frame in self._stack:
+                frame["_peak"] = max(frame["_peak"], peak)
+            tracemalloc.reset_peak()
+
+        record = {"stage": name,
+                  "parent": self._stack[-1]["stage"] if self._stack else None,
+                  "depth": len(self._stack),
+                  "rows_in": rows_in,
+                  "rows_out": None,
+                  **info}
+        record["_mem_start"] = current if tracing else None
+        record["_peak"] = current if tracing else 0
+        self._stack.append(record)
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_time_s"] = time.perf_counter() - wall_start
+            record["cpu_time_s"] = time.process_time() - cpu_start
+            self._stack.pop()
+            mem_start, peak_seen = record.pop("_mem_start"), record.pop("_peak")
+            if tracing and tracemalloc.is_tracing():
+                peak_seen = max(peak_seen, tracemalloc.get_traced_memory()[1])
+                record["peak_memory_mb"] = (peak_seen - mem_start) / 2**20
+                if self._stack:
+                    self._stack[-1]["_peak"] = max(self._stack[-1]["_peak"], peak_seen)
+            else:
+                record["peak_memory_mb"] = None
+            self.records.append(record)
+
+    def call(self, name: str, func, *args, rows_in: int = None, **kwargs):
+        """Calls func(*args, **kwargs) as a stage; the number of output rows is taken from the result."""
+        if not self.enabled:
+            return func(*args, **kwargs)
+        with self.stage(name, rows_in=rows_in) as record:
+            result = func(*args, **kwargs)
+            record["rows_out"] = n_rows(result)
+        return result
+
+    ######################################################
+    ###################### Reporting #####################
+    ######################################################
+
+    def report(self) -> pd.DataFrame:
+        """One row per profiled call."""
+        columns = ["stage", "parent", "depth", "wall_time_s", "cpu_time_s", "rows_in", "rows_out", "peak_memory_mb"]
+        report = pd.DataFrame(self.records)
+        for column in columns:
+            if column not in report.columns:
+                report[column] = None
+        for column in ["rows_in", "rows_out", "peak_memory_mb"]:
+            report[column] = pd.to_numeric(report[column], errors="coerce")
+        return report[columns + [c for c in report.columns if c not in columns]]
+
+    def summary(self) -> pd.DataFrame:
+        """Per stage totals, sorted by decreasing wall time."""
+        report = self.report()
+        if report.empty:
+            return report
+        summary = report.groupby("stage", sort=False).agg(calls=("stage", "size"),
+                                                          wall_time_s=("wall_time_s", "sum"),
+                                                          cpu_time_s=("cpu_time_s", "sum"),
+                                                          rows_in=("rows_in", "sum"),
+                                                          rows_out=("rows_out", "sum"),
+                                                          peak_memory_mb=("peak_memory_mb", "max"))
+        return summary.sort_values("wall_time_s", ascending=False).reset_index()
+
+    def print_summary(self) -> None:
+        summary = self.summary()
+        if summary.empty:
+            print("Nothing was profiled. Did you call PROFILER.enable()? ⏱️")
+            return
+        print(summary.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+
+    def to_json(self, path: str) -> None:
+        def to_records(df):
+            # NaN is not valid JSON
+            return df.astype(object).where(df.notna(), None).to_dict(orient="records")
+        report = {"records": to_records(self.report()),
+                  "summary": to_records(self.summary())}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+
+
+def n_rows(obj):
+    """Number of rows of a DataFrame/Series/array-like, None for anything else."""
+    if obj is None or isinstance(obj, (str, bytes)):
+        return None
+    try:
+        return len(obj)
+    except TypeError:
+        return None
+
+
+# Shared profiler used by the dataset classes and the analysis modules
+PROFILER = Profiler()
+
+
+def profiled(name: str = None, rows_in=None):
+    """Decorator recording every call of a function in PROFILER.
+
+    Args:
+        name (str): Stage name, the function's qualified name by default.
+        rows_in (callable): Computes the number of input rows from the call arguments.
+    """
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+            n_in = rows_in(*args, **kwargs) if rows_in is not None else n_rows(args[0]) if args else None
+            return PROFILER.call(stage_name, func, *args, rows_in=n_in, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,283 @@
+"""Headless refresh of the analysis tables, from the raw datasets to the CSV outputs.
+
+Runs the MastodonDataset / RedditDataset pipelines and writes, in the output directory:
+    - <platform>_server_strictness.csv   sum of the rule strictness of each server, with its bootstrap
+                                         confidence interval and its attributes
+    - <platform>_clusters_descr.csv      topic of each server description (BERTopic)
+    - lgbtq_safe_servers.csv             Mastodon servers whose description topic is about LGBTQ+ safety
+    - <platform>_server_clusters.csv     cluster of each server on the topics of its rules (step
+                                         "clusters", opt-in: it fits a topic model on all the rules)
+    - <platform>_rules.parquet           the rules with their strictness, language prediction and
+                                         topic (step "clusters")
+
+Files are written atomically, so that readers (e.g. utils.strictness_service) never see a
+partial file. The platforms can run in parallel worker processes (--platform-workers, at most
+one per platform). The stages themselves are parallelized by their own options: --lang-threads
+for language detection, --cluster-workers for the choice of the number of clusters, and
+utils.shards to split one platform across worker processes or machines.
+
+Usage (from the analysis/ directory):
+    python -m utils.refresh
+    python -m utils.refresh --steps strictness --platforms mastodon --output-dir out/ --cache-dir .cache/
+    python -m utils.refresh --platform-workers 2 --batch-size 64 --profile profile.json
+    python -m utils.refresh --lang-backend onnx --lang-threads 4 --batch-size 64
+    python -m utils.refresh --steps strictness descriptions clusters --clusters 8
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .profiling import PROFILER
+
+
+STEPS = ["strictness", "descriptions", "clusters"]
+# Steps run by default, "clusters" is opt-in
+DEFAULT_STEPS = ["strictness", "descriptions"]
+PLATFORMS = ["mastodon", "reddit"]
+DATA_PATHS = {"mastodon": "../dataset/Mastodon/mastodon_instance_info.csv",
+              "reddit": "../dataset/Reddit/reddit_subreddits_data_top100.csv"}
+# Top words identifying the LGBTQ+ safe spaces topic of the Mastodon descriptions
+LGBTQ_KEYWORDS = ["lgbtq", "lgbtqia", "lgbt", "queer", "trans"]
+TOPIC_COLUMNS = {"Name": "Topic Name", "Count": "Topic Count", "Representation": "Topic Representation"}
+
+
+def write_csv(df: pd.DataFrame, path: str) -> None:
+    """Writes the CSV next to its destination, then renames it over the previous version."""
+    tmp_path = f"{path}.tmp"
+    df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    print(f"Wrote {len(df)} rows to {path} 💾")
+
+
+def flatten_nested(df: pd.DataFrame) -> pd.DataFrame:
+    """Lists and dicts of object columns as their str(), as they are written by to_csv()."""
+    df = df.copy()
+    for column in df.columns[df.dtypes == object]:
+        nested = df[column].map(lambda value: isinstance(value, (list, tuple, dict, set, np.ndarray)))
+        if nested.any():
+            df[column] = df[column].astype(object)
+            df.loc[nested, column] = df.loc[nested, column].map(str)
+    return df
+
+
+def write_parquet(df: pd.DataFrame, path: str) -> None:
+    """Writes the table (nested values as strings) atomically, as write_csv()."""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    flatten_nested(df).to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    print(f"Wrote {len(df)} rows to {path} 💾")
+
+
+def load_dataset(platform: str, data_path: str = None, cache_dir: str = None, batch_size: int = None,
+                 server_range: tuple = None):
+    from .SocialMediaDataset import MastodonDataset, RedditDataset
+    if platform == "mastodon":
+        dataset = MastodonDataset(data_path or DATA_PATHS[platform], cache_dir=cache_dir, server_range=server_range)
+    else:
+        dataset = RedditDataset(data_path or DATA_PATHS[platform], cache_dir=cache_dir, server_range=server_range)
+    dataset.lang_batch_size = batch_size
+    return dataset
+
+
+def servers_table(dataset) -> pd.DataFrame:
+    return dataset.df_en if dataset.df_en is not None else dataset.df
+
+
+######################################################
+##################### Strictness #####################
+######################################################
+
+def server_strictness(dataset, n_resamples: int = 1000, confidence: float = 0.95) -> pd.DataFrame:
+    """Server strictness (sum of the strictness of its rules) joined with the server attributes,
+    with the bounds of its bootstrap confidence interval (strictness_lower / strictness_upper)
+    unless n_resamples is 0."""
+    aggregates = dataset.aggregate_servers(topic_col=None)
+    strictness = aggregates[["server_id", "strictness_sum"]].rename(columns={"strictness_sum": "strictness"})
+    if n_resamples:
+        intervals = dataset.bootstrap_servers("strictness", "sum", n_resamples=n_resamples, confidence=confidence)
+        strictness["strictness_lower"] = intervals["lower"].to_numpy()  # same servers, same order
+        strictness["strictness_upper"] = intervals["upper"].to_numpy()
+    # The rules come from df_en (Mastodon) or df (Reddit); df_en rows are the same as in df
+    return strictness.merge(dataset.df, how="left", on="server_id")
+
+
+######################################################
+############ Topic modeling of descriptions ##########
+######################################################
+
+def description_documents(dataset, detect_language: bool) -> pd.DataFrame:
+    """Standardized descriptions of the English servers, without stop words (as in the notebook)."""
+    from nltk.corpus import stopwords
+    import nltk
+    nltk.download("stopwords", quiet=True)
+    stop_words = set(stopwords.words("english"))
+
+    descriptions = servers_table(dataset)[["server_id", "description"]].copy()
+    descriptions = descriptions[~descriptions["description"].fillna("").astype(str).str.strip().isin(["", "nan"])]
+    if detect_language:
+        descriptions = descriptions[dataset.detect_english_many(descriptions["description"]).to_numpy()]
+    words = dataset._standardize_text(descriptions["description"].astype(str))
+    descriptions["description"] = words.apply(lambda tokens: " ".join(w for w in tokens if w not in stop_words)
+                                              if isinstance(tokens, list) else "")
+    return descriptions[descriptions["description"] != ""].reset_index(drop=True)
+
+
+def description_topics(dataset, detect_language: bool, batch_size: int = 32, seed: int = 1) -> pd.DataFrame:
+    """Topic of each server description, with the topic information columns of BERTopic."""
+    from .topic_model import IncrementalTopicModel
+    descriptions = description_documents(dataset, detect_language)
+    topic_model = IncrementalTopicModel(batch_size=batch_size, seed=seed)
+    descriptions["Topic"] = topic_model.fit(descriptions["description"].tolist())
+    info = topic_model.topic_info().rename(columns=TOPIC_COLUMNS)
+    return descriptions.merge(info, on="Topic", how="left")
+
+
+def lgbtq_topics(topics: pd.DataFrame, keywords: list = LGBTQ_KEYWORDS) -> list:
+    representation = topics.drop_duplicates("Topic").set_index("Topic")["Topic Representation"]
+    return [topic for topic, words in representation.items()
+            if topic >= 0 and any(word in keywords for word in words[:5])]
+
+
+######################################################
+################### Server clusters ##################
+######################################################
+
+def rule_clusters(dataset, batch_size: int = 32, k: int = None, workers: int = 1, seed: int = 1) -> pd.DataFrame:
+    """Cluster of each server on the topic distribution of its rules (see server_clustering)."""
+    from .topic_model import IncrementalTopicModel
+    dataset.assign_topics(IncrementalTopicModel(batch_size=batch_size, seed=seed))
+    clusters = dataset.cluster_servers(k=k, workers=workers)
+    return clusters[["server_id", "cluster"]]
+
+
+######################################################
+####################### Runner #######################
+######################################################
+
+def refresh_platform(platform: str, output_dir: str, steps: list = DEFAULT_STEPS, stages: list = None,
+                     data_path: str = None, cache_dir: str = None, batch_size: int = None,
+                     n_clusters: int = None, cluster_workers: int = 1, profile: bool = False,
+                     lang_backend: str = "pipeline", lang_threads: int = None, n_resamples: int = 1000) -> dict:
+    """Runs the pipeline of one platform and writes its outputs. Returns {output name: path}.
+    The profile only holds the stages of this platform (the profiler is shared by the platforms
+    refreshed in the same process)."""
+    if profile:
+        PROFILER.reset()
+        PROFILER.enable()
+    try:
+        start = time.perf_counter()
+        if lang_backend != "pipeline":
+            from .SocialMediaDataset import set_lang_backend
+            set_lang_backend(lang_backend, num_threads=lang_threads, batch_size=batch_size or 64)
+        dataset = load_dataset(platform, data_path, cache_dir, batch_size)
+        dataset.run_pipeline(stages)
+        outputs = {}
+
+        if "strictness" in steps:
+            outputs["strictness"] = os.path.join(output_dir, f"{platform}_server_strictness.csv")
+            write_csv(server_strictness(dataset, n_resamples), outputs["strictness"])
+
+        if "descriptions" in steps:
+            with PROFILER.stage(f"{platform}.description_topics"):
+                topics = description_topics(dataset, detect_language=platform == "mastodon",
+                                            batch_size=batch_size or 32)
+            servers = servers_table(dataset)
+            clusters = topics.drop(columns="description").merge(servers, on="server_id", how="left")
+            outputs["clusters"] = os.path.join(output_dir, f"{platform}_clusters_descr.csv")
+            write_csv(clusters, outputs["clusters"])
+            if platform == "mastodon":
+                lgbtq = topics[topics["Topic"].isin(lgbtq_topics(topics))]
+                lgbtq = lgbtq.merge(servers.drop(columns="description"), on="server_id", how="left")
+                outputs["lgbtq"] = os.path.join(output_dir, "lgbtq_safe_servers.csv")
+                write_csv(lgbtq, outputs["lgbtq"])
+
+        if "clusters" in steps:
+            server_clusters = rule_clusters(dataset, batch_size or 32, n_clusters, cluster_workers)
+            servers = servers_table(dataset)[["server_id", "domain"]]
+            server_clusters = servers.merge(server_clusters, on="server_id", how="left")
+            server_clusters["cluster"] = server_clusters["cluster"].astype("Int64")  # servers without rules
+            outputs["server_clusters"] = os.path.join(output_dir, f"{platform}_server_clusters.csv")
+            write_csv(server_clusters, outputs["server_clusters"])
+
+        if "strictness" in steps or "clusters" in steps:
+            # Rule table of utils.strictness_service, with the rule topics once the clusters step ran
+            outputs["rules"] = os.path.join(output_dir, f"{platform}_rules.parquet")
+            write_parquet(dataset.rules_df, outputs["rules"])
+
+        print(f"Refreshed {platform} in {time.perf_counter() - start:.1f}s ✨")
+        return {"outputs": outputs, "profile": PROFILER.report().to_dict("records") if profile else None}
+    finally:
+        if profile:
+            PROFILER.disable()
+
+
+def refresh(platforms: list = PLATFORMS, output_dir: str = ".", steps: list = DEFAULT_STEPS, stages: list = None,
+            data_paths: dict = None, cache_dir: str = None, platform_workers: int = 1, batch_size: int = None,
+            profile_path: str = None, n_clusters: int = None, cluster_workers: int = 1,
+            lang_backend: str = "pipeline", lang_threads: int = None, n_resamples: int = 1000) -> dict:
+    """Refreshes the outputs of every platform, in up to `platform_workers` parallel processes
+    (one platform per process, so more workers than platforms have no effect)."""
+    os.makedirs(output_dir, exist_ok=True)
+    data_paths = data_paths or {}
+    kwargs = [dict(platform=platform, output_dir=output_dir, steps=steps, stages=stages,
+                   data_path=data_paths.get(platform), cache_dir=cache_dir, batch_size=batch_size,
+                   n_clusters=n_clusters, cluster_workers=cluster_workers,
+                   profile=profile_path is not None, lang_backend=lang_backend,
+                   lang_threads=lang_threads, n_resamples=n_resamples) for platform in platforms]
+    if platform_workers > 1 and len(platforms) > 1:
+        with ProcessPoolExecutor(min(platform_workers, len(platforms))) as executor:
+            results = list(executor.map(_refresh_platform_kwargs, kwargs))
+    else:
+        results = [refresh_platform(**kw) for kw in kwargs]
+
+    if profile_path is not None:
+        profile = pd.DataFrame([record for result in results for record in result["profile"] or []])
+        profile.to_json(profile_path, orient="records", indent=2)
+    return {platform: result["outputs"] for platform, result in zip(platforms, results)}
+
+
+def _refresh_platform_kwargs(kwargs: dict) -> dict:
+    return refresh_platform(**kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the analysis tables from the raw datasets.")
+    parser.add_argument("--platforms", nargs="+", choices=PLATFORMS, default=PLATFORMS)
+    parser.add_argument("--steps", nargs="+", choices=STEPS, default=DEFAULT_STEPS,
+                        help=f"Outputs to produce (default: {' '.join(DEFAULT_STEPS)}).")
+    parser.add_argument("--stages", nargs="+", default=None,
+                        help="Dataset pipeline stages to run (default: the dataset's pipeline_stages).")
+    parser.add_argument("--output-dir", default=".", help="Directory of the output CSV files.")
+    parser.add_argument("--mastodon-path", default=None, help=f"Default: {DATA_PATHS['mastodon']}")
+    parser.add_argument("--reddit-path", default=None, help=f"Default: {DATA_PATHS['reddit']}")
+    parser.add_argument("--cache-dir", default=None, help="Cache of the pipeline stages, reused across refreshes.")
+    parser.add_argument("--platform-workers", type=int, default=1,
+                        help="Platforms processed in parallel processes (at most one per platform). To parallelize "
+                             "the stages of one platform, see --lang-threads and utils.shards.")
+    parser.add_argument("--batch-size", type=int, default=None,
+                        help="Texts per batch for language detection and embeddings (default: one by one / 32).")
+    parser.add_argument("--clusters", type=int, default=None, metavar="K",
+                        help="Number of server clusters (default: chosen by silhouette score).")
+    parser.add_argument("--cluster-workers", type=int, default=1,
+                        help="Worker processes evaluating the numbers of clusters.")
+    parser.add_argument("--profile", default=None, metavar="PATH", help="Write the per-stage profile to this JSON file.")
+    parser.add_argument("--lang-backend", choices=["pipeline", "int8", "onnx"], default="pipeline",
+                        help="Inference backend of the language recognition model (see utils.lang_backend).")
+    parser.add_argument("--lang-threads", type=int, default=None,
+                        help="Threads of the int8 / onnx language recognition backend.")
+    parser.add_argument("--bootstrap", type=int, default=1000, metavar="N",
+                        help="Bootstrap resamples of the strictness confidence intervals (0: no intervals).")
+    args = parser.parse_args()
+
+    outputs = refresh(args.platforms, args.output_dir, args.steps, args.stages,
+                      {"mastodon": args.mastodon_path, "reddit": args.reddit_path},
+                      args.cache_dir, args.platform_workers, args.batch_size, args.profile,
+                      args.clusters, args.cluster_workers, args.lang_backend, args.lang_threads,
+                      args.bootstrap)
+    for platform, paths in outputs.items():
+        for name, path in paths.items():
+            print(f"{platform} {name}: {path}")
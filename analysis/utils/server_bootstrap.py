@@ -0,0 +1,107 @@
+"""Bootstrap confidence intervals of server-level statistics, for all servers at once.
+
+The rules of each server are resampled with replacement within the server (a server with n
+rules gets n rules drawn among its own), and the statistic (sum, mean or max of a rule-level
+metric) is recomputed on every resample. Rather than one bootstrap loop per server, each
+replicate draws a random offset within its segment for every rule of the flat rules table
+sorted by server (see aggregation.ServerSegments), and the statistic of every server is one
+np.add/np.maximum.reduceat over the replicate matrix. Servers are processed by blocks, so the
+memory stays bounded by max_elements whatever the number of rules.
+
+Usage:
+    intervals = bootstrap_servers(dataset.rules_df["strictness"], dataset.rules_df["server_id"],
+                                  statistic="sum", n_resamples=1000, confidence=0.95)
+"""
+import numpy as np
+import pandas as pd
+
+from .aggregation import ServerSegments
+
+
+STATISTICS = ["sum", "mean", "max"]
+
+
+def _segment_statistic(resampled: np.ndarray, starts: np.ndarray, counts: np.ndarray, statistic: str) -> np.ndarray:
+    """Statistic of each segment of each row of a (n_resamples, n_rules) matrix."""
+    if statistic == "max":
+        return np.maximum.reduceat(resampled, starts, axis=1)
+    sums = np.add.reduceat(resampled, starts, axis=1)
+    return sums / counts if statistic == "mean" else sums
+
+
+def _blocks(counts: np.ndarray, max_rules: int):
+    """(first server, last server + 1) of consecutive servers holding about max_rules rules."""
+    ends = np.cumsum(counts)
+    first = 0
+    while first < len(counts):
+        limit = (ends[first - 1] if first else 0) + max_rules
+        last = max(int(np.searchsorted(ends, limit, side="right")), first + 1)
+        yield first, last
+        first = last
+
+
+def bootstrap_servers(values, server_id, statistic: str = "sum", n_resamples: int = 1000,
+                      confidence: float = 0.95, seed: int = 42, max_elements: int = 1 << 24) -> pd.DataFrame:
+    """Percentile bootstrap confidence interval of a per-server statistic of a rule-level metric.
+
+    Args:
+        values: Metric of each rule (missing values count as 0, as in aggregate_rules()).
+        server_id: Server of each rule.
+        statistic (str): "sum", "mean" or "max" of the metric over the rules of a server.
+        n_resamples (int): Bootstrap replicates.
+        confidence (float): Level of the intervals.
+        max_elements (int): Maximum size of the replicate matrix of a block of servers.
+
+    Returns:
+        pd.DataFrame: One row per server_id (increasing) with n_rules, estimate (statistic of the
+            observed rules), std_error, lower and upper. Servers with a single rule, or with all
+            their rules equal, have a zero-width interval.
+    """
+    if statistic not in STATISTICS:
+        raise ValueError(f"Unknown statistic {statistic!r}, expected one of {STATISTICS}.")
+    segments = ServerSegments(server_id)
+    values = pd.Series(values).fillna(0).to_numpy(dtype=float)[segments.order]
+    counts = segments.counts
+    starts = np.r_[0, np.cumsum(counts)[:-1]]
+    estimate = _segment_statistic(values[None, :], starts, counts, statistic)[0] if len(values) else np.zeros(0)
+
+    rng = np.random.default_rng(seed)
+    alpha = (1 - confidence) / 2
+    lower, upper, std_error = (np.zeros(segments.n_servers) for _ in range(3))
+    for first, last in _blocks(counts, max(max_elements // n_resamples, 1)):
+        block_counts = counts[first:last]
+        block_starts = starts[first:last] - starts[first]
+        # Segment start and length of every rule of the block, then a random rule of the same segment
+        rule_starts = np.repeat(block_starts, block_counts)
+        rule_counts = np.repeat(block_counts, block_counts)
+        draws = rng.random((n_resamples, len(rule_starts)))
+        draws *= rule_counts
+        positions = draws.astype(np.int64)
+        positions += rule_starts
+        resampled = values[starts[first]:starts[first] + block_counts.sum()].take(positions)
+        replicates = _segment_statistic(resampled, block_starts, block_counts, statistic)
+        lower[first:last], upper[first:last] = np.quantile(replicates, [alpha, 1 - alpha], axis=0)
+        std_error[first:last] = replicates.std(axis=0, ddof=1) if n_resamples > 1 else np.nan
+
+    return pd.DataFrame({"server_id": segments.server_ids, "n_rules": counts, "estimate": estimate,
+                         "std_error": std_error, "lower": lower, "upper": upper})
+
+
+def bootstrap_rule_metrics(rules: pd.DataFrame, metrics: dict, **kwargs) -> pd.DataFrame:
+    """bootstrap_servers() for several metrics of a rules table, one column triple per metric.
+
+    Args:
+        metrics (dict): {rules column: statistic}, e.g. {"strictness": "sum", "is_english_pred": "mean"}.
+        **kwargs: n_resamples, confidence, seed, max_elements.
+
+    Returns:
+        pd.DataFrame: server_id, n_rules and <column>_<statistic>, _lower, _upper per metric.
+    """
+    table = None
+    for column, statistic in metrics.items():
+        intervals = bootstrap_servers(rules[column], rules["server_id"], statistic, **kwargs)
+        name = f"{column}_{statistic}"
+        intervals = intervals.rename(columns={"estimate": name, "std_error": f"{name}_std_error",
+                                              "lower": f"{name}_lower", "upper": f"{name}_upper"})
+        table = intervals if table is None else table.merge(intervals.drop(columns="n_rules"), on="server_id")
+    return table
@@ -0,0 +1,158 @@
+"""Clustering of the servers on the topic distribution of their rules.
+
+Scales to fediverse-size inputs:
+    - the server x topic matrix is built as sparse counts directly from the rules table
+      (one row per rule with its server_id and Topic), without groupby/unstack
+    - the features (topic shares, scaled to unit variance) are written to a memory-mapped file
+    - mini-batch k-means streams over the memory-mapped rows
+    - k is chosen among several values evaluated in parallel worker processes, by silhouette
+      score on a sample of servers (inertia is reported as well, for the elbow method)
+
+Usage:
+    clusters, selection = cluster_servers(dataset.rules_df, k_values=range(2, 16), workers=4)
+"""
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .aggregation import ServerSegments
+
+
+def server_topic_matrix(server_id, topics) -> tuple:
+    """Sparse number of rules of each server in each topic, outliers (-1) excluded.
+
+    Returns:
+        tuple: (scipy.sparse.csr_matrix of shape (n_servers, n_topics), server ids, topic ids),
+            servers in increasing id order, including the servers whose rules are all outliers.
+    """
+    from scipy.sparse import csr_matrix
+    servers = ServerSegments(server_id)
+    topics = np.asarray(topics)
+    assigned = topics >= 0
+    topic_codes, topic_ids = pd.factorize(topics[assigned], sort=True)
+    counts = csr_matrix((np.ones(len(topic_codes)), (servers.codes[assigned], topic_codes)),
+                        shape=(servers.n_servers, len(topic_ids)))
+    counts.sum_duplicates()
+    return counts, servers.server_ids, np.asarray(topic_ids)
+
+
+def topic_features(counts, path: str) -> np.memmap:
+    """Topic shares of each server (as the notebook's value_counts(normalize=True)), scaled to
+    unit variance per topic, written to a float32 memory-mapped file at `path`.
+
+    Unlike the notebook's StandardScaler, the features are not centered, which keeps the
+    computation sparse; k-means distances are unchanged by centering anyway.
+    """
+    from sklearn.preprocessing import normalize
+    shares = normalize(counts.astype(np.float64), norm="l1")
+    mean = np.asarray(shares.mean(axis=0)).ravel()
+    variance = np.asarray(shares.multiply(shares).mean(axis=0)).ravel() - mean ** 2
+    scale = np.sqrt(np.where(variance > 0, variance, 1.0))
+    features = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=shares.shape)
+    for start in range(0, shares.shape[0], 65_536):
+        features[start:start + 65_536] = shares[start:start + 65_536].toarray() / scale
+    features.flush()
+    return features
+
+
+def minibatch_kmeans(features: np.ndarray, k: int, batch_size: int = 4096, n_epochs: int = 10, seed: int = 42):
+    """MiniBatchKMeans fitted by streaming over the (memory-mapped) rows.
+
+    Returns:
+        tuple: (fitted model, cluster of each row, inertia)
+    """
+    from sklearn.cluster import MiniBatchKMeans
+    n_rows = features.shape[0]
+    if not 1 <= k <= n_rows:
+        raise ValueError(f"The number of clusters must be between 1 and the number of servers ({n_rows}), got k={k}.")
+    # Every batch must hold at least k rows, the first one initializes the centers
+    batch_size = max(batch_size, 3 * k)
+    model = MiniBatchKMeans(n_clusters=k, batch_size=batch_size, random_state=seed, n_init=3)
+    rng = np.random.default_rng(seed)
+    for _ in range(n_epochs):
+        order = rng.permutation(n_rows)
+        for start in range(0, n_rows, batch_size):
+            batch = np.sort(order[start:start + batch_size])
+            if len(batch) >= k:
+                model.partial_fit(np.asarray(features[batch]))
+    labels, inertia = [], 0.0
+    for start in range(0, n_rows, 65_536):
+        chunk = np.asarray(features[start:start + 65_536])
+        labels.append(model.predict(chunk))
+        inertia -= model.score(chunk)
+    return model, np.concatenate(labels), inertia
+
+
+def _evaluate_k(task: dict) -> dict:
+    from sklearn.metrics import silhouette_score
+    features = np.load(task["path"], mmap_mode="r")
+    _, labels, inertia = minibatch_kmeans(features, task["k"], task["batch_size"], seed=task["seed"])
+    sample = task["sample"]
+    sample_labels = labels[sample]
+    silhouette = (silhouette_score(np.asarray(features[sample]), sample_labels)
+                  if len(np.unique(sample_labels)) > 1 else np.nan)
+    return {"k": task["k"], "inertia": inertia, "silhouette": float(silhouette)}
+
+
+def choose_k(features_path: str, k_values=range(2, 11), workers: int = 1, batch_size: int = 4096,
+             sample_size: int = 10_000, seed: int = 42) -> pd.DataFrame:
+    """Silhouette score (on a sample of sample_size servers) and inertia of mini-batch k-means
+    for each k, evaluated in parallel. Returns one row per k, best silhouette first (no rows when
+    there are too few servers for any of k_values, every k must be in [2, number of servers))."""
+    n_rows = np.load(features_path, mmap_mode="r").shape[0]
+    k_values = [k for k in k_values if 2 <= k < n_rows]
+    sample = np.sort(np.random.default_rng(seed).choice(n_rows, min(sample_size, n_rows), replace=False))
+    tasks = [{"path": features_path, "k": k, "batch_size": batch_size, "sample": sample, "seed": seed} for k in k_values]
+    if not tasks:
+        return pd.DataFrame(columns=["k", "inertia", "silhouette"])
+    if workers > 1:
+        with ProcessPoolExecutor(min(workers, len(tasks))) as executor:
+            results = list(executor.map(_evaluate_k, tasks))
+    else:
+        results = [_evaluate_k(task) for task in tasks]
+    return pd.DataFrame(results).sort_values("silhouette", ascending=False, na_position="last", ignore_index=True)
+
+
+def cluster_servers(rules: pd.DataFrame, topic_col: str = "Topic", k: int = None, k_values=range(2, 11),
+                    workers: int = 1, batch_size: int = 4096, features_path: str = None, seed: int = 42) -> tuple:
+    """Clusters the servers on the topic distribution of their rules.
+
+    Args:
+        rules (pd.DataFrame): Rules table with server_id and topic_col (see assign_topics()).
+        k (int): Number of clusters, chosen with choose_k() among k_values if None (a single
+            cluster when there are too few servers to compare any of them).
+        features_path (str): Where the memory-mapped features are kept (temporary file if None).
+
+    Returns:
+        tuple: (DataFrame of server_id, cluster and n_rules_with_topic, DataFrame of choose_k() or None)
+    """
+    counts, server_ids, _ = server_topic_matrix(rules["server_id"], rules[topic_col])
+    if counts.shape[1] == 0:
+        raise ValueError(f"No rule has a {topic_col} (all outliers or no rules), there is nothing to cluster.")
+    work_dir = None
+    if features_path is None:
+        work_dir = tempfile.mkdtemp(prefix="server_clustering_")
+        features_path = os.path.join(work_dir, "features.npy")
+    try:
+        features = topic_features(counts, features_path)
+        selection = None
+        if k is None:
+            selection = choose_k(features_path, k_values, workers, batch_size, seed=seed)
+            if selection.empty:
+                k = 1
+                print(f"Only {len(server_ids)} servers, too few to choose k: using a single cluster ⚠️")
+            else:
+                k = int(selection["k"].iloc[0])
+                print(f"Chose k={k} (silhouette {selection['silhouette'].iloc[0]:.3f}) among {len(selection)} values 🔢")
+        _, labels, _ = minibatch_kmeans(features, k, batch_size, seed=seed)
+        del features
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    clusters = pd.DataFrame({"server_id": server_ids, "cluster": labels,
+                             "n_rules_with_topic": np.asarray(counts.sum(axis=1)).ravel().astype(np.int64)})
+    return clusters, selection
@@ -0,0 +1,398 @@
+"""Sharded execution of the dataset pipelines, for workers on several machines.
+
+The servers of a raw dataset are split into shards, ranges [start, stop) of rows of the CSV
+(server_id stays the row number in the whole file, see SocialMediaDataset.load_instance). The
+shards are claimed from a work queue that is a plain directory on a filesystem shared by the
+workers (NFS, SMB, a local disk for local workers):
+
+    <queue>/plan.json               platform, raw data path, pipeline stages and the shards
+    <queue>/claims/<shard>.claim    created with O_EXCL by the worker running the shard; its
+                                    mtime is a heartbeat, a claim older than the lease is stale
+                                    and can be taken over by another worker
+    <queue>/done/<shard>.json       written once the outputs of the shard are complete
+    <queue>/failed/<shard>.json     errors of the failed attempts
+    <queue>/outputs/<shard>/        servers.parquet and rules.parquet of the shard
+
+Each worker runs the pipeline (cleaning, language detection, deduplication, strictness) on
+the servers of its shards. Shard outputs are deterministic and written atomically, so a shard
+run twice (e.g. by a worker whose lease expired) gives the same files. The merge step then
+concatenates the shard outputs and writes <platform>_server_strictness.csv as utils.refresh
+does. The steps that fit a model on all the rules at once (description topics, clusters)
+still run on one machine, on the merged tables. So do the block network metrics
+(add_federation_metrics): the block graph of a shard only holds the blocks between its own
+servers, plans including that stage are rejected. The merge recomputes the exact_id of the
+rules on the normalized texts of all the shards, so it means what it means unsharded. The
+canonical_id stays shard-local: near duplicates are only grouped within a shard, and the merge
+only renumbers the groups so that the ids of different shards do not collide.
+
+Usage (from the analysis/ directory):
+    python -m utils.shards plan --platform mastodon --queue /shared/queue --shard-size 5000
+    python -m utils.shards work --queue /shared/queue            # on every machine, as many as wanted
+    python -m utils.shards status --queue /shared/queue
+    python -m utils.shards merge --queue /shared/queue --output-dir out/
+
+    python -m utils.shards local --platform mastodon --queue /tmp/queue --workers 4 --output-dir out/
+"""
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+
+import pandas as pd
+
+
+DEFAULT_LEASE_SECONDS = 600
+# A shard that failed this many times is not claimed anymore (see `status`)
+MAX_ATTEMPTS = 3
+OUTPUT_FILES = ["servers.parquet", "rules.parquet"]
+# Stages whose results on a shard differ from the ones on the whole dataset
+GLOBAL_STAGES = ["add_federation_metrics"]
+# Normalized text of the rules in the shard outputs, from which merged_tables() recomputes exact_id
+DEDUP_TEXT_COLUMN = "dedup_text"
+
+
+def _write_json(path: str, content: dict) -> None:
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(content, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+######################################################
+######################## Queue #######################
+######################################################
+
+class ShardQueue:
+    """Work queue of the shards of one platform, in a directory of a shared filesystem.
+
+    Args:
+        queue_dir (str): Directory of the queue.
+        lease_seconds (float): A claim whose heartbeat is older than this is taken over.
+        max_attempts (int): Failed attempts after which a shard is given up.
+    """
+
+    def __init__(self, queue_dir: str, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS) -> None:
+        self.queue_dir = queue_dir
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        for name in ["claims", "done", "failed", "outputs"]:
+            os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+        self._plan = None
+
+    def path(self, *parts) -> str:
+        return os.path.join(self.queue_dir, *parts)
+
+    @property
+    def plan(self) -> dict:
+        if self._plan is None:
+            self._plan = _read_json(self.path("plan.json"))
+        return self._plan
+
+    def create_plan(self, platform: str, data_path: str = None, shard_size: int = 1000, stages: list = None,
+                    batch_size: int = None, cache_dir: str = None) -> dict:
+        """Splits the servers of the raw dataset into shards of shard_size rows. Planning again
+        with the same parameters keeps the existing plan (and the shards already done)."""
+        from .refresh import DATA_PATHS
+        global_stages = [stage for stage in stages or [] if stage in GLOBAL_STAGES]
+        if global_stages:
+            raise ValueError(f"{', '.join(global_stages)} needs all the servers at once and cannot run on shards, "
+                             "run it on the whole dataset instead.")
+        data_path = os.path.abspath(data_path or DATA_PATHS[platform])
+        n_servers = len(pd.read_csv(data_path, usecols=[0]))
+        width = len(str(max(n_servers - 1, 0) // shard_size))
+        shards = [{"id": f"{i:0{width}d}", "start": start, "stop": min(start + shard_size, n_servers)}
+                  for i, start in enumerate(range(0, n_servers, shard_size))]
+        plan = {"platform": platform, "data_path": data_path, "n_servers": n_servers, "shard_size": shard_size,
+                "stages": stages, "batch_size": batch_size, "cache_dir": cache_dir, "shards": shards}
+        if os.path.exists(self.path("plan.json")):
+            existing = _read_json(self.path("plan.json"))
+            if existing != plan:
+                raise ValueError(f"{self.queue_dir} already holds another plan, use an empty queue directory.")
+            return existing
+        _write_json(self.path("plan.json"), plan)
+        self._plan = plan
+        return plan
+
+    def is_done(self, shard_id: str) -> bool:
+        return os.path.exists(self.path("done", f"{shard_id}.json"))
+
+    def claim(self, worker_id: str):
+        """Claims the first shard that is neither done, given up nor claimed by a live worker, None
+        if there is no such shard. Claims are atomic: of two workers claiming a shard, only one gets it."""
+        for shard in self.plan["shards"]:
+            if self.is_done(shard["id"]) or self.failures(shard["id"]) >= self.max_attempts:
+                continue
+            claim_path = self.path("claims", f"{shard['id']}.claim")
+            if os.path.exists(claim_path) and self._is_stale(claim_path) and not self._take_over(claim_path, worker_id):
+                continue
+            try:
+                fd = os.open(claim_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"worker": worker_id, "claimed_at": time.time()}, f)
+            if self.is_done(shard["id"]):  # completed between the check and the claim
+                self._remove_claim(shard["id"])
+                continue
+            return shard
+        return None
+
+    def _take_over(self, claim_path: str, worker_id: str) -> bool:
+        """Removes a stale claim, False if it is not stale anymore. Another worker may have taken it
+        over and claimed the shard between our staleness check and the rename, so the renamed file
+        is checked again and a live claim is put back (with link, which never overwrites a claim)."""
+        stale_path = f"{claim_path}.stale-{worker_id}"
+        try:
+            os.rename(claim_path, stale_path)
+        except FileNotFoundError:
+            return False
+        if self._is_stale(stale_path):
+            os.remove(stale_path)
+            return True
+        try:
+            os.link(stale_path, claim_path)
+        except FileExistsError:
+            pass  # yet another worker claimed the shard meanwhile: both run it, outputs are idempotent
+        os.remove(stale_path)
+        return False
+
+    def _is_stale(self, claim_path: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(claim_path) > self.lease_seconds
+        except FileNotFoundError:
+            return False
+
+    def heartbeat(self, shard_id: str) -> None:
+        try:
+            os.utime(self.path("claims", f"{shard_id}.claim"))
+        except FileNotFoundError:
+            pass
+
+    def _remove_claim(self, shard_id: str) -> None:
+        try:
+            os.remove(self.path("claims", f"{shard_id}.claim"))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, shard_id: str, info: dict) -> None:
+        _write_json(self.path("done", f"{shard_id}.json"), info)
+        self._remove_claim(shard_id)
+
+    def failures(self, shard_id: str) -> int:
+        path = self.path("failed", f"{shard_id}.json")
+        return len(_read_json(path)["attempts"]) if os.path.exists(path) else 0
+
+    def fail(self, shard_id: str, worker_id: str, error: str) -> None:
+        """Records the error and releases the shard, which can be claimed again."""
+        path = self.path("failed", f"{shard_id}.json")
+        attempts = _read_json(path)["attempts"] if os.path.exists(path) else []
+        _write_json(path, {"attempts": attempts + [{"worker": worker_id, "time": time.time(), "error": error}]})
+        self._remove_claim(shard_id)
+
+    def status(self) -> pd.DataFrame:
+        """State of every shard: done, running (live claim), stale (expired claim), failed (given
+        up after max_attempts) or pending."""
+        rows = []
+        for shard in self.plan["shards"]:
+            claim_path = self.path("claims", f"{shard['id']}.claim")
+            worker = None
+            if self.is_done(shard["id"]):
+                info = _read_json(self.path("done", f"{shard['id']}.json"))
+                state, worker = "done", info.get("worker")
+            elif os.path.exists(claim_path):
+                state = "stale" if self._is_stale(claim_path) else "running"
+                try:
+                    worker = _read_json(claim_path).get("worker")
+                except (FileNotFoundError, json.JSONDecodeError):
+                    pass
+            else:
+                state = "failed" if self.failures(shard["id"]) >= self.max_attempts else "pending"
+            failures = self.failures(shard["id"])
+            rows.append({"shard": shard["id"], "start": shard["start"], "stop": shard["stop"],
+                         "state": state, "worker": worker, "failures": failures})
+        return pd.DataFrame(rows)
+
+
+######################################################
+####################### Workers ######################
+######################################################
+
+def run_shard(plan: dict, shard: dict, output_dir: str) -> dict:
+    """Runs the pipeline on the servers of a shard and writes its servers and rules tables."""
+    from .dedup import normalize_text
+    from .refresh import flatten_nested, load_dataset
+    dataset = load_dataset(plan["platform"], plan["data_path"], plan.get("cache_dir"), plan.get("batch_size"),
+                           server_range=(shard["start"], shard["stop"]))
+    dataset.run_pipeline(plan.get("stages"))
+    os.makedirs(output_dir, exist_ok=True)
+    rules = dataset.rules_df
+    if "exact_id" in rules.columns:
+        rules = rules.assign(**{DEDUP_TEXT_COLUMN: normalize_text(dataset.rule_documents()).to_numpy()})
+    tables = {"servers.parquet": dataset.df, "rules.parquet": rules}
+    for name, table in tables.items():
+        path = os.path.join(output_dir, name)
+        flatten_nested(table).to_parquet(f"{path}.tmp-{os.getpid()}", index=False)
+        os.replace(f"{path}.tmp-{os.getpid()}", path)
+    return {"n_servers": len(dataset.df), "n_rules": len(dataset.rules_df)}
+
+
+def work(queue_dir: str, worker_id: str = None, max_shards: int = None,
+         lease_seconds: float = DEFAULT_LEASE_SECONDS) -> int:
+    """Claims and runs shards until none is left (or max_shards are done). Returns the number of
+    shards completed by this worker. A failing shard is recorded and released for a retry."""
+    queue = ShardQueue(queue_dir, lease_seconds)
+    worker_id = worker_id or default_worker_id()
+    completed = 0
+    while max_shards is None or completed < max_shards:
+        shard = queue.claim(worker_id)
+        if shard is None:
+            break
+        stop = threading.Event()
+
+        def beat(shard_id=shard["id"]):
+            while not stop.wait(lease_seconds / 3):
+                queue.heartbeat(shard_id)
+
+        heartbeat = threading.Thread(target=beat, daemon=True)
+        heartbeat.start()
+        start = time.perf_counter()
+        try:
+            info = run_shard(queue.plan, shard, queue.path("outputs", shard["id"]))
+        except Exception:
+            queue.fail(shard["id"], worker_id, traceback.format_exc())
+            print(f"[{worker_id}] shard {shard['id']} failed ❌")
+            continue
+        finally:
+            stop.set()
+            heartbeat.join()
+        info.update(worker=worker_id, seconds=time.perf_counter() - start, finished_at=time.time())
+        queue.complete(shard["id"], info)
+        completed += 1
+        print(f"[{worker_id}] shard {shard['id']} ({shard['start']}-{shard['stop']}) done in {info['seconds']:.1f}s ✅")
+    return completed
+
+
+######################################################
+######################## Merge #######################
+######################################################
+
+def merged_tables(queue_dir: str) -> tuple:
+    """(servers, rules) of all the shards, in server_id order. Fails if a shard is not done.
+    The exact_id of the rules is recomputed on the texts of all the shards, their canonical_id
+    is renumbered per (shard, canonical_id) to stay unique."""
+    queue = ShardQueue(queue_dir)
+    missing = [shard["id"] for shard in queue.plan["shards"] if not queue.is_done(shard["id"])]
+    if missing:
+        raise RuntimeError(f"{len(missing)} shards are not done yet: {', '.join(missing[:10])}")
+    tables = {}
+    for name in OUTPUT_FILES:
+        tables[name] = pd.concat([pd.read_parquet(queue.path("outputs", shard["id"], name))
+                                  for shard in queue.plan["shards"]],
+                                 keys=[shard["id"] for shard in queue.plan["shards"]], names=["shard", None])
+    rules = tables["rules.parquet"]
+    if DEDUP_TEXT_COLUMN in rules.columns:
+        from .dedup import exact_ids
+        rules["exact_id"] = exact_ids(rules.pop(DEDUP_TEXT_COLUMN))[0]
+    if "canonical_id" in rules.columns:
+        shard_ids = rules.index.get_level_values("shard")
+        rules["canonical_id"] = pd.MultiIndex.from_arrays([shard_ids, rules["canonical_id"]]).factorize()[0]
+    return tables["servers.parquet"].reset_index(drop=True), rules.reset_index(drop=True)
+
+
+def merge(queue_dir: str, output_dir: str, n_resamples: int = 1000, confidence: float = 0.95) -> dict:
+    """Writes <platform>_server_strictness.csv (as utils.refresh, bootstrap intervals included)
+    and the merged rules table <platform>_rules.parquet. Returns {output name: path}."""
+    from .aggregation import aggregate_rules
+    from .refresh import write_csv
+    from .server_bootstrap import bootstrap_servers
+    platform = ShardQueue(queue_dir).plan["platform"]
+    servers, rules = merged_tables(queue_dir)
+    strictness = aggregate_rules(rules, topic_col=None)[["server_id", "strictness_sum"]]
+    strictness = strictness.rename(columns={"strictness_sum": "strictness"})
+    if n_resamples:
+        intervals = bootstrap_servers(rules["strictness"], rules["server_id"], "sum",
+                                      n_resamples=n_resamples, confidence=confidence)
+        strictness["strictness_lower"] = intervals["lower"].to_numpy()
+        strictness["strictness_upper"] = intervals["upper"].to_numpy()
+
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = {"strictness": os.path.join(output_dir, f"{platform}_server_strictness.csv"),
+               "rules": os.path.join(output_dir, f"{platform}_rules.parquet")}
+    write_csv(strictness.merge(servers, how="left", on="server_id"), outputs["strictness"])
+    rules.to_parquet(f"{outputs['rules']}.tmp", index=False)
+    os.replace(f"{outputs['rules']}.tmp", outputs["rules"])
+    return outputs
+
+
+def run_local(platform: str, queue_dir: str, output_dir: str, workers: int = 2, shard_size: int = 1000,
+              data_path: str = None, stages: list = None, batch_size: int = None, n_resamples: int = 1000) -> dict:
+    """Plans the shards, runs them in `workers` local worker processes (each one behaving as a
+    separate machine, through the queue directory only) and merges their outputs."""
+    import multiprocessing
+    queue = ShardQueue(queue_dir)
+    plan = queue.create_plan(platform, data_path, shard_size, stages, batch_size)
+    print(f"{len(plan['shards'])} shards of {shard_size} servers, {workers} workers 🧩")
+    processes = [multiprocessing.Process(target=work, args=(queue_dir, f"local-{i}")) for i in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return merge(queue_dir, output_dir, n_resamples)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded pipeline runs through a shared-filesystem work queue.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    commands = {name: subparsers.add_parser(name) for name in ["plan", "work", "status", "merge", "local"]}
+    for name, subparser in commands.items():
+        subparser.add_argument("--queue", required=True, help="Queue directory, on a filesystem shared by the workers.")
+    for name in ["plan", "local"]:
+        commands[name].add_argument("--platform", choices=["mastodon", "reddit"], required=True)
+        commands[name].add_argument("--data-path", default=None)
+        commands[name].add_argument("--shard-size", type=int, default=1000, help="Servers per shard.")
+        commands[name].add_argument("--stages", nargs="+", default=None)
+        commands[name].add_argument("--batch-size", type=int, default=None, help="Texts per language detection batch.")
+    commands["plan"].add_argument("--cache-dir", default=None, help="Stage cache of the workers (shared or local).")
+    commands["work"].add_argument("--worker-id", default=None)
+    commands["work"].add_argument("--max-shards", type=int, default=None)
+    commands["work"].add_argument("--lease", type=float, default=DEFAULT_LEASE_SECONDS,
+                                  help="Seconds without heartbeat after which a claim is taken over.")
+    commands["local"].add_argument("--workers", type=int, default=2)
+    for name in ["merge", "local"]:
+        commands[name].add_argument("--output-dir", default=".")
+        commands[name].add_argument("--bootstrap", type=int, default=1000, metavar="N",
+                                    help="Bootstrap resamples of the strictness intervals (0: none).")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        plan = ShardQueue(args.queue).create_plan(args.platform, args.data_path, args.shard_size, args.stages,
+                                                  args.batch_size, args.cache_dir)
+        print(f"Planned {len(plan['shards'])} shards of {plan['n_servers']} {plan['platform']} servers 🧩")
+    elif args.command == "work":
+        n_done = work(args.queue, args.worker_id, args.max_shards, args.lease)
+        print(f"No shard left, {n_done} done by this worker 🏁")
+    elif args.command == "status":
+        status = ShardQueue(args.queue).status()
+        print(status.to_string(index=False))
+        print(status["state"].value_counts().to_string())
+    else:
+        if args.command == "merge":
+            outputs = merge(args.queue, args.output_dir, args.bootstrap)
+        else:
+            outputs = run_local(args.platform, args.queue, args.output_dir, args.workers, args.shard_size,
+                                args.data_path, args.stages, args.batch_size, args.bootstrap)
+        for name, path in outputs.items():
+            print(f"{name}: {path}")
@@ -1,18 +1,12 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
-from sklearn.metrics import r2_score
-from scipy.stats import pearsonr, spearmanr, norm, zscore,kendalltau,ttest_ind
 
-import shap
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import train_test_split
-from tqdm import tqdm
+# Heavy dependencies (matplotlib, scipy.stats, sklearn, shap, tqdm) are imported inside the functions using them
 
 
 
 def plot_distribution(data,xlabel,ylabel,title,bin):
+    import matplotlib.pyplot as plt
     plt.figure(figsize=(8, 6))
     plt.hist(data, bins=bin, edgecolor='black', align='left')
     plt.xlabel(xlabel)
@@ -24,6 +18,8 @@ def plot_distribution(data,xlabel,ylabel,title,bin):
     return
 
 def plot_scatter(x,y,xlabel,ylabel,title,cluster=None):
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import r2_score
     coefficients = np.polyfit(x, y, 1)  # 二次多项式
     poly_eq = np.poly1d(coefficients)
     y_fit = poly_eq(x)
@@ -57,18 +53,21 @@ def plot_scatter(x,y,xlabel,ylabel,title,cluster=None):
     return
 
 def pearsonr_correlation(x,y):
+    from scipy.stats import pearsonr
     corr, p_value = pearsonr(x, y)
     print(f"Pearson correlation coefficient: {corr}")
     print(f"P-value: {p_value}")
     return
 
 def spearmanr_correlation(x,y):
+    from scipy.stats import spearmanr
     corr, p_value = spearmanr(x, y)
     print(f"Spearmanr correlation coefficient: {corr}")
     print(f"P-value: {p_value}")
     return
 
 def kendalltau_correlation(x,y):
+    from scipy.stats import kendalltau
     corr, p_value = kendalltau(x, y)
     print(f"Kendall-tau correlation coefficient: {corr}")
     print(f"P-value: {p_value}")
@@ -79,6 +78,7 @@ def kendalltau_correlation(x,y):
 
 
 def fisher_z_test(A1, B1, A2, B2, method='spearman'):
+    from scipy.stats import pearsonr, spearmanr, norm
 
     if method == 'pearson':
         r1, _ = pearsonr(A1, B1)
@@ -111,6 +111,10 @@ def fisher_z_test(A1, B1, A2, B2, method='spearman'):
 
 
 def shap_analysis(df, feature_cols, target_col, plot_interaction=True, interaction_pair=None):
+    import shap
+    from scipy.stats import zscore
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.model_selection import train_test_split
 
     X_raw = df[feature_cols]
     y_raw = df[target_col]
@@ -144,6 +148,7 @@ def shap_analysis(df, feature_cols, target_col, plot_interaction=True, interacti
 
 
 def run_t_test(sample1, sample2, equal_var=False):
+    from scipy.stats import ttest_ind
 
     t_stat, p_value = ttest_ind(sample1, sample2, equal_var=equal_var)
     significant = p_value < 0.05
@@ -153,6 +158,8 @@ def run_t_test(sample1, sample2, equal_var=False):
 
 
 def bootstrap_spearman_diff(x1, y1, x2, y2, n_iter=10000, random_state=42):
+    from scipy.stats import spearmanr
+    from tqdm import tqdm
     rng = np.random.default_rng(random_state)
     n1 = len(x1)
     n2 = len(x2)
@@ -188,6 +195,8 @@ def bootstrap_spearman_diff(x1, y1, x2, y2, n_iter=10000, random_state=42):
 
 
 def bootstrap_kendall_diff(x1, y1, x2, y2, n_iter=10000, random_state=42):
+    from scipy.stats import kendalltau
+    from tqdm import tqdm
 
     rng = np.random.default_rng(random_state)
     n1 = len(x1)
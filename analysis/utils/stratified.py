@@ -0,0 +1,278 @@
+"""Correlations, t-tests and effect sizes for every stratum of a grouping column, in one table.
+
+Instead of filtering the DataFrame and calling pearsonr_correlation / run_t_test / fisher_z_test
+once per cluster or platform (see statistic_analysis), the statistics of all the strata (e.g.
+cluster, platform, over18, language) are computed together:
+    - Pearson: grouped centered sums of products (np.bincount over the stratum codes)
+    - Spearman: Pearson on the ranks within each stratum (groupby().rank(), average ties as scipy)
+    - Kendall: scipy.stats.kendalltau per stratum (no grouped formulation)
+    - t-tests: each stratum against the rest of the data (or a reference stratum), Welch by
+      default as run_t_test, from the grouped moments
+The p-values are those of scipy (spearmanr, pearsonr, ttest_ind), and each correlation is also
+compared to the correlation over the rest of the data (the other strata) with a Fisher z-test,
+as fisher_z_test(): the two samples are independent, unlike a stratum and the overall sample.
+
+Usage:
+    results = stratified_analysis(servers, by="cluster",
+                                  pairs=[("strictness", "active_month"), ("strictness", "total_users")],
+                                  t_tests=["strictness"])
+"""
+import numpy as np
+import pandas as pd
+
+
+METHODS = ["pearson", "spearman", "kendall"]
+OVERALL = "(all)"
+# (c, k) of the variance c / (n - k) of the Fisher z of each coefficient (Fieller, Hartley and
+# Pearson 1957 for the rank correlations)
+Z_VARIANCE = {"pearson": (1.0, 3), "spearman": (1.06, 3), "kendall": (0.437, 4)}
+
+
+def _values(df: pd.DataFrame, column: str) -> np.ndarray:
+    """Column as floats, missing values (NA of nullable and Arrow dtypes included) as NaN."""
+    return pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+
+
+def _strata(df: pd.DataFrame, by: str) -> tuple:
+    """(code of the stratum of each row, -1 if missing, stratum values), strata sorted."""
+    codes, strata = pd.factorize(df[by], sort=True)
+    return codes, np.asarray(strata, dtype=object)
+
+
+def _grouped_moments(codes: np.ndarray, values: np.ndarray, n_groups: int) -> tuple:
+    """(count, mean, sum of squared deviations) of the values of each group."""
+    n = np.bincount(codes, minlength=n_groups).astype(float)
+    mean = np.bincount(codes, weights=values, minlength=n_groups) / np.maximum(n, 1)
+    m2 = np.bincount(codes, weights=(values - mean[codes]) ** 2, minlength=n_groups)
+    return n, mean, m2
+
+
+def grouped_pearson(codes: np.ndarray, x: np.ndarray, y: np.ndarray, n_groups: int) -> tuple:
+    """(count, Pearson r, two-sided p-value) of each group, NaN for groups of less than 3 rows."""
+    from scipy.stats import t as student
+    n, mean_x, m2_x = _grouped_moments(codes, x, n_groups)
+    _, mean_y, m2_y = _grouped_moments(codes, y, n_groups)
+    cross = np.bincount(codes, weights=(x - mean_x[codes]) * (y - mean_y[codes]), minlength=n_groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.clip(cross / np.sqrt(m2_x * m2_y), -1, 1)
+        t_stat = r * np.sqrt((n - 2) / (1 - r ** 2))
+        p = 2 * student.sf(np.abs(t_stat), n - 2)
+    r[n < 3] = np.nan
+    p[(n < 3) | np.isnan(r)] = np.nan
+    p[np.abs(r) == 1] = 0.0
+    return n.astype(np.int64), r, p
+
+
+def fisher_z(r):
+    """Fisher r-to-z transformation, clipped as in fisher_z_test() to avoid infinite values at ±1."""
+    r = np.clip(r, -0.999999, 0.999999)
+    return 0.5 * np.log((1 + r) / (1 - r))
+
+
+def benjamini_hochberg(p_values) -> np.ndarray:
+    """False discovery rate adjusted p-values (NaN p-values are left out and stay NaN)."""
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(len(p_values), np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    if len(valid):
+        order = valid[np.argsort(p_values[valid])]
+        scaled = p_values[order] * len(valid) / np.arange(1, len(valid) + 1)
+        adjusted[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1.0)
+    return adjusted
+
+
+######################################################
+################### Correlations #####################
+######################################################
+
+def _rest_correlations(method: str, codes: np.ndarray, x: np.ndarray, y: np.ndarray, n_strata: int) -> np.ndarray:
+    """Correlation of x and y over the rows outside of each stratum, NaN for less than 3 rows."""
+    from scipy.stats import kendalltau, spearmanr
+    r = np.full(n_strata, np.nan)
+    rest_n = len(codes) - np.bincount(codes, minlength=n_strata)
+    if method == "pearson":  # sums of the rest from the totals, on values centered for precision
+        x, y = x - x.mean(), y - y.mean()
+
+        def rest_sum(values):
+            return values.sum() - np.bincount(codes, weights=values, minlength=n_strata)
+
+        sx, sy = rest_sum(x), rest_sum(y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = rest_sum(x * y) - sx * sy / rest_n
+            var_x, var_y = rest_sum(x * x) - sx ** 2 / rest_n, rest_sum(y * y) - sy ** 2 / rest_n
+            r = np.clip(cov / np.sqrt(var_x * var_y), -1, 1)
+    else:
+        correlation = spearmanr if method == "spearman" else kendalltau
+        for group in np.flatnonzero(rest_n >= 3):
+            rest = codes != group
+            r[group] = correlation(x[rest], y[rest])[0]
+    r[rest_n < 3] = np.nan
+    return r
+
+
+def stratified_correlations(df: pd.DataFrame, by: str, x: str, y: str, methods: list = METHODS,
+                            min_size: int = 3, include_overall: bool = True, confidence: float = 0.95) -> pd.DataFrame:
+    """Correlation of x and y in each stratum of `by`, rows with a missing or infinite x / y dropped.
+
+    Returns:
+        pd.DataFrame: One row per (stratum, method) with n, statistic and effect_size (the
+            correlation coefficient), p_value, the Fisher-z confidence interval of the
+            coefficient (ci_low, ci_high, see Z_VARIANCE), rest_n and rest_statistic (the
+            correlation over the other strata) and z_vs_rest / p_vs_rest, the Fisher z-test of
+            the difference between the two.
+    """
+    from scipy.stats import kendalltau, norm
+    codes, strata = _strata(df, by)
+    x_values, y_values = _values(df, x), _values(df, y)
+    valid = (codes >= 0) & np.isfinite(x_values) & np.isfinite(y_values)
+    codes, x_values, y_values = codes[valid], x_values[valid], y_values[valid]
+    n_strata = len(strata)
+    # The overall stratum is one more group, holding every row
+    all_codes = np.r_[codes, np.full(len(codes), n_strata)]
+    all_x, all_y = np.r_[x_values, x_values], np.r_[y_values, y_values]
+    labels = np.r_[strata, [OVERALL]]
+
+    rows = []
+    for method in methods:
+        if method == "pearson":
+            n, r, p = grouped_pearson(all_codes, all_x, all_y, n_strata + 1)
+        elif method == "spearman":
+            groups = pd.Series(all_codes)
+            x_ranks = pd.Series(all_x).groupby(groups).rank().to_numpy()
+            y_ranks = pd.Series(all_y).groupby(groups).rank().to_numpy()
+            n, r, p = grouped_pearson(all_codes, x_ranks, y_ranks, n_strata + 1)
+        elif method == "kendall":
+            n = np.bincount(all_codes, minlength=n_strata + 1)
+            r, p = np.full(n_strata + 1, np.nan), np.full(n_strata + 1, np.nan)
+            order = np.argsort(all_codes, kind="stable")
+            bounds = np.r_[0, np.cumsum(n)]
+            for group in np.flatnonzero(n >= 3):
+                rows_of_group = order[bounds[group]:bounds[group + 1]]
+                r[group], p[group] = kendalltau(all_x[rows_of_group], all_y[rows_of_group])
+        else:
+            raise ValueError(f"Unknown method {method!r}, expected one of {METHODS}.")
+
+        # The overall row has no rest
+        rest_n = np.r_[n[-1] - n[:-1], 0]
+        rest_r = np.r_[_rest_correlations(method, codes, x_values, y_values, n_strata), np.nan]
+        scale, offset = Z_VARIANCE[method]
+        # The Fisher z standard error needs more than `offset` rows
+        variance = np.where(n > offset, scale / np.maximum(n - offset, 1), np.nan)
+        rest_variance = np.where(rest_n > offset, scale / np.maximum(rest_n - offset, 1), np.nan)
+        with np.errstate(invalid="ignore"):
+            half_width = norm.ppf((1 + confidence) / 2) * np.sqrt(variance)
+            z = fisher_z(r)
+            z_vs_rest = (z - fisher_z(rest_r)) / np.sqrt(variance + rest_variance)
+        rows.append(pd.DataFrame({"stratum": labels, "test": method, "x": x, "y": y, "n": n,
+                                  "statistic": r, "p_value": p, "effect_size": r,
+                                  "ci_low": np.tanh(z - half_width), "ci_high": np.tanh(z + half_width),
+                                  "rest_n": rest_n, "rest_statistic": rest_r, "z_vs_rest": z_vs_rest,
+                                  "p_vs_rest": 2 * norm.sf(np.abs(z_vs_rest))}))
+    results = pd.concat(rows, ignore_index=True)
+    results = results[results["n"] >= min_size]
+    if not include_overall:
+        results = results[results["stratum"] != OVERALL]
+    return results.reset_index(drop=True)
+
+
+######################################################
+###################### t-tests #######################
+######################################################
+
+def stratified_t_tests(df: pd.DataFrame, by: str, column: str, reference=None, equal_var: bool = False,
+                       min_size: int = 2, confidence: float = 0.95) -> pd.DataFrame:
+    """t-test of the mean of `column` in each stratum against the rest of the data (or against
+    the `reference` stratum), Welch's by default as run_t_test().
+
+    Returns:
+        pd.DataFrame: One row per stratum with n, mean, reference_n, reference_mean, statistic (t),
+            p_value, effect_size (Cohen's d with the pooled standard deviation), hedges_g, and
+            the confidence interval of the difference of the means (ci_low, ci_high).
+    """
+    from scipy.stats import t as student
+    codes, strata = _strata(df, by)
+    values = _values(df, column)
+    valid = (codes >= 0) & np.isfinite(values)
+    codes, values = codes[valid], values[valid]
+    n, mean, m2 = _grouped_moments(codes, values, len(strata))
+
+    if reference is None:  # the rest of the data, from the totals (parallel variance formula)
+        total_n, total_mean = len(values), values.mean() if len(values) else np.nan
+        total_m2 = ((values - total_mean) ** 2).sum()
+        ref_n = total_n - n
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ref_mean = (total_n * total_mean - n * mean) / ref_n
+            ref_m2 = total_m2 - m2 - (mean - ref_mean) ** 2 * n * ref_n / total_n
+        ref_m2 = np.maximum(ref_m2, 0)
+    else:
+        position = np.flatnonzero(strata == reference)
+        if not len(position):
+            raise ValueError(f"The reference {reference!r} is not a value of {by!r}.")
+        ref_n, ref_mean, ref_m2 = n[position[0]], mean[position[0]], m2[position[0]]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var, ref_var = m2 / (n - 1), ref_m2 / (ref_n - 1)
+        pooled_var = (m2 + ref_m2) / (n + ref_n - 2)
+        if equal_var:
+            se = np.sqrt(pooled_var * (1 / n + 1 / ref_n))
+            dof = n + ref_n - 2
+        else:
+            se = np.sqrt(var / n + ref_var / ref_n)
+            dof = (var / n + ref_var / ref_n) ** 2 / ((var / n) ** 2 / (n - 1) + (ref_var / ref_n) ** 2 / (ref_n - 1))
+        difference = mean - ref_mean
+        t_stat = difference / se
+        p = 2 * student.sf(np.abs(t_stat), dof)
+        cohen_d = difference / np.sqrt(pooled_var)
+        half_width = student.ppf((1 + confidence) / 2, dof) * se
+    results = pd.DataFrame({"stratum": strata, "test": "t_test", "x": column, "y": None,
+                            "n": n.astype(np.int64), "mean": mean,
+                            "reference_n": np.broadcast_to(ref_n, n.shape).astype(np.int64),
+                            "reference_mean": np.broadcast_to(ref_mean, n.shape),
+                            "statistic": t_stat, "p_value": p, "effect_size": cohen_d,
+                            "hedges_g": cohen_d * (1 - 3 / (4 * (n + ref_n) - 9)),
+                            "ci_low": difference - half_width, "ci_high": difference + half_width})
+    if reference is not None:
+        results = results[results["stratum"] != reference]
+    keep = (results["n"] >= min_size) & (results["reference_n"] >= min_size)
+    return results[keep].reset_index(drop=True)
+
+
+######################################################
+###################### Combined ######################
+######################################################
+
+def stratified_analysis(df: pd.DataFrame, by: str, pairs: list = (), t_tests: list = (), methods: list = METHODS,
+                        reference=None, equal_var: bool = False, min_size: int = 3, alpha: float = 0.05,
+                        include_overall: bool = True) -> pd.DataFrame:
+    """Correlations of each (x, y) pair and t-tests of each column, for every stratum of `by`.
+
+    Args:
+        df (pd.DataFrame): One row per server (e.g. the refresh outputs, or MultiPlatformDataset.frame()).
+        by (str): Grouping column (cluster, platform, over18, language, ...).
+        pairs (list): (x, y) column pairs, correlated with every method of `methods`.
+        t_tests (list): Columns whose mean in each stratum is compared with the rest (or `reference`).
+        alpha (float): Level of the `significant` column, on the Benjamini-Hochberg adjusted p-values
+            of each test type.
+
+    Returns:
+        pd.DataFrame: One row per (stratum, test, x, y), with by, n, statistic, p_value, p_adjusted,
+            significant, effect_size (correlation coefficient or Cohen's d), ci_low, ci_high, and
+            the test-specific columns of stratified_correlations() and stratified_t_tests().
+    """
+    tables = [stratified_correlations(df, by, x, y, methods, min_size, include_overall) for x, y in pairs]
+    tables += [stratified_t_tests(df, by, column, reference, equal_var, min_size) for column in t_tests]
+    tables = [table for table in tables if len(table)]
+    if not tables:
+        return pd.DataFrame(columns=["by", "stratum", "test", "x", "y", "n", "statistic", "p_value",
+                                     "p_adjusted", "significant", "effect_size", "ci_low", "ci_high"])
+    results = pd.concat(tables, ignore_index=True)
+    results.insert(0, "by", by)
+    overall = results["stratum"] == OVERALL
+    results["p_adjusted"] = np.nan
+    for test, rows in results[~overall].groupby("test").groups.items():
+        results.loc[rows, "p_adjusted"] = benjamini_hochberg(results.loc[rows, "p_value"])
+    results.loc[overall, "p_adjusted"] = results.loc[overall, "p_value"]
+    results["significant"] = results["p_adjusted"] < alpha
+    first = ["by", "stratum", "test", "x", "y", "n", "statistic", "p_value", "p_adjusted", "significant",
+             "effect_size", "ci_low", "ci_high"]
+    return results[first + [column for column in results.columns if column not in first]]
@@ -0,0 +1,51 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+
+LEXICON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "strictness_lexicon.json")
+
+
+def load_lexicon(path: str = LEXICON_PATH) -> dict:
+    """Strict and lenient modal words, as {"strict": [...], "lenient": [...]}."""
+    with open(path, encoding="utf-8") as f:
+        lexicon = json.load(f)
+    return lexicon[0] if isinstance(lexicon, list) else lexicon
+
+
+def lexicon_hits(documents: pd.Series, lexicon: dict = None) -> pd.DataFrame:
+    """Number of occurrences of the strict and lenient words in each document.
+
+    Occurrences are substring counts, like str.count in the notebook version of the metric
+    (e.g. "no" is also counted in "not"). Each word is counted over all documents in one
+    vectorized pass.
+    """
+    lexicon = lexicon or load_lexicon()
+    documents = documents.fillna("").astype(str)
+    hits = {}
+    for kind in ["strict", "lenient"]:
+        counts = np.zeros(len(documents), dtype=np.int64)
+        for word in lexicon[kind]:
+            counts += documents.str.count(re.escape(word)).to_numpy(dtype=np.int64)
+        hits[f"{kind}_hits"] = counts
+    return pd.DataFrame(hits, index=documents.index)
+
+
+def strictness_scores(strict_hits, lenient_hits) -> np.ndarray:
+    """ Computes the strictness score of a rule based on the modal words it contains.
+    The metric is defined as follows:
+        S = number of strict words that the rule contains
+        L = number of lenient words that the rule contains
+        T = S + L
+
+        Strictness score = 0 if T = 0
+                           S / T otherwise
+
+        Strictness score is between 0 and 1, equal to 0 if no imperative words are present,
+        and equal to one if all the imperative words that the rule contains are strict words."""
+    strict_hits = np.asarray(strict_hits, dtype=float)
+    total = strict_hits + np.asarray(lenient_hits, dtype=float)
+    return np.divide(strict_hits, total, out=np.zeros_like(total), where=total != 0)
@@ -0,0 +1,424 @@
+"""Local HTTP/JSON lookup service for the server strictness, topic and engagement outputs.
+
+The outputs of utils.refresh (or utils.shards merge) of each platform are loaded into
+in-memory indexes keyed by domain, and reloaded automatically when the pipeline writes new
+versions of them:
+    - <platform>_server_strictness.csv   strictness and engagement of each server (required)
+    - <platform>_clusters_descr.csv      topic of its description
+    - <platform>_server_clusters.csv     cluster of its rules
+    - <platform>_rules.parquet           its rules, with their strictness and topic
+The JSON of every server and rule is encoded once per snapshot, so a lookup only joins bytes.
+Only the standard library is used besides pandas.
+
+Endpoints:
+    GET  /health                                    loaded files and number of servers
+    GET  /servers/<domain>[?platform=mastodon]      one server
+    GET  /servers?domains=a,b,c[&platform=...]      several servers
+    POST /servers  {"domains": [...], "platform": ...}
+    GET  /rules/<domain>[?platform=...]             rules of one server
+    GET  /top?metric=strictness&k=10[&platform=...&order=asc]
+
+Usage (from the analysis/ directory):
+    python -m utils.strictness_service --port 8000
+    python -m utils.strictness_service --benchmark 5000 --concurrency 8
+"""
+import argparse
+import http.client
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+import numpy as np
+import pandas as pd
+
+
+STRICTNESS_FILES = {"mastodon": "mastodon_server_strictness.csv",
+                    "reddit": "reddit_server_strictness.csv"}
+CLUSTERS_FILE = "{platform}_clusters_descr.csv"
+RULES_FILE = "{platform}_rules.parquet"
+SERVER_CLUSTERS_FILE = "{platform}_server_clusters.csv"
+# Columns of the descriptions output added to the servers
+CLUSTER_COLUMNS = {"Topic": "topic", "Topic Name": "topic_name"}
+# Numeric columns that are ids, not metrics that /top can rank by
+ID_COLUMNS = ["server_id", "topic", "cluster", "rule_topic"]
+
+
+def _file_version(path: str):
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, TypeError):
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _encode(records: list) -> list:
+    return [json.dumps(record).encode("utf-8") for record in records]
+
+
+def _json_list(items: list) -> bytes:
+    return b"[" + b",".join(items) + b"]"
+
+
+class PlatformIndex:
+    """Immutable snapshot of the outputs of one platform: JSON-ready records of the servers, their
+    encoded JSON, a domain -> row index and the encoded rules of each server.
+
+    Args:
+        path (str): <platform>_server_strictness.csv.
+        clusters_path (str): <platform>_clusters_descr.csv, skipped when missing.
+        rules_path (str): <platform>_rules.parquet, skipped when missing.
+        server_clusters_path (str): <platform>_server_clusters.csv, skipped when missing.
+        platform (str): Added to every record.
+    """
+
+    def __init__(self, path: str, clusters_path: str = None, rules_path: str = None, server_clusters_path: str = None,
+                 platform: str = None) -> None:
+        self.path = path
+        self.files = {name: file for name, file in [("servers", path), ("clusters", clusters_path),
+                                                     ("rules", rules_path), ("server_clusters", server_clusters_path)]
+                      if _file_version(file) is not None}
+        self.version = tuple(_file_version(file) for file in (path, clusters_path, rules_path, server_clusters_path))
+        df = pd.read_csv(path)
+        if "clusters" in self.files:
+            clusters = pd.read_csv(clusters_path, usecols=lambda col: col == "server_id" or col in CLUSTER_COLUMNS)
+            clusters = clusters.drop_duplicates("server_id").rename(columns=CLUSTER_COLUMNS)
+            df = df.merge(clusters, on="server_id", how="left")
+        if "server_clusters" in self.files:
+            server_clusters = pd.read_csv(server_clusters_path, usecols=["server_id", "cluster"])
+            df = df.merge(server_clusters.drop_duplicates("server_id"), on="server_id", how="left")
+        for col in ["topic", "cluster"]:
+            if col in df.columns:
+                df[col] = df[col].astype("Int64")
+
+        self.rules = None
+        if "rules" in self.files:
+            rules = pd.read_parquet(rules_path).sort_values("server_id", kind="stable", ignore_index=True)
+            server_ids = rules["server_id"].to_numpy()
+            # Rules of the server of row i: self.rules[starts[i]:stops[i]]
+            self.rule_starts = np.searchsorted(server_ids, df["server_id"].to_numpy(), side="left")
+            self.rule_stops = np.searchsorted(server_ids, df["server_id"].to_numpy(), side="right")
+            self.rules = _encode(json.loads(rules.to_json(orient="records")))
+            if "n_rules" not in df.columns:
+                df["n_rules"] = self.rule_stops - self.rule_starts
+            if "Topic" in rules.columns:
+                # Most frequent topic of the rules of each server (outliers left out)
+                counts = rules.loc[rules["Topic"] >= 0].groupby(["server_id", "Topic"]).size()
+                main = counts.sort_values(ascending=False, kind="stable").reset_index().drop_duplicates("server_id")
+                df["rule_topic"] = df["server_id"].map(main.set_index("server_id")["Topic"]).astype("Int64")
+
+        self.columns = list(df.columns)
+        self.numeric_columns = [col for col in df.columns
+                                if pd.api.types.is_numeric_dtype(df[col]) and col not in ID_COLUMNS]
+        self.values = {col: df[col].to_numpy(dtype=float, na_value=np.nan) for col in self.numeric_columns}
+        self.records = json.loads(df.to_json(orient="records"))  # NaN -> null
+        if platform is not None:
+            self.records = [{"platform": platform, **record} for record in self.records]
+        self.payloads = _encode(self.records)
+        self.rows = {str(domain).lower(): i for i, domain in enumerate(df["domain"])}
+        self._orders = {}
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def row(self, domain: str):
+        return self.rows.get(str(domain).strip().lower())
+
+    def get(self, domain: str):
+        i = self.row(domain)
+        return None if i is None else self.records[i]
+
+    def rules_json(self, i: int) -> bytes:
+        return _json_list(self.rules[self.rule_starts[i]:self.rule_stops[i]])
+
+    def top_rows(self, metric: str, k: int, ascending: bool = False) -> np.ndarray:
+        if metric not in self.values:
+            raise KeyError(metric)
+        if metric not in self._orders:
+            # Sorted once per snapshot, missing values left out
+            values = self.values[metric]
+            order = np.argsort(np.nan_to_num(values, nan=np.inf), kind="stable")
+            self._orders[metric] = order[:int((~np.isnan(values)).sum())]
+        order = self._orders[metric]
+        return order[:k] if ascending else order[::-1][:k]
+
+    def top(self, metric: str, k: int, ascending: bool = False) -> list:
+        return [self.records[i] for i in self.top_rows(metric, k, ascending)]
+
+
+class StrictnessStore:
+    """Indexes of all platforms, swapped atomically when one of their files changes on disk.
+
+    The files are checked at most every `check_interval` seconds, on request. Files that cannot
+    be parsed (e.g. while they are being written) keep the previous snapshot.
+    """
+
+    def __init__(self, data_dir: str = ".", files: dict = STRICTNESS_FILES, check_interval: float = 1.0) -> None:
+        self.paths = {platform: (os.path.join(data_dir, name),
+                                 os.path.join(data_dir, CLUSTERS_FILE.format(platform=platform)),
+                                 os.path.join(data_dir, RULES_FILE.format(platform=platform)),
+                                 os.path.join(data_dir, SERVER_CLUSTERS_FILE.format(platform=platform)))
+                      for platform, name in files.items()}
+        self.check_interval = check_interval
+        self.indexes = {}
+        self.reloads = 0
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.refresh(force=True)
+
+    def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return
+        with self._lock:
+            self._last_check = now
+            indexes = dict(self.indexes)
+            for platform, paths in self.paths.items():
+                if _file_version(paths[0]) is None:
+                    indexes.pop(platform, None)
+                    continue
+                current = indexes.get(platform)
+                if current is not None and current.version == tuple(_file_version(path) for path in paths):
+                    continue
+                try:
+                    indexes[platform] = PlatformIndex(*paths, platform=platform)
+                    self.reloads += current is not None
+                except Exception as e:
+                    print(f"Could not load the {platform} outputs, keeping the previous version: {e}")
+            self.indexes = indexes
+
+    def platforms(self, platform: str = None) -> list:
+        if platform is None:
+            return list(self.indexes.items())
+        if platform not in self.indexes:
+            raise KeyError(platform)
+        return [(platform, self.indexes[platform])]
+
+    def _find(self, domain: str, platform: str = None):
+        for _, index in self.platforms(platform):
+            i = index.row(domain)
+            if i is not None:
+                return index, i
+        return None, None
+
+    def lookup(self, domain: str, platform: str = None):
+        index, i = self._find(domain, platform)
+        return None if index is None else index.records[i]
+
+    def lookup_many(self, domains: list, platform: str = None) -> dict:
+        return {domain: self.lookup(domain, platform) for domain in domains}
+
+    def rules(self, domain: str, platform: str = None):
+        """Rules of a server, None for an unknown domain or a platform without rules table."""
+        index, i = self._find(domain, platform)
+        return None if index is None or index.rules is None else json.loads(index.rules_json(i))
+
+    def _top(self, metric: str, k: int, platform: str, ascending: bool) -> list:
+        """(index, row) of the k servers of all platforms with the highest (lowest) metric."""
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        results = [(index.values[metric][i], index, i)
+                   for _, index in self.platforms(platform) for i in index.top_rows(metric, k, ascending)]
+        results.sort(key=lambda result: result[0], reverse=not ascending)
+        return [(index, i) for _, index, i in results[:k]]
+
+    def top(self, metric: str = "strictness", k: int = 10, platform: str = None, ascending: bool = False) -> list:
+        return [index.records[i] for index, i in self._top(metric, k, platform, ascending)]
+
+    # Encoded responses of the HTTP handler, made of the JSON encoded once per snapshot
+
+    def lookup_json(self, domain: str, platform: str = None):
+        index, i = self._find(domain, platform)
+        return None if index is None else index.payloads[i]
+
+    def lookup_many_json(self, domains: list, platform: str = None) -> bytes:
+        items = [json.dumps(str(domain)).encode("utf-8") + b":" + (self.lookup_json(domain, platform) or b"null")
+                 for domain in domains]
+        return b"{" + b",".join(items) + b"}"
+
+    def rules_json(self, domain: str, platform: str = None):
+        index, i = self._find(domain, platform)
+        if index is None or index.rules is None:
+            return None
+        server = index.records[i]
+        return (b'{"platform":' + json.dumps(server.get("platform")).encode("utf-8")
+                + b',"domain":' + json.dumps(server["domain"]).encode("utf-8")
+                + b',"server_id":' + json.dumps(server["server_id"]).encode("utf-8")
+                + b',"rules":' + index.rules_json(i) + b"}")
+
+    def top_json(self, metric: str = "strictness", k: int = 10, platform: str = None, ascending: bool = False) -> bytes:
+        return _json_list([index.payloads[i] for index, i in self._top(metric, k, platform, ascending)])
+
+    def health(self) -> dict:
+        return {"platforms": {name: {"files": index.files, "servers": len(index), "metrics": index.numeric_columns,
+                                     "rules": len(index.rules) if index.rules is not None else None}
+                              for name, index in self.indexes.items()},
+                "reloads": self.reloads}
+
+
+######################################################
+##################### HTTP server ####################
+######################################################
+
+def make_handler(store: StrictnessStore):
+    class StrictnessHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+        disable_nagle_algorithm = True  # headers and body are written separately
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, payload) -> None:
+            self._send_json(status, json.dumps(payload).encode("utf-8"))
+
+        def _send_json(self, status: int, body: bytes) -> None:
+            # Status line, headers and body in a single write (no Date / Server headers)
+            head = (f"HTTP/1.1 {status} {self.responses[status][0]}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n")
+            self.wfile.write(head.encode("latin-1") + body)
+
+        def _route(self, method: str) -> None:
+            store.refresh()
+            url = urlparse(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            platform = query.get("platform")
+            parts = [part for part in url.path.split("/") if part]
+            try:
+                if method == "GET" and parts == ["health"]:
+                    return self._send(200, store.health())
+                if method == "GET" and len(parts) == 2 and parts[0] in ("servers", "rules"):
+                    domain = unquote(parts[1])
+                    lookup = store.lookup_json if parts[0] == "servers" else store.rules_json
+                    body = lookup(domain, platform)
+                    if body is None:
+                        return self._send(404, {"error": f"Unknown domain {domain}" if store.lookup_json(domain, platform) is None
+                                                else f"No rules table for the platform of {domain}"})
+                    return self._send_json(200, body)
+                if parts == ["servers"] and method == "GET":
+                    domains = [d for d in query.get("domains", "").split(",") if d]
+                    return self._send_json(200, store.lookup_many_json(domains, platform))
+                if parts == ["servers"] and method == "POST":
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                    if not isinstance(body, dict):
+                        raise ValueError("The body must be a JSON object {\"domains\": [...], \"platform\": ...}")
+                    domains, platform = body.get("domains", []), body.get("platform", platform)
+                    if not isinstance(domains, list) or not all(isinstance(domain, str) for domain in domains):
+                        raise ValueError("domains must be a list of strings")
+                    if platform is not None and not isinstance(platform, str):
+                        raise ValueError("platform must be a string")
+                    return self._send_json(200, store.lookup_many_json(domains, platform))
+                if method == "GET" and parts == ["top"]:
+                    return self._send_json(200, store.top_json(query.get("metric", "strictness"), int(query.get("k", 10)),
+                                                               platform, ascending=query.get("order", "desc") == "asc"))
+                return self._send(404, {"error": f"Unknown endpoint {method} {url.path}"})
+            except KeyError as e:
+                return self._send(400, {"error": f"Unknown platform or metric {e}"})
+            except ValueError as e:
+                return self._send(400, {"error": str(e)})
+
+        def do_GET(self):
+            self._route("GET")
+
+        def do_POST(self):
+            self._route("POST")
+
+    return StrictnessHandler
+
+
+class StrictnessServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # the default backlog of 5 drops connections under concurrent load
+
+
+def serve(store: StrictnessStore, host: str = "127.0.0.1", port: int = 8000) -> StrictnessServer:
+    """Starts the service in a background thread and returns the server (server.shutdown() to stop)."""
+    server = StrictnessServer((host, port), make_handler(store))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+######################################################
+##################### Benchmark ######################
+######################################################
+
+def benchmark(host: str, port: int, paths: list, concurrency: int = 8) -> dict:
+    """Sends GET requests for the given paths with `concurrency` keep-alive connections.
+
+    Returns:
+        dict: Number of requests, errors, throughput (requests/s) and latency percentiles (ms).
+    """
+    chunks = [paths[i::concurrency] for i in range(concurrency)]
+
+    def worker(chunk):
+        connection = http.client.HTTPConnection(host, port)
+        latencies, errors = [], 0
+        for path in chunk:
+            start = time.perf_counter()
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            errors += response.status >= 500
+        connection.close()
+        return latencies, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(worker, chunks))
+    elapsed = time.perf_counter() - start
+    latencies = np.concatenate([np.asarray(lat) for lat, _ in results]) * 1000
+    return {"requests": len(paths),
+            "errors": sum(err for _, err in results),
+            "concurrency": concurrency,
+            "throughput_rps": len(paths) / elapsed,
+            **{f"p{q}_ms": float(np.percentile(latencies, q)) for q in (50, 95, 99)},
+            "max_ms": float(latencies.max())}
+
+
+def benchmark_paths(store: StrictnessStore, n_requests: int, batch_size: int = 20, seed: int = 0) -> dict:
+    """Request mixes of the benchmark: point lookups, batch lookups, rules and top-k queries."""
+    rng = np.random.default_rng(seed)
+    domains = [record["domain"] for _, index in store.platforms() for record in index.records]
+    point = [f"/servers/{quote(str(domains[i]))}" for i in rng.integers(0, len(domains), n_requests)]
+    batch = ["/servers?domains=" + ",".join(quote(str(domains[i])) for i in rng.integers(0, len(domains), batch_size))
+             for _ in range(n_requests)]
+    top = [f"/top?metric=strictness&k={k}" for k in rng.integers(1, 50, n_requests)]
+    paths = {"point": point, "batch": batch, "top_k": top}
+    with_rules = [record["domain"] for _, index in store.platforms() if index.rules is not None for record in index.records]
+    if with_rules:
+        paths["rules"] = [f"/rules/{quote(str(with_rules[i]))}" for i in rng.integers(0, len(with_rules), n_requests)]
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the server strictness outputs over HTTP/JSON.")
+    parser.add_argument("--data-dir", default=".", help="Directory of the refresh outputs (*_server_strictness.csv...).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--benchmark", type=int, default=0, metavar="N",
+                        help="Instead of serving, run N requests of each kind against a local instance and print latencies.")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Connections of the throughput runs; latencies are also measured on a single connection.")
+    args = parser.parse_args()
+
+    store = StrictnessStore(args.data_dir)
+    if args.benchmark:
+        server = serve(store, args.host, 0)
+        port = server.server_address[1]
+        rows = [{"query": kind, **benchmark(args.host, port, paths, concurrency)}
+                for concurrency in sorted({1, args.concurrency})
+                for kind, paths in benchmark_paths(store, args.benchmark).items()]
+        server.shutdown()
+        print(pd.DataFrame(rows).round(3).to_string(index=False))
+    else:
+        print(f"Serving {', '.join(f'{len(i)} {p} servers' for p, i in store.indexes.items())} "
+              f"on http://{args.host}:{args.port} 🚀")
+        server = StrictnessServer((args.host, args.port), make_handler(store))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
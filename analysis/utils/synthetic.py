@@ -0,0 +1,248 @@
+"""Generator of synthetic, schema-faithful Mastodon and Reddit datasets.
+
+The generated CSVs have the same columns and cell encodings as the files written by
+dataset/Mastodon/test.py and dataset/Reddit/reddit.py (JSON-encoded languages, rules and
+trends, " | "-joined blacklists, "; "-joined Reddit rules), so that MastodonDataset and
+RedditDataset can load them directly. A share of the Mastodon servers copies the default
+mastodon.social rules, verbatim or lightly edited, as observed in the real crawl.
+
+Usage (from the analysis/ directory):
+    python -m utils.synthetic --sizes 10000 100000 --output-dir synthetic_data
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+MASTODON_COLUMNS = ["domain", "title", "source_url", "description", "active_month",
+                    "languages", "rules", "top_5_trends", "total_users", "total_posts", "blacklist"]
+REDDIT_COLUMNS = ["name", "title", "description", "language", "subscribers", "active_user_count",
+                  "over18", "quarantine", "is_restricted", "moderators_count", "rules"]
+
+# Rules of mastodon.social, which many servers copy as their own
+DEFAULT_RULES = [
+    ("Sexually explicit or violent media must be marked as sensitive or with a content warning",
+     "This includes content that is particularly provocative even if it may not show specific body parts, as well as dead bodies, bloody injuries, and other gore."),
+    ("No racism, sexism, homophobia, transphobia, ableism, xenophobia, or casteism.",
+     "Transphobic behavior such as intentional misgendering and deadnaming is strictly prohibited."),
+    ("No incitement of violence or promotion of violent ideologies",
+     "Calling for people or groups to be assassinated, murdered, or attacked physically is strictly prohibited."),
+    ("No harassment, block evasion, dogpiling, or doxxing of others",
+     "Repeat attempts to communicate with users who have blocked you is strictly prohibited."),
+    ("Do not share information widely-known to be false and misleading",
+     "False and misleading information and links from low-quality sources may not be posted."),
+    ("Content created by others must be attributed, and use of generative AI must be disclosed",
+     "Content created by others must clearly provide a reference to the author, creator, or source."),
+]
+
+RULE_TEMPLATES = [
+    "No {}.",
+    "No {} of any kind is allowed",
+    "Do not post {}",
+    "{} is strictly prohibited",
+    "{} will result in a permanent ban",
+    "Please avoid {}",
+    "Please use a content warning for {}",
+    "You should not engage in {}",
+    "We encourage you to report {}",
+    "{} may be removed by moderators",
+    "Be respectful, {} is not tolerated",
+    "Keep in mind that {} is against our policy",
+]
+RULE_SUBJECTS = ["spam", "advertising", "hate speech", "harassment", "nsfw content", "illegal content",
+                 "racism", "sexism", "bots", "misinformation", "doxxing", "violence", "crypto promotion",
+                 "political content", "self promotion", "ai generated art", "piracy", "trolling",
+                 "impersonation", "gore", "slurs", "unmarked sensitive media", "brigading", "scams"]
+HINTS = ["", "", "", "Moderators will decide on a case by case basis.",
+         "Repeated violations will result in a suspension.", "See our about page for details."]
+
+WORDS = ["social", "toot", "masto", "fedi", "tech", "art", "queer", "furry", "photo", "music", "science",
+         "games", "linux", "city", "cafe", "space", "club", "garden", "hub", "town", "zone", "online",
+         "anime", "book", "cat", "dog", "climate", "news", "dev", "code", "open", "free", "world"]
+TLDS = ["social", "online", "org", "net", "com", "de", "fr", "uk", "io", "xyz", "club", "space"]
+
+MASTODON_LANGUAGES = [(["en"], 0.62), (["de"], 0.08), (["ja"], 0.06), (["fr"], 0.05), (["es"], 0.03),
+                      (["en", "de"], 0.03), (["en", "fr"], 0.02), (["nl"], 0.02), (["it"], 0.02),
+                      ([], 0.07)]
+REDDIT_LANGUAGES = [("en", 0.88), ("es", 0.03), ("de", 0.03), ("fr", 0.02), ("pt", 0.02), ("", 0.02)]
+
+SOURCE_URLS = [("https://github.com/mastodon/mastodon", 0.85),
+               ("https://github.com/glitch-soc/mastodon", 0.10),
+               ("https://github.com/hometown-fork/hometown", 0.05)]
+
+
+def _choice(rng, weighted_values, size):
+    values, weights = zip(*weighted_values)
+    weights = np.asarray(weights, dtype=float)
+    idx = rng.choice(len(values), size=size, p=weights / weights.sum())
+    return [values[i] for i in idx]
+
+
+def _sentences(rng, size, min_words, max_words):
+    """size random sentences of min_words to max_words - 1 words, drawn in one vectorized call."""
+    lengths = rng.integers(min_words, max_words, size=size)
+    words = np.asarray(WORDS, dtype=object)[rng.integers(len(WORDS), size=lengths.sum())]
+    return [" ".join(sentence).capitalize() for sentence in np.split(words, np.cumsum(lengths)[:-1])]
+
+
+def _rule_text(template, subject):
+    text = RULE_TEMPLATES[template].format(RULE_SUBJECTS[subject])
+    return text[0].upper() + text[1:]
+
+
+def _edit_rule(rng, text):
+    """Light edit of a rule, producing a near duplicate."""
+    edit = rng.integers(4)
+    if edit == 0:
+        return text.rstrip(".") + "."
+    if edit == 1:
+        return text.lower()
+    if edit == 2:
+        words = text.split(" ")
+        del words[rng.integers(len(words))]
+        return " ".join(words)
+    return text + " " + ["Thank you.", "Be nice.", "Thanks!"][rng.integers(3)]
+
+
+def _mastodon_rules(rng, n_rules, copy_mode):
+    if copy_mode == "verbatim":
+        pairs = DEFAULT_RULES[:n_rules] if n_rules else DEFAULT_RULES
+    elif copy_mode == "edited":
+        pairs = [(_edit_rule(rng, text), hint) for text, hint in (DEFAULT_RULES[:n_rules] or DEFAULT_RULES)]
+    else:
+        templates = rng.integers(len(RULE_TEMPLATES), size=n_rules)
+        subjects = rng.integers(len(RULE_SUBJECTS), size=n_rules)
+        hints = rng.integers(len(HINTS), size=n_rules)
+        pairs = [(_rule_text(t, s), HINTS[h]) for t, s, h in zip(templates, subjects, hints)]
+    first_id = int(rng.integers(1, 20))
+    return json.dumps([{"id": str(first_id + i), "text": text, "hint": hint} for i, (text, hint) in enumerate(pairs)],
+                      ensure_ascii=False)
+
+
+def _trends(rng, day):
+    n_trends = 5 if rng.random() < 0.8 else int(rng.integers(0, 5))
+    uses = rng.zipf(1.8, size=n_trends).clip(max=10_000)
+    accounts = np.minimum(uses, rng.zipf(2.0, size=n_trends))
+    return json.dumps([{"day": str(day), "uses": str(u), "accounts": str(a)} for u, a in zip(uses, accounts)])
+
+
+def generate_mastodon(n_instances: int, seed: int = 0, dup_rate: float = 0.35, edit_rate: float = 0.4,
+                      blacklist_rate: float = 0.43, mean_blocks: int = 300) -> pd.DataFrame:
+    """Generates a Mastodon instance table with the schema of mastodon_instance_info.csv.
+
+    Args:
+        n_instances (int): Number of servers.
+        seed (int): Seed of the random generator.
+        dup_rate (float): Share of servers whose rules are copies of the mastodon.social rules.
+        edit_rate (float): Among the copies, share of lightly edited (near duplicate) ones.
+        blacklist_rate (float): Share of servers publishing their domain blocks.
+        mean_blocks (int): Mean number of blocked domains of the publishing servers.
+    """
+    rng = np.random.default_rng(seed)
+    domains = [f"{WORDS[i % len(WORDS)]}{i}.{TLDS[i % len(TLDS)]}" for i in rng.permutation(n_instances)]
+    day = 1746144000
+
+    # Blocks go preferentially to a few notorious domains (Zipf popularity)
+    popularity = np.cumsum(1.0 / np.arange(1, n_instances + 1) ** 1.1)
+    popularity /= popularity[-1]
+    has_blacklist = rng.random(n_instances) < blacklist_rate
+    n_blocks = np.minimum(rng.geometric(1 / mean_blocks, size=n_instances), n_instances - 1)
+
+    copies = rng.random(n_instances) < dup_rate
+    edited = rng.random(n_instances) < edit_rate
+    n_rules = rng.poisson(7, size=n_instances)
+
+    rules, trends, blacklist = [], [], []
+    for i in range(n_instances):
+        copy_mode = ("edited" if edited[i] else "verbatim") if copies[i] else None
+        rules.append(_mastodon_rules(rng, int(n_rules[i]), copy_mode))
+        trends.append(_trends(rng, day) if rng.random() < 0.9 else "[]")
+        if has_blacklist[i]:
+            blocked = np.unique(np.searchsorted(popularity, rng.random(int(n_blocks[i]))))
+            blacklist.append(" | ".join(domains[j] for j in blocked if j != i))
+        else:
+            blacklist.append(None)
+
+    total_users = np.floor(rng.lognormal(5, 2.2, size=n_instances))
+    total_users[rng.random(n_instances) < 0.02] = np.nan
+    active_month = np.floor(np.nan_to_num(total_users) * rng.beta(1.2, 6, size=n_instances)).astype(np.int64)
+    total_posts = np.floor(np.nan_to_num(total_users) * rng.lognormal(4, 1.5, size=n_instances))
+
+    return pd.DataFrame({
+        "domain": domains,
+        "title": _sentences(rng, n_instances, 1, 4),
+        "source_url": _choice(rng, SOURCE_URLS, n_instances),
+        "description": _sentences(rng, n_instances, 3, 25),
+        "active_month": active_month,
+        "languages": [json.dumps(lang) for lang in _choice(rng, MASTODON_LANGUAGES, n_instances)],
+        "rules": rules,
+        "top_5_trends": trends,
+        "total_users": total_users,
+        "total_posts": total_posts,
+        "blacklist": blacklist,
+    }, columns=MASTODON_COLUMNS)
+
+
+def generate_reddit(n_instances: int, seed: int = 0) -> pd.DataFrame:
+    """Generates a subreddit table with the schema of reddit_subreddits_data_top100.csv."""
+    rng = np.random.default_rng(seed)
+    n_rules = rng.poisson(8, size=n_instances)
+    numbered = rng.random(n_instances) < 0.4
+    rules = []
+    for i in range(n_instances):
+        templates = rng.integers(len(RULE_TEMPLATES), size=n_rules[i])
+        subjects = rng.integers(len(RULE_SUBJECTS), size=n_rules[i])
+        texts = [_rule_text(t, s) for t, s in zip(templates, subjects)]
+        if numbered[i]:
+            texts = [f"Rule {k + 1} - {text}" for k, text in enumerate(texts)]
+        rules.append("; ".join(texts) if texts else None)
+    subscribers = np.floor(rng.lognormal(12, 2, size=n_instances)).astype(np.int64)
+    descriptions = _sentences(rng, n_instances, 0, 30)
+    return pd.DataFrame({
+        "name": [f"{WORDS[i % len(WORDS)].capitalize()}{i}" for i in rng.permutation(n_instances)],
+        "title": _sentences(rng, n_instances, 1, 5),
+        "description": [description if description else None for description in descriptions],
+        "language": _choice(rng, REDDIT_LANGUAGES, n_instances),
+        "subscribers": subscribers,
+        "active_user_count": np.floor(subscribers * rng.beta(1, 400, size=n_instances)).astype(np.int64),
+        "over18": rng.random(n_instances) < 0.05,
+        "quarantine": rng.random(n_instances) < 0.005,
+        "is_restricted": rng.random(n_instances) < 0.1,
+        "moderators_count": rng.geometric(0.08, size=n_instances),
+        "rules": rules,
+    }, columns=REDDIT_COLUMNS)
+
+
+def write_datasets(sizes: list, output_dir: str, seed: int = 0, chunk_size: int = 50_000) -> dict:
+    """Writes mastodon_<n>.csv and reddit_<n>.csv for each size, in chunks to bound memory.
+
+    Returns:
+        dict: {(platform, size): path}
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    for size in sizes:
+        for platform, generate in [("mastodon", generate_mastodon), ("reddit", generate_reddit)]:
+            path = os.path.join(output_dir, f"{platform}_{size}.csv")
+            print(f"Generating {size} synthetic {platform} instances in {path}… 🏭")
+            for start in range(0, size, chunk_size):
+                chunk = generate(min(chunk_size, size - start), seed=seed + start)
+                if platform == "mastodon" and size > chunk_size:
+                    # Chunks are generated independently: make the domains unique across chunks
+                    chunk["domain"] = chunk["domain"].str.replace(".", f"-{start}.", n=1, regex=False)
+                    chunk["blacklist"] = chunk["blacklist"].str.replace(r"(\w+?\d+)\.", rf"\1-{start}.", regex=True)
+                chunk.to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+            paths[(platform, size)] = path
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic Mastodon and Reddit datasets.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--output-dir", default="synthetic_data")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_datasets(args.sizes, args.output_dir, seed=args.seed)
@@ -0,0 +1,396 @@
+"""Incremental topic modeling of rules and server descriptions.
+
+BERTopic is fitted once, then new documents (e.g. the rules of newly crawled servers) are
+assigned to the nearest existing topic in embedding space, and the topic centroids and
+class-based TF-IDF (c-TF-IDF) term counts are updated online. The vocabulary grows online too:
+words first seen in new documents get new columns of the term counts, so they can enter the
+topic representations before any refit. The full BERTopic model (UMAP +
+HDBSCAN) is only refitted when the new documents drift away from the existing topics, and
+the topics of the refitted model are matched to the previous ones so that topic ids stay
+stable across refits. Documents can carry a weight, e.g. the number of near-duplicate rules a
+canonical rule stands for (see SocialMediaDataset.assign_topics()): the topic sizes, centroids,
+term counts and drift then count each document that many times.
+
+Usage:
+    topic_model = IncrementalTopicModel()
+    topics = topic_model.fit(documents)
+    topic_model.save("topic_model/")
+
+    topic_model = IncrementalTopicModel.load("topic_model/")
+    new_topics = topic_model.partial_fit(new_documents)  # refits by itself when drift > drift_threshold
+    topic_model.topic_info()
+"""
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from .profiling import profiled
+
+
+DEFAULT_EMBEDDING_MODEL = "paraphrase-MiniLM-L6-v2"  # better for shorter sentences
+DEFAULT_UMAP_PARAMS = {"n_neighbors": 5, "n_components": 2, "min_dist": 0.0}
+DEFAULT_HDBSCAN_PARAMS = {"min_cluster_size": 4, "min_samples": 1}
+DEFAULT_VECTORIZER_PARAMS = {"stop_words": "english", "lowercase": True}
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _one_hot(positions: np.ndarray, n_topics: int, weights: np.ndarray = None):
+    """(n_topics, n_docs) sparse indicator matrix (entries are the document weights when given),
+    documents with position -1 are left out."""
+    from scipy.sparse import csr_matrix
+    docs = np.flatnonzero(positions >= 0)
+    data = np.ones(len(docs)) if weights is None else np.asarray(weights, dtype=float)[docs]
+    return csr_matrix((data, (positions[docs], docs)), shape=(n_topics, len(positions)))
+
+
+def _weights(weights, n_docs: int) -> np.ndarray:
+    return np.ones(n_docs, dtype=np.int64) if weights is None else np.asarray(weights, dtype=np.int64)
+
+
+def class_tfidf(topic_term_counts):
+    """Class-based TF-IDF of the topics: L1-normalized term frequencies of each topic
+    weighted by log(1 + A / f_t), where A is the average number of words per topic and
+    f_t the frequency of the term across all topics (as in BERTopic).
+
+    Args:
+        topic_term_counts (scipy.sparse matrix): Term counts of each topic, (n_topics, n_terms).
+    """
+    from sklearn.preprocessing import normalize
+    counts = topic_term_counts.astype(float)
+    term_frequency = np.asarray(counts.sum(axis=0)).ravel()
+    average_words = counts.sum() / max(counts.shape[0], 1)
+    idf = np.log(1 + np.divide(average_words, term_frequency,
+                               out=np.zeros_like(term_frequency), where=term_frequency > 0))
+    return normalize(counts, norm="l1").multiply(idf).tocsr()
+
+
+class IncrementalTopicModel:
+    """BERTopic model with online assignment of new documents and stable topic ids.
+
+    Attributes:
+        documents (pd.DataFrame): Every document seen so far with its topic and weight
+            ("document", "Topic", "weight").
+        embeddings (np.ndarray): Normalized embedding of each document.
+        topic_ids (np.ndarray): Stable id of each topic (-1, the outliers, is not a topic).
+        topic_sizes (np.ndarray): Number of documents of each topic (weighted).
+        topic_term_counts (scipy.sparse.csr_matrix): Term counts of each topic, over self.terms.
+        terms (list): Vocabulary: the terms of the vectorizer fitted with the last BERTopic model,
+            followed by the terms first seen in the documents added since.
+        history (list): One record per fit, refit and update, with the drift at that time.
+    """
+
+    def __init__(self,
+                 embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+                 umap_params: dict = None,
+                 hdbscan_params: dict = None,
+                 vectorizer_params: dict = None,
+                 min_similarity: float = 0.5,
+                 drift_threshold: float = 0.2,
+                 min_new_docs: int = 50,
+                 top_n_words: int = 10,
+                 batch_size: int = 32,
+                 seed: int = 1) -> None:
+        self.embedding_model = embedding_model
+        self.umap_params = umap_params or DEFAULT_UMAP_PARAMS
+        self.hdbscan_params = hdbscan_params or DEFAULT_HDBSCAN_PARAMS
+        self.vectorizer_params = vectorizer_params or DEFAULT_VECTORIZER_PARAMS
+        self.min_similarity = min_similarity
+        self.drift_threshold = drift_threshold
+        self.min_new_docs = min_new_docs
+        self.top_n_words = top_n_words
+        self.batch_size = batch_size
+        self.seed = seed
+
+        self.documents = pd.DataFrame({"document": pd.Series(dtype=str), "Topic": pd.Series(dtype=int),
+                                       "weight": pd.Series(dtype=int)})
+        self.embeddings = None
+        self.topic_ids = np.zeros(0, dtype=np.int64)
+        self.topic_sizes = np.zeros(0, dtype=np.int64)
+        self.topic_term_counts = None
+        self.terms = []
+        self._term_ids = {}
+        self.vectorizer = None
+        self.bertopic_model = None
+        self.next_topic_id = 0
+        self.history = []
+
+        # Drift bookkeeping, reset at each (re)fit
+        self._centroid_sums = None
+        self.baseline_outlier_rate = 0.0
+        self.n_new_docs = 0
+        self.n_new_outliers = 0
+        self._encoder = None
+
+    ######################################################
+    ##################### Embeddings #####################
+    ######################################################
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            from sentence_transformers import SentenceTransformer
+            self._encoder = SentenceTransformer(self.embedding_model)
+        return self._encoder
+
+    def embed(self, documents: list) -> np.ndarray:
+        embeddings = self.encoder.encode(list(documents), batch_size=self.batch_size, show_progress_bar=False)
+        return _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+
+    @property
+    def centroids(self) -> np.ndarray:
+        return _normalize_rows(self._centroid_sums)
+
+    ######################################################
+    ################## Online vocabulary #################
+    ######################################################
+
+    def _reset_vocabulary(self) -> None:
+        self.terms = self.vectorizer.get_feature_names_out().tolist()
+        self._term_ids = {term: j for j, term in enumerate(self.terms)}
+
+    def _term_counts(self, documents: list):
+        """(n_docs, n_terms) term counts of the documents with the analyzer of the fitted vectorizer
+        (stop words, n-grams...). Terms not in the vocabulary yet are appended to it, and
+        topic_term_counts gets as many new (empty) columns."""
+        from scipy.sparse import csr_matrix
+        analyzer = self.vectorizer.build_analyzer()
+        indptr, indices = [0], []
+        for document in documents:
+            indices += [self._term_ids.setdefault(term, len(self._term_ids)) for term in analyzer(document)]
+            indptr.append(len(indices))
+        new_terms = list(self._term_ids)[len(self.terms):]
+        if new_terms:
+            self.terms += new_terms
+            self.topic_term_counts.resize((self.topic_term_counts.shape[0], len(self.terms)))
+        counts = csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(documents), len(self.terms)))
+        counts.sum_duplicates()
+        return counts
+
+    ######################################################
+    ################## Full (re)fitting ##################
+    ######################################################
+
+    def _fit_bertopic(self, documents: list, embeddings: np.ndarray) -> np.ndarray:
+        from bertopic import BERTopic
+        from hdbscan import HDBSCAN
+        from sklearn.feature_extraction.text import CountVectorizer
+        from umap import UMAP
+
+        self.bertopic_model = BERTopic(embedding_model=self.encoder,
+                                       umap_model=UMAP(**self.umap_params, random_state=self.seed),
+                                       hdbscan_model=HDBSCAN(**self.hdbscan_params),
+                                       vectorizer_model=CountVectorizer(**self.vectorizer_params))
+        topics, _ = self.bertopic_model.fit_transform(documents, embeddings=embeddings)
+        self.vectorizer = self.bertopic_model.vectorizer_model
+        return np.asarray(topics, dtype=np.int64)
+
+    def _match_topics(self, centroids: np.ndarray) -> np.ndarray:
+        """Stable ids of the clusters of a refitted model.
+
+        Clusters are matched one-to-one with the previous topics by maximal total cosine
+        similarity of their centroids (Hungarian algorithm). Clusters matching no previous
+        topic closely enough get new ids; ids of vanished topics are never reused.
+        """
+        from scipy.optimize import linear_sum_assignment
+        ids = np.full(len(centroids), -1, dtype=np.int64)
+        if len(self.topic_ids) and len(centroids):
+            similarity = centroids @ self.centroids.T
+            rows, cols = linear_sum_assignment(-similarity)
+            matched = similarity[rows, cols] >= self.min_similarity
+            ids[rows[matched]] = self.topic_ids[cols[matched]]
+        n_new = int((ids < 0).sum())
+        ids[ids < 0] = np.arange(self.next_topic_id, self.next_topic_id + n_new)
+        self.next_topic_id += n_new
+        return ids
+
+    def _set_topics(self, documents: list, embeddings: np.ndarray, clusters: np.ndarray,
+                    weights: np.ndarray) -> np.ndarray:
+        """Replaces the topics with the given clustering of all the documents, returns their stable ids."""
+        cluster_ids = np.unique(clusters[clusters >= 0])
+        positions = np.where(clusters >= 0, np.searchsorted(cluster_ids, clusters), -1)
+        indicator = _one_hot(positions, len(cluster_ids), weights)
+        centroid_sums = np.asarray(indicator @ embeddings)
+
+        self.topic_ids = self._match_topics(_normalize_rows(centroid_sums))
+        self._centroid_sums = centroid_sums
+        self.topic_sizes = np.asarray(indicator.sum(axis=1)).ravel().astype(np.int64)
+        self.topic_term_counts = (indicator @ self.vectorizer.transform(documents)).tocsr()
+        self._reset_vocabulary()
+        topics = np.where(positions >= 0, self.topic_ids[np.maximum(positions, 0)], -1)
+
+        self.documents = pd.DataFrame({"document": list(documents), "Topic": topics, "weight": weights})
+        self.embeddings = embeddings
+        outliers = self._nearest(embeddings)[1] < self.min_similarity
+        self.baseline_outlier_rate = float(weights[outliers].sum() / max(weights.sum(), 1))
+        self.n_new_docs = self.n_new_outliers = 0
+        return topics
+
+    @profiled("topic_model.fit")
+    def fit(self, documents: list, weights=None) -> np.ndarray:
+        """Fits BERTopic on the documents. Returns the topic of each document.
+
+        The weights count in the topic sizes, centroids and term counts, not in the clustering
+        itself (BERTopic clusters the distinct documents)."""
+        documents = list(documents)
+        weights = _weights(weights, len(documents))
+        embeddings = self.embed(documents)
+        topics = self._set_topics(documents, embeddings, self._fit_bertopic(documents, embeddings), weights)
+        self._log("fit", int(weights.sum()))
+        return topics
+
+    @profiled("topic_model.refit")
+    def refit(self) -> np.ndarray:
+        """Refits BERTopic on every document seen so far, keeping the ids of the topics that persist."""
+        documents = self.documents["document"].tolist()
+        weights = self.documents["weight"].to_numpy(dtype=np.int64)
+        topics = self._set_topics(documents, self.embeddings, self._fit_bertopic(documents, self.embeddings), weights)
+        self._log("refit", int(weights.sum()))
+        return topics
+
+    ######################################################
+    ################# Online assignment ##################
+    ######################################################
+
+    def _nearest(self, embeddings: np.ndarray) -> tuple:
+        """Position of the nearest topic centroid of each document, and its cosine similarity."""
+        if len(self.topic_ids) == 0:
+            return np.full(len(embeddings), -1), np.zeros(len(embeddings))
+        similarity = embeddings @ self.centroids.T
+        nearest = similarity.argmax(axis=1)
+        return nearest, similarity[np.arange(len(embeddings)), nearest]
+
+    def transform(self, documents: list, embeddings: np.ndarray = None) -> np.ndarray:
+        """Topic of each document (-1 if no topic is similar enough), without updating the model."""
+        if len(documents) == 0:
+            return np.zeros(0, dtype=np.int64)
+        embeddings = self.embed(documents) if embeddings is None else embeddings
+        nearest, similarity = self._nearest(embeddings)
+        return np.where(similarity >= self.min_similarity, self.topic_ids[np.maximum(nearest, 0)], -1)
+
+    @profiled("topic_model.partial_fit")
+    def partial_fit(self, documents: list, weights=None) -> np.ndarray:
+        """Assigns new documents to the existing topics and updates the centroids and c-TF-IDF counts.
+
+        The model is refitted on all documents when drift() exceeds drift_threshold after at
+        least min_new_docs new documents (weighted). Returns the topic of each new document.
+        """
+        documents = list(documents)
+        if not documents:
+            return np.zeros(0, dtype=np.int64)
+        if self.vectorizer is None:
+            return self.fit(documents, weights)
+        weights = _weights(weights, len(documents))
+        embeddings = self.embed(documents)
+        nearest, similarity = self._nearest(embeddings)
+        positions = np.where(similarity >= self.min_similarity, nearest, -1)
+        topics = np.where(positions >= 0, self.topic_ids[np.maximum(positions, 0)], -1)
+
+        indicator = _one_hot(positions, len(self.topic_ids), weights)
+        self._centroid_sums += np.asarray(indicator @ embeddings)
+        self.topic_sizes += np.asarray(indicator.sum(axis=1)).ravel().astype(np.int64)
+        term_counts = self._term_counts(documents)
+        self.topic_term_counts = (self.topic_term_counts + indicator @ term_counts).tocsr()
+
+        new_documents = pd.DataFrame({"document": documents, "Topic": topics, "weight": weights})
+        self.documents = pd.concat([self.documents, new_documents], ignore_index=True)
+        self.embeddings = np.vstack([self.embeddings, embeddings])
+        self.n_new_docs += int(weights.sum())
+        self.n_new_outliers += int(weights[topics < 0].sum())
+        self._log("update", int(weights.sum()))
+
+        if self.n_new_docs >= self.min_new_docs and self.drift() > self.drift_threshold:
+            topics = self.refit()[-len(documents):]
+        return topics
+
+    def drift(self) -> float:
+        """Share of the documents added since the last fit that fit no topic, in excess of the
+        share of the fitted documents that would not have fit any topic either."""
+        if self.n_new_docs == 0:
+            return 0.0
+        return self.n_new_outliers / self.n_new_docs - self.baseline_outlier_rate
+
+    def _log(self, event: str, n_docs: int) -> None:
+        self.history.append({"event": event, "n_docs": n_docs, "n_total_docs": int(self.documents["weight"].sum()),
+                             "n_topics": len(self.topic_ids), "drift": self.drift()})
+
+    ######################################################
+    ################### Representation ###################
+    ######################################################
+
+    def c_tf_idf(self):
+        """Class-based TF-IDF of the topics, see class_tfidf()."""
+        return class_tfidf(self.topic_term_counts)
+
+    def topic_words(self, top_n: int = None) -> dict:
+        """Top words of each topic, by c-TF-IDF."""
+        top_n = top_n or self.top_n_words
+        scores = self.c_tf_idf().toarray()
+        vocabulary = self.terms
+        top = np.argsort(-scores, axis=1)[:, :top_n]
+        return {int(topic_id): [vocabulary[j] for j in top[i] if scores[i, j] > 0]
+                for i, topic_id in enumerate(self.topic_ids)}
+
+    def representative_docs(self, n_docs: int = 3) -> dict:
+        """The n_docs documents of each topic closest to its centroid."""
+        topics = self.documents["Topic"].to_numpy()
+        assigned = np.flatnonzero(topics >= 0)
+        positions = pd.Index(self.topic_ids).get_indexer(topics[assigned])
+        similarity = np.einsum("ij,ij->i", self.embeddings[assigned], self.centroids[positions])
+        ranked = pd.DataFrame({"Topic": topics[assigned], "similarity": similarity,
+                               "document": self.documents["document"].to_numpy()[assigned]})
+        ranked = ranked.sort_values(["Topic", "similarity"], ascending=[True, False]).groupby("Topic").head(n_docs)
+        return ranked.groupby("Topic")["document"].agg(list).to_dict()
+
+    def topic_info(self) -> pd.DataFrame:
+        """Same columns as BERTopic.get_topic_info(): Topic, Count, Name, Representation, Representative_Docs."""
+        words = self.topic_words()
+        docs = self.representative_docs()
+        info = pd.DataFrame({"Topic": self.topic_ids, "Count": self.topic_sizes})
+        info["Representation"] = info["Topic"].map(words)
+        info["Name"] = info["Topic"].astype(str) + "_" + info["Representation"].str[:4].str.join("_")
+        info["Representative_Docs"] = info["Topic"].map(lambda topic: docs.get(topic, []))
+        outliers = pd.DataFrame({"Topic": [-1], "Count": [int(self.documents.loc[self.documents["Topic"] < 0, "weight"].sum())],
+                                 "Name": ["-1_outliers"], "Representation": [[]], "Representative_Docs": [[]]})
+        info = pd.concat([outliers, info], ignore_index=True)
+        columns = ["Topic", "Count", "Name", "Representation", "Representative_Docs"]
+        return info[columns].sort_values("Topic", ignore_index=True)
+
+    ######################################################
+    #################### Persistence #####################
+    ######################################################
+
+    def save(self, path: str) -> None:
+        """Writes the model to a directory: the BERTopic model, the embeddings (.npy, memory-mappable)
+        and the rest of the state (pickle)."""
+        os.makedirs(path, exist_ok=True)
+        if self.bertopic_model is not None:
+            self.bertopic_model.save(os.path.join(path, "bertopic"), serialization="safetensors",
+                                     save_ctfidf=True, save_embedding_model=self.embedding_model)
+        np.save(os.path.join(path, "embeddings.npy"), self.embeddings)
+        state = {key: value for key, value in self.__dict__.items()
+                 if key not in ("_encoder", "bertopic_model", "embeddings")}
+        tmp_path = os.path.join(path, "state.pkl.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, os.path.join(path, "state.pkl"))
+
+    @classmethod
+    def load(cls, path: str, load_bertopic: bool = False) -> "IncrementalTopicModel":
+        """Loads a model written by save(). The BERTopic model is only needed for its own API
+        (visualizations, ...), online updates and refits work without it."""
+        model = cls.__new__(cls)
+        with open(os.path.join(path, "state.pkl"), "rb") as f:
+            model.__dict__.update(pickle.load(f))
+        model._encoder = None
+        model.embeddings = np.load(os.path.join(path, "embeddings.npy"))
+        model.bertopic_model = None
+        if load_bertopic and os.path.isdir(os.path.join(path, "bertopic")):
+            from bertopic import BERTopic
+            model.bertopic_model = BERTopic.load(os.path.join(path, "bertopic"))
+        return model
@@ -0,0 +1,250 @@
+"""Hyperparameter sweep of the BERTopic model (UMAP, HDBSCAN and vectorizer settings).
+
+The documents are embedded once. Each UMAP setting reduces the embeddings once, and the
+reduction is saved as a .npy file that the HDBSCAN settings reuse (memory-mapped, so worker
+processes do not copy it). Every (UMAP, HDBSCAN, vectorizer) configuration is then clustered
+and scored in parallel worker processes:
+    - coherence   mean NPMI of the pairs of top words of each topic, over document co-occurrences
+    - diversity   share of distinct words among the top words of all topics
+    - outlier_rate, n_topics
+    - score       (coherence + 1) / 2 * diversity * (1 - outlier_rate), used for the ranking;
+                  NaN (ranked last) with fewer than 2 topics, whose diversity is 1 by definition
+The clusters and c-TF-IDF topic words are those BERTopic computes from the same reduction.
+
+Usage (from the analysis/ directory):
+    python -m utils.topic_sweep --platform mastodon --documents rules --workers 4 --output sweep.csv
+    python -m utils.topic_sweep --platform reddit --documents descriptions --grid grid.json --cache-dir .cache/sweep
+
+    results = sweep(documents, grid, workers=4)
+    topic_model = IncrementalTopicModel(**best_params(results))
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .pipeline import hash_items
+from .topic_model import DEFAULT_EMBEDDING_MODEL, _one_hot, class_tfidf
+
+
+# Lists of values for each parameter, see sklearn.model_selection.ParameterGrid
+DEFAULT_GRID = {"umap": {"n_neighbors": [5, 15, 30], "n_components": [2, 5], "min_dist": [0.0]},
+                "hdbscan": {"min_cluster_size": [4, 10, 25], "min_samples": [1, 5]},
+                "vectorizer": {"stop_words": ["english"], "lowercase": [True], "ngram_range": [[1, 1], [1, 2]]}}
+PARTS = ["umap", "hdbscan", "vectorizer"]
+
+
+def expand_grid(grid: dict) -> dict:
+    """Every combination of the values of each part of the grid, {part: [params, ...]}."""
+    from sklearn.model_selection import ParameterGrid
+    expanded = {part: list(ParameterGrid(grid.get(part) or {})) for part in PARTS}
+    # JSON has no tuples
+    for params in expanded["vectorizer"]:
+        if isinstance(params.get("ngram_range"), list):
+            params["ngram_range"] = tuple(params["ngram_range"])
+    return expanded
+
+
+######################################################
+####################### Scoring ######################
+######################################################
+
+def topic_words(labels: np.ndarray, doc_term, top_n: int = 10) -> list:
+    """Top terms (column ids of doc_term) of each cluster by c-TF-IDF, outliers (-1) excluded."""
+    clusters = np.unique(labels[labels >= 0])
+    positions = np.searchsorted(clusters, labels)
+    positions[labels < 0] = -1
+    scores = class_tfidf(_one_hot(positions, len(clusters)) @ doc_term).toarray()
+    top = np.argsort(-scores, axis=1)[:, :top_n]
+    return [top[i][scores[i, top[i]] > 0] for i in range(len(clusters))]
+
+
+def npmi_coherence(words: list, doc_term) -> float:
+    """Mean over topics of the mean normalized PMI of their pairs of top words, with the
+    probabilities estimated from document co-occurrences (NPMI of words that never co-occur is -1)."""
+    union = np.unique(np.concatenate(words)) if words else np.zeros(0, dtype=np.int64)
+    if len(union) == 0:
+        return np.nan
+    present = (doc_term[:, union] > 0).astype(np.float64)
+    n_docs = doc_term.shape[0]
+    co = (present.T @ present).toarray() / n_docs
+    p = np.diag(co)
+    topic_scores = []
+    for topic in words:
+        if len(topic) < 2:
+            continue
+        i = np.searchsorted(union, topic)
+        pairs = np.triu_indices(len(i), k=1)
+        p_ij, p_i, p_j = co[i[pairs[0]], i[pairs[1]]], p[i[pairs[0]]], p[i[pairs[1]]]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            npmi = np.where(p_ij > 0, np.log(p_ij / (p_i * p_j)) / -np.log(p_ij), -1.0)
+        npmi[p_ij >= 1] = 1.0
+        topic_scores.append(npmi.mean())
+    return float(np.mean(topic_scores)) if topic_scores else np.nan
+
+
+def topic_diversity(words: list) -> float:
+    total = sum(len(topic) for topic in words)
+    return len(np.unique(np.concatenate(words))) / total if total else np.nan
+
+
+######################################################
+####################### Workers ######################
+######################################################
+
+def _reduce(task: dict) -> str:
+    from umap import UMAP
+    if not os.path.exists(task["path"]):
+        embeddings = np.load(task["embeddings_path"], mmap_mode="r")
+        reduced = UMAP(**task["umap_params"], random_state=task["seed"]).fit_transform(np.asarray(embeddings))
+        tmp_path = f"{task['path']}.tmp.npy"
+        np.save(tmp_path, np.asarray(reduced, dtype=np.float32))
+        os.replace(tmp_path, task["path"])
+    return task["path"]
+
+
+def _evaluate(task: dict) -> dict:
+    from hdbscan import HDBSCAN
+    from scipy.sparse import load_npz
+    start = time.perf_counter()
+    result = {"umap_id": task["umap_id"], "hdbscan_id": task["hdbscan_id"], "vectorizer_id": task["vectorizer_id"]}
+    try:
+        reduced = np.load(task["reduction_path"], mmap_mode="r")
+        labels = np.asarray(HDBSCAN(**task["hdbscan_params"]).fit(np.asarray(reduced)).labels_, dtype=np.int64)
+        doc_term = load_npz(task["doc_term_path"]).tocsr()
+        words = topic_words(labels, doc_term, task["top_n_words"])
+        result.update(n_topics=len(words),
+                      outlier_rate=float((labels < 0).mean()),
+                      coherence=npmi_coherence(words, doc_term),
+                      diversity=topic_diversity(words),
+                      error=None)
+    except Exception as e:  # e.g. min_samples larger than the corpus
+        result.update(n_topics=0, outlier_rate=np.nan, coherence=np.nan, diversity=np.nan, error=repr(e))
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+######################################################
+######################## Sweep #######################
+######################################################
+
+def sweep(documents: list, grid: dict = None, embedding_model: str = DEFAULT_EMBEDDING_MODEL,
+          embeddings: np.ndarray = None, workers: int = 1, cache_dir: str = None, top_n_words: int = 10,
+          batch_size: int = 32, seed: int = 1) -> pd.DataFrame:
+    """Scores every configuration of the grid and ranks them (see the module docstring).
+
+    Args:
+        grid (dict): {"umap": {param: [values]}, "hdbscan": {...}, "vectorizer": {...}}, DEFAULT_GRID by default.
+        embeddings (np.ndarray): Precomputed embeddings of the documents, computed with embedding_model otherwise.
+        cache_dir (str): Where the embeddings and the UMAP reductions are kept across sweeps (temporary if None).
+
+    Returns:
+        pd.DataFrame: One row per configuration, best first, with the umap_params, hdbscan_params
+            and vectorizer_params dicts, one column per parameter and the scores.
+    """
+    from scipy.sparse import save_npz
+    from sklearn.feature_extraction.text import CountVectorizer
+    documents = [str(doc) for doc in documents]
+    configs = expand_grid(DEFAULT_GRID if grid is None else grid)
+    work_dir = cache_dir or tempfile.mkdtemp(prefix="topic_sweep_")
+    os.makedirs(work_dir, exist_ok=True)
+    corpus_key = hash_items(embedding_model, hash_items(*documents))
+    try:
+        embeddings_path = os.path.join(work_dir, f"embeddings-{corpus_key}.npy")
+        if embeddings is not None:
+            np.save(embeddings_path, np.asarray(embeddings, dtype=np.float32))
+        elif not os.path.exists(embeddings_path):
+            from .topic_model import IncrementalTopicModel
+            print(f"Embedding {len(documents)} documents with {embedding_model}...")
+            np.save(embeddings_path, IncrementalTopicModel(embedding_model, batch_size=batch_size).embed(documents))
+
+        doc_term_paths = []
+        for i, params in enumerate(configs["vectorizer"]):
+            doc_term_paths.append(os.path.join(work_dir, f"doc_term-{corpus_key}-{i}.npz"))
+            save_npz(doc_term_paths[-1], CountVectorizer(**params).fit_transform(documents).tocsr())
+
+        reductions = [{"embeddings_path": embeddings_path, "umap_params": params, "seed": seed,
+                       "path": os.path.join(work_dir, f"umap-{hash_items(corpus_key, sorted(params.items()), seed)}.npy")}
+                      for params in configs["umap"]]
+        tasks = [{"umap_id": u, "hdbscan_id": h, "vectorizer_id": v, "reduction_path": reductions[u]["path"],
+                  "hdbscan_params": hdbscan_params, "doc_term_path": doc_term_paths[v], "top_n_words": top_n_words}
+                 for u in range(len(reductions))
+                 for h, hdbscan_params in enumerate(configs["hdbscan"])
+                 for v in range(len(doc_term_paths))]
+        n_cached = sum(os.path.exists(reduction["path"]) for reduction in reductions)
+        print(f"Sweeping {len(tasks)} configurations ({len(reductions)} UMAP reductions, {n_cached} cached) "
+              f"with {workers} workers 🧪")
+        start = time.perf_counter()
+        if workers > 1:
+            with ProcessPoolExecutor(workers) as executor:
+                list(executor.map(_reduce, reductions))
+                results = list(executor.map(_evaluate, tasks))
+        else:
+            for reduction in reductions:
+                _reduce(reduction)
+            results = [_evaluate(task) for task in tasks]
+        print(f"Swept {len(tasks)} configurations in {time.perf_counter() - start:.1f}s ✨")
+    finally:
+        if cache_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    results = pd.DataFrame(results)
+    for part in PARTS:
+        params = pd.Series(configs[part])[results[f"{part}_id"]].reset_index(drop=True)
+        results[f"{part}_params"] = params
+        flat = pd.DataFrame(params.tolist()).add_prefix(f"{part}_")
+        results = pd.concat([results, flat], axis=1)
+    results["score"] = (results["coherence"] + 1) / 2 * results["diversity"] * (1 - results["outlier_rate"])
+    # A single topic has a perfect diversity, it would outrank every real topic model
+    results.loc[results["n_topics"] < 2, "score"] = np.nan
+    results = results.drop(columns=[f"{part}_id" for part in PARTS])
+    results = results.sort_values("score", ascending=False, na_position="last", ignore_index=True)
+    results.insert(0, "rank", np.arange(1, len(results) + 1))
+    return results
+
+
+def best_params(results: pd.DataFrame, rank: int = 1) -> dict:
+    """Parameters of a configuration of sweep(), as keyword arguments of IncrementalTopicModel."""
+    row = results[results["rank"] == rank].iloc[0]
+    if pd.isna(row["score"]):
+        raise ValueError(f"The configuration of rank {rank} is not scored (fewer than 2 topics or failed).")
+    return {f"{part}_params": dict(row[f"{part}_params"]) for part in PARTS}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep the UMAP/HDBSCAN/vectorizer settings of the topic model.")
+    parser.add_argument("--platform", choices=["mastodon", "reddit"], default="mastodon")
+    parser.add_argument("--documents", choices=["rules", "descriptions"], default="rules")
+    parser.add_argument("--data-path", default=None, help="Raw dataset (default: the one of utils.refresh).")
+    parser.add_argument("--grid", default=None, help="JSON file of the grid (default: DEFAULT_GRID).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--cache-dir", default=None, help="Keeps the embeddings and UMAP reductions for later sweeps.")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--top", type=int, default=10, help="Number of configurations printed.")
+    parser.add_argument("--output", default=None, help="CSV file of the ranked results.")
+    args = parser.parse_args()
+
+    from .refresh import description_documents, load_dataset
+    dataset = load_dataset(args.platform, args.data_path, batch_size=args.batch_size)
+    dataset.run_pipeline()
+    if args.documents == "rules":
+        documents = dataset.rule_documents().tolist()
+    else:
+        documents = description_documents(dataset, detect_language=args.platform == "mastodon")["description"].tolist()
+    grid = None
+    if args.grid:
+        with open(args.grid) as f:
+            grid = json.load(f)
+
+    results = sweep(documents, grid, workers=args.workers, cache_dir=args.cache_dir, batch_size=args.batch_size)
+    columns = [c for c in results.columns if not c.endswith("_params") and c != "error"]
+    print(results[columns].head(args.top).round(3).to_string(index=False))
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f"Wrote {len(results)} configurations to {args.output} 💾")
@@ -0,0 +1,186 @@
+"""Trending tags of the Mastodon servers (column top_5_trends).
+
+The collector (dataset/Mastodon/test.py) stores, for each server, the first history entry of its
+top 5 trending tags as a JSON list of {"day", "uses", "accounts"} strings. They are expanded here
+into a long typed table (one row per server and trend rank), aggregated per server, and
+successive crawls are appended to a time-series store (one Parquet file per crawl).
+
+Usage (from the analysis/ directory):
+    python -m utils.trends --append ../dataset/Mastodon/mastodon_instance_info.csv --store trends_store/
+    python -m utils.trends --store trends_store/ --summary
+"""
+import argparse
+import ast
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from .aggregation import ServerSegments
+
+
+TREND_FIELDS = ["day", "uses", "accounts"]
+
+
+def parse_trend_list(value) -> list:
+    """Trends of one server as a list of dicts, [] for missing or malformed values."""
+    if isinstance(value, list):
+        parsed = value
+    elif isinstance(value, str):
+        try:
+            parsed = json.loads(value)
+        except ValueError:
+            try:
+                parsed = ast.literal_eval(value)
+            except Exception:
+                return []
+    else:
+        return []
+    if not isinstance(parsed, list):
+        return []
+    return [item for item in parsed if isinstance(item, dict)]
+
+
+def trends_table(trends: pd.Series, server_id=None) -> pd.DataFrame:
+    """Long table of the trends: one row per server and rank (1 = top trend).
+
+    Args:
+        trends (pd.Series): top_5_trends column, raw JSON strings or lists of dicts.
+        server_id: Id of the server of each row of `trends` (default: the index).
+
+    Returns:
+        pd.DataFrame: server_id, rank (uint8), day (datetime64[s], UTC), uses and accounts
+            (nullable Int64, missing when the server did not report them).
+    """
+    parsed = [parse_trend_list(value) for value in trends]
+    lengths = np.fromiter((len(items) for items in parsed), dtype=np.int64, count=len(parsed))
+    server_id = trends.index.to_numpy() if server_id is None else np.asarray(server_id)
+    starts = np.cumsum(lengths) - lengths
+    flat = [item for items in parsed for item in items]
+    table = {"server_id": np.repeat(server_id, lengths),
+             "rank": (np.arange(len(flat)) - np.repeat(starts, lengths) + 1).astype(np.uint8)}
+    for field in TREND_FIELDS:
+        table[field] = pd.to_numeric(pd.Series([item.get(field) for item in flat], dtype=object),
+                                     errors="coerce").astype("Int64")
+    table = pd.DataFrame(table)
+    table["day"] = pd.to_datetime(table["day"].astype("float64"), unit="s").astype("datetime64[s]")
+    return table
+
+
+def trend_aggregates(trends: pd.DataFrame, reference=None) -> pd.DataFrame:
+    """Per-server statistics of a trends table, in one vectorized pass.
+
+    Args:
+        reference: Date from which the recency is measured (default: the last day of the table).
+
+    Returns:
+        pd.DataFrame: One row per server_id with n_trends, total_uses, total_accounts, max_uses,
+            uses_per_account, last_day and recency_days (days between last_day and reference).
+    """
+    segments = ServerSegments(trends["server_id"])
+    uses = trends["uses"].fillna(0).to_numpy(dtype=float)
+    accounts = trends["accounts"].fillna(0).to_numpy(dtype=float)
+    days = trends["day"].to_numpy(dtype="datetime64[s]").astype(np.int64).astype(float)
+    days[trends["day"].isna().to_numpy()] = -np.inf
+    last_day = segments.max(days)
+    reference = (trends["day"].max() if reference is None else pd.Timestamp(reference))
+    aggregates = pd.DataFrame({"server_id": segments.server_ids,
+                               "n_trends": segments.counts,
+                               "total_uses": segments.sum(uses).astype(np.int64),
+                               "total_accounts": segments.sum(accounts).astype(np.int64),
+                               "max_uses": segments.max(uses).astype(np.int64)})
+    aggregates["uses_per_account"] = aggregates["total_uses"] / aggregates["total_accounts"].replace(0, np.nan)
+    aggregates["last_day"] = pd.to_datetime(np.where(np.isfinite(last_day), last_day, np.nan), unit="s")
+    aggregates["recency_days"] = (pd.Timestamp(reference) - aggregates["last_day"]).dt.total_seconds() / 86400
+    return aggregates
+
+
+######################################################
+################# Time-series store ##################
+######################################################
+
+class TrendStore:
+    """Append-only store of crawl snapshots of the trends, one Parquet file per crawl.
+
+    Rows are keyed by domain (server_ids are only row numbers of one crawl) and the crawl time.
+    Domains are dictionary encoded and the files zstd compressed. A snapshot is written to a
+    temporary file and renamed, and an existing snapshot is never overwritten.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, crawled_at: pd.Timestamp) -> str:
+        return os.path.join(self.path, f"snapshot-{crawled_at.strftime('%Y%m%dT%H%M%S')}.parquet")
+
+    def snapshots(self) -> list:
+        """Crawl times of the stored snapshots, in increasing order."""
+        names = sorted(name for name in os.listdir(self.path) if re.fullmatch(r"snapshot-\d{8}T\d{6}\.parquet", name))
+        return [pd.Timestamp(name[len("snapshot-"):-len(".parquet")]) for name in names]
+
+    def append(self, trends: pd.DataFrame, domains: pd.Series, crawled_at=None) -> str:
+        """Adds one crawl. `trends` is a trends_table(), `domains` maps its server_id to domains.
+
+        Returns:
+            str: Path of the snapshot file.
+        """
+        crawled_at = pd.Timestamp.now(tz="UTC").tz_localize(None) if crawled_at is None else pd.Timestamp(crawled_at)
+        crawled_at = crawled_at.floor("s")
+        path = self._file(crawled_at)
+        if os.path.exists(path):
+            raise FileExistsError(f"A snapshot of {crawled_at} already exists in {self.path}.")
+        snapshot = trends.copy()
+        snapshot.insert(0, "domain", pd.Series(domains).reindex(snapshot["server_id"]).astype("category").to_numpy())
+        snapshot.insert(0, "crawled_at", np.full(len(snapshot), crawled_at.to_datetime64()).astype("datetime64[s]"))
+        snapshot = snapshot.drop(columns="server_id")
+        tmp_path = f"{path}.tmp"
+        snapshot.to_parquet(tmp_path, index=False, compression="zstd")
+        os.replace(tmp_path, path)
+        return path
+
+    def load(self, domains: list = None, start=None, end=None) -> pd.DataFrame:
+        """Rows of the snapshots crawled between start and end (included), optionally for some domains only."""
+        files = [self._file(crawled_at) for crawled_at in self.snapshots()
+                 if (start is None or crawled_at >= pd.Timestamp(start)) and (end is None or crawled_at <= pd.Timestamp(end))]
+        if not files:
+            return pd.DataFrame(columns=["crawled_at", "domain", "rank"] + TREND_FIELDS)
+        filters = [("domain", "in", list(domains))] if domains is not None else None
+        frames = [pd.read_parquet(path, filters=filters) for path in files]
+        history = pd.concat(frames, ignore_index=True)
+        history["domain"] = history["domain"].astype(str).astype("category")
+        return history
+
+    def series(self, metric: str = "total_uses", domains: list = None) -> pd.DataFrame:
+        """One trend_aggregates() metric per crawl (rows) and domain (columns)."""
+        history = self.load(domains)
+        domain_codes, domain_names = pd.factorize(history["domain"].astype(str), sort=True)
+        history = history.assign(server_id=domain_codes)
+        rows = []
+        for crawled_at, snapshot in history.groupby("crawled_at", sort=True):
+            aggregates = trend_aggregates(snapshot, reference=crawled_at)
+            rows.append(pd.Series(aggregates[metric].to_numpy(), index=domain_names[aggregates["server_id"]], name=crawled_at))
+        return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expand the Mastodon trends and store crawl snapshots.")
+    parser.add_argument("--store", required=True, help="Directory of the time-series store.")
+    parser.add_argument("--append", default=None, metavar="CSV", help="mastodon_instance_info.csv of a crawl to append.")
+    parser.add_argument("--crawled-at", default=None, help="Crawl time of the appended file (default: its modification time).")
+    parser.add_argument("--summary", action="store_true", help="Print the snapshots and the total uses per crawl.")
+    args = parser.parse_args()
+
+    store = TrendStore(args.store)
+    if args.append:
+        crawl = pd.read_csv(args.append, usecols=["domain", "top_5_trends"])
+        crawled_at = args.crawled_at or pd.Timestamp(os.path.getmtime(args.append), unit="s")
+        table = trends_table(crawl["top_5_trends"])
+        path = store.append(table, crawl["domain"], crawled_at)
+        print(f"Appended {len(table)} trends of {crawl['domain'].nunique()} servers to {path} 💾")
+    if args.summary:
+        series = store.series("total_uses")
+        print(f"{len(series)} snapshots, {series.shape[1]} servers 📈")
+        print(pd.DataFrame({"servers": series.notna().sum(axis=1), "total_uses": series.sum(axis=1).astype(np.int64)}).to_string())
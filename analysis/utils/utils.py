@@ -1,6 +1,4 @@
 import pandas as pd
-from langdetect import detect
-from nltk.stem import WordNetLemmatizer
 
 
 def compare_languages(df_mastodon, df_reddit):
@@ -28,7 +26,9 @@ def compare_languages(df_mastodon, df_reddit):
 
 def lemmatize(x): 
     if isinstance(x, list):
-        return [WordNetLemmatizer().lemmatize(word) for word in x]  
+        from nltk.stem import WordNetLemmatizer  # nltk is slow to import, only load it when needed
+        lemmatizer = WordNetLemmatizer()
+        return [lemmatizer.lemmatize(word) for word in x]  
     else:
         return x
     
@@ -0,0 +1,271 @@
+"""Structured telemetry of the crawlers (standard library only).
+
+Records, for every request: latency (histograms per endpoint and per host), bytes received,
+status codes and exceptions, along with the number of requests in flight and the progress of
+the crawl (hosts done, ETA). Snapshots are written periodically as JSON and in the Prometheus
+text exposition format (atomically, so they can be scraped or tailed during the crawl), and a
+summary is printed at the end of the run.
+
+Example:
+    telemetry = CrawlTelemetry(json_path="crawl_telemetry.json", prometheus_path="crawl_telemetry.prom")
+    telemetry.add_hosts(len(domains))
+    response = telemetry.call(domain, "/api/v2/instance", requests.get, url, timeout=10)
+    telemetry.host_done(domain, ok=True)
+    telemetry.write()
+    telemetry.print_summary()
+"""
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Prometheus' default latency buckets (seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram, as a Prometheus histogram (counts are per bucket, not cumulative)."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate by linear interpolation within the bucket holding the q-th observation."""
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+                return lower + (max(upper, lower) - lower) * (rank - seen) / n
+            seen += n
+        return self.max
+
+    def to_dict(self):
+        return {"buckets": list(self.buckets), "counts": self.counts, "count": self.count,
+                "sum": self.sum, "max": self.max,
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)}
+
+
+class CrawlTelemetry:
+    """Thread-safe metrics of a crawl.
+
+    Attributes:
+        endpoints (dict): Latency histogram of each endpoint.
+        hosts (dict): Latency histogram of each host.
+        statuses (dict): {(endpoint, status code): count}.
+        exceptions (dict): {(endpoint, exception class name): count}.
+        bytes (dict): Bytes received from each endpoint.
+    """
+
+    def __init__(self, json_path=None, prometheus_path=None, snapshot_interval=10.0, progress=True,
+                 buckets=DEFAULT_BUCKETS):
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.snapshot_interval = snapshot_interval
+        self.progress = progress
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.endpoints = {}
+        self.hosts = {}
+        self.statuses = {}
+        self.exceptions = {}
+        self.bytes = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_hosts = 0
+        self.hosts_done = 0
+        self.hosts_failed = 0
+        self.started = time.time()
+        self._last_snapshot = time.monotonic()
+
+    ######################################################
+    ##################### Recording ######################
+    ######################################################
+
+    def add_hosts(self, n):
+        """Adds n hosts to the expected total of the crawl (used for the ETA)."""
+        with self._lock:
+            self.total_hosts += n
+
+    @contextmanager
+    def request(self, host, endpoint):
+        """Times the enclosed request. The yielded dict takes the "status" and "bytes" of the response;
+        an exception raised in the block is counted and re-raised."""
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        record = {}
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            with self._lock:
+                key = (endpoint, type(e).__name__)
+                self.exceptions[key] = self.exceptions.get(key, 0) + 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.in_flight -= 1
+                self._histogram(self.endpoints, endpoint).observe(elapsed)
+                self._histogram(self.hosts, host).observe(elapsed)
+                if "status" in record:
+                    key = (endpoint, record["status"])
+                    self.statuses[key] = self.statuses.get(key, 0) + 1
+                self.bytes[endpoint] = self.bytes.get(endpoint, 0) + record.get("bytes", 0)
+        self.maybe_write()
+
+    def call(self, host, endpoint, func, *args, **kwargs):
+        """func(*args, **kwargs) (e.g. requests.get) timed as a request to an endpoint of a host."""
+        with self.request(host, endpoint) as record:
+            response = func(*args, **kwargs)
+            record["status"] = response.status_code
+            record["bytes"] = len(response.content)
+        return response
+
+    def _histogram(self, histograms, key):
+        if key not in histograms:
+            histograms[key] = Histogram(self.buckets)
+        return histograms[key]
+
+    def host_done(self, host, ok=True):
+        with self._lock:
+            self.hosts_done += 1
+            self.hosts_failed += not ok
+        self.maybe_write()
+
+    def eta(self):
+        """Estimated seconds until all hosts are done, at the average pace so far (None if unknown)."""
+        if self.hosts_done == 0 or self.total_hosts == 0:
+            return None
+        return (time.time() - self.started) / self.hosts_done * max(self.total_hosts - self.hosts_done, 0)
+
+    ######################################################
+    ###################### Export ########################
+    ######################################################
+
+    def snapshot(self):
+        with self._lock:
+            eta = self.eta()
+            return {"time": time.time(),
+                    "elapsed_s": time.time() - self.started,
+                    "hosts": {"total": self.total_hosts, "done": self.hosts_done, "failed": self.hosts_failed,
+                              "eta_s": eta},
+                    "in_flight": self.in_flight,
+                    "max_in_flight": self.max_in_flight,
+                    "endpoints": {endpoint: {**histogram.to_dict(), "bytes": self.bytes.get(endpoint, 0),
+                                             "statuses": {str(status): n for (e, status), n in self.statuses.items() if e == endpoint},
+                                             "exceptions": {name: n for (e, name), n in self.exceptions.items() if e == endpoint}}
+                                  for endpoint, histogram in self.endpoints.items()},
+                    "hosts_latency": {host: histogram.to_dict() for host, histogram in self.hosts.items()}}
+
+    def to_prometheus(self):
+        """Snapshot in the Prometheus text exposition format."""
+        def escape(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        def histogram_lines(name, label, histograms):
+            lines = [f"# TYPE {name} histogram"]
+            for key, histogram in sorted(histograms.items()):
+                cumulative = 0
+                for bound, n in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                    cumulative += n
+                    lines.append(f'{name}_bucket{{{label}="{escape(key)}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}="{escape(key)}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{{label}="{escape(key)}"}} {histogram.count}')
+            return lines
+
+        with self._lock:
+            eta = self.eta()
+            lines = histogram_lines("crawler_request_duration_seconds", "endpoint", self.endpoints)
+            lines += histogram_lines("crawler_host_request_duration_seconds", "host", self.hosts)
+            lines.append("# TYPE crawler_responses_total counter")
+            lines += [f'crawler_responses_total{{endpoint="{escape(e)}",code="{status}"}} {n}'
+                      for (e, status), n in sorted(self.statuses.items())]
+            lines.append("# TYPE crawler_exceptions_total counter")
+            lines += [f'crawler_exceptions_total{{endpoint="{escape(e)}",exception="{escape(name)}"}} {n}'
+                      for (e, name), n in sorted(self.exceptions.items())]
+            lines.append("# TYPE crawler_response_bytes_total counter")
+            lines += [f'crawler_response_bytes_total{{endpoint="{escape(e)}"}} {n}' for e, n in sorted(self.bytes.items())]
+            lines.append("# TYPE crawler_in_flight_requests gauge")
+            lines.append(f"crawler_in_flight_requests {self.in_flight}")
+            lines.append("# TYPE crawler_in_flight_requests_max gauge")
+            lines.append(f"crawler_in_flight_requests_max {self.max_in_flight}")
+            lines.append("# TYPE crawler_hosts_total gauge")
+            lines.append(f"crawler_hosts_total {self.total_hosts}")
+            lines.append("# TYPE crawler_hosts_done_total counter")
+            lines.append(f"crawler_hosts_done_total {self.hosts_done}")
+            lines.append("# TYPE crawler_hosts_failed_total counter")
+            lines.append(f"crawler_hosts_failed_total {self.hosts_failed}")
+            lines.append("# TYPE crawler_eta_seconds gauge")
+            lines.append(f"crawler_eta_seconds {eta if eta is not None else 'NaN'}")
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """Writes the JSON and Prometheus snapshot files (those with a path)."""
+        for path, content in [(self.json_path, lambda: json.dumps(self.snapshot(), indent=1)),
+                              (self.prometheus_path, self.to_prometheus)]:
+            if path:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(content())
+                os.replace(tmp_path, path)
+
+    def maybe_write(self):
+        """Writes the snapshots and prints the progress at most every snapshot_interval seconds."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_snapshot < self.snapshot_interval:
+                return
+            self._last_snapshot = now
+        self.write()
+        if self.progress:
+            print(self.progress_line())
+
+    def progress_line(self):
+        eta = self.eta()
+        eta = "?" if eta is None else time.strftime("%H:%M:%S", time.gmtime(eta))
+        return (f"[telemetry] {self.hosts_done}/{self.total_hosts or '?'} hosts, {self.hosts_failed} failed, "
+                f"{self.in_flight} requests in flight, ETA {eta}")
+
+    ######################################################
+    ###################### Summary #######################
+    ######################################################
+
+    def summary(self, n_slowest_hosts=5):
+        snapshot = self.snapshot()
+        lines = [f"Crawled {snapshot['hosts']['done']} hosts ({snapshot['hosts']['failed']} failed) "
+                 f"in {snapshot['elapsed_s']:.1f}s, up to {snapshot['max_in_flight']} requests in flight",
+                 f"{'endpoint':<34}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'MB':>8}  statuses / exceptions"]
+        for endpoint, stats in sorted(snapshot["endpoints"].items()):
+            errors = ", ".join([f"{code}: {n}" for code, n in sorted(stats["statuses"].items())] +
+                               [f"{name}: {n}" for name, n in sorted(stats["exceptions"].items())])
+            lines.append(f"{endpoint:<34}{stats['count']:>9}{1000 * stats['p50']:>9.1f}{1000 * stats['p95']:>9.1f}"
+                         f"{1000 * stats['p99']:>9.1f}{1000 * stats['max']:>9.1f}{stats['bytes'] / 2**20:>8.2f}  {errors}")
+        slowest = sorted(snapshot["hosts_latency"].items(), key=lambda item: -item[1]["sum"])[:n_slowest_hosts]
+        if slowest:
+            lines.append("Slowest hosts (total request time): " +
+                         ", ".join(f"{host} {stats['sum']:.2f}s" for host, stats in slowest))
+        return "\n".join(lines)
+
+    def print_summary(self, n_slowest_hosts=5):
+        print(self.summary(n_slowest_hosts))